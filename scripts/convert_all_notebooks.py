@@ -1,45 +1,234 @@
 #!/usr/bin/env python3
+import io
+import multiprocessing
 import os
 import sys
+import signal
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import redirect_stdout
 from pathlib import Path
 import argparse
 import time
-from typing import List, Dict
-
-# Import the convert_notebook function from the notebook_split_convert module
-from notebook_convert import convert_notebook
-
-# Define folders to exclude from notebook search
-EXCLUDED_FOLDERS = ["/tests/"]
-
-def should_exclude(path: str) -> bool:
-    """Check if a path should be excluded based on the exclusion patterns."""
-    for excluded in EXCLUDED_FOLDERS:
-        if excluded in path:
-            return True
-    return False
-
-def find_notebooks(directory: Path) -> List[Path]:
-    """Find all Jupyter notebook files recursively in a directory."""
-    notebooks = []
-    for root, _, files in os.walk(directory):
-        # Skip directories matching exclusion patterns
-        if should_exclude(str(root)):
-            continue
-        for file in files:
-            if file.endswith('.ipynb') and not file.startswith('.'):
-                notebooks.append(Path(root) / file)
-    return notebooks
-
-def convert_all_notebooks(root_dir: Path) -> Dict:
-    """Convert all notebooks in the directory to markdown files."""
+from typing import List, Dict, Iterable, Optional
+
+from notebook_assets import HASH_ALGORITHMS, publish_assets, set_hash_algorithm, unpublish_assets
+from notebook_discovery import find_notebooks, set_discovery_options
+from notebook_images import DEFAULT_SVG_SETTINGS, SUPPORTED_IMAGE_FORMATS, set_image_formats, set_svg_settings
+from notebook_loader import set_validate_notebooks
+from notebook_manifest import (
+    BuildManifest, PageCache, build_key, collect_assets, converter_fingerprint, hash_file, prune_outputs
+)
+from notebook_profile import PROFILE_FORMATS, profile, profile_path, stage, stage_times_since
+from notebook_render import ENGINES, set_engine
+from notebook_report import write_report
+from notebook_weight import DEFAULT_BUDGETS, check_budgets, weigh_notebook
+
+# Location of the Jinja bytecode cache, relative to the documentation root
+JINJA_CACHE_PATH = Path("_intermediate") / "jinja-cache"
+
+# Number of notebooks listed as the slowest, and pages as the heaviest, in the summary
+SLOWEST_NOTEBOOKS = 5
+HEAVIEST_PAGES = 5
+
+def apply_options(options: Dict):
+    """Apply conversion options in the current (possibly worker) process."""
+    set_engine(options.get("engine", "nbconvert"))
+    set_hash_algorithm(options.get("hash_algorithm", "md5"))
+    set_validate_notebooks(options.get("validate", False))
+    set_image_formats(options.get("image_formats", []))
+    set_svg_settings(options.get("svg"))
+
+def add_option_arguments(parser: argparse.ArgumentParser):
+    """Add the command line arguments of the conversion options to a parser."""
+    parser.add_argument("--engine", choices=ENGINES, default="nbconvert", help="Page renderer: nbconvert's exporter or the direct MDX renderer (default: %(default)s)")
+    parser.add_argument("--hash", choices=HASH_ALGORITHMS, default="md5", help="Hash used to name extracted assets (default: md5)")
+    parser.add_argument("--validate", action="store_true", help="Validate every notebook against the nbformat schema")
+    parser.add_argument("--optimize-images", action="store_true", help="Recompress PNG outputs and add smaller WebP/AVIF variants (requires Pillow)")
+    parser.add_argument("--image-formats", nargs="+", choices=SUPPORTED_IMAGE_FORMATS, default=SUPPORTED_IMAGE_FORMATS, help="Variant formats for --optimize-images, in order of preference (default: avif webp)")
+    parser.add_argument("--optimize-svg", action="store_true", help="Minify SVG outputs and rasterize very large ones (rasterizing requires cairosvg)")
+    parser.add_argument("--svg-precision", type=int, default=DEFAULT_SVG_SETTINGS["precision"], help="Decimal places kept in SVG coordinates (default: %(default)s)")
+    parser.add_argument("--svg-max-bytes", type=int, default=DEFAULT_SVG_SETTINGS["max_bytes"], help="Rasterize minified SVGs larger than this (default: %(default)s)")
+    parser.add_argument("--svg-max-elements", type=int, default=DEFAULT_SVG_SETTINGS["max_elements"], help="Rasterize SVGs with more elements than this (default: %(default)s)")
+
+def options_from_args(args: argparse.Namespace) -> Dict:
+    """Build the conversion options (see `apply_options()`) from parsed arguments."""
+    return {
+        "engine": args.engine,
+        "hash_algorithm": args.hash,
+        "validate": args.validate,
+        "image_formats": args.image_formats if args.optimize_images else [],
+        "svg": {
+            "precision": args.svg_precision,
+            "max_bytes": args.svg_max_bytes,
+            "max_elements": args.svg_max_elements,
+        } if args.optimize_svg else None,
+    }
+
+def parse_options(argv: List[str]) -> Dict:
+    """Parse conversion options given as command line arguments, e.g. `["--optimize-svg"]`."""
+    parser = argparse.ArgumentParser(prog="options")
+    add_option_arguments(parser)
+    return options_from_args(parser.parse_args(argv))
+
+def _raise_timeout(signum, frame):
+    raise TimeoutError("conversion timed out")
+
+def convert_one_notebook(
+    notebook_path: Path,
+    root_dir: Path,
+    timeout: Optional[float] = None,
+    capture: bool = False,
+    jinja_cache: bool = False,
+    options: Optional[Dict] = None,
+    page_cache: Optional[PageCache] = None,
+    profile_dir: Optional[Path] = None,
+    profile_format: str = "cprofile"
+) -> Dict:
+    """Convert a single notebook, optionally with a timeout and captured output.
+
+    This runs inside worker processes, so it never raises. Returns a dict with
+    the output paths and asset paths (None on failure), the captured log, the
+    error message if any, the updated page cache, the number of files written
+    and left unchanged, the duration, the time spent in each stage (see
+    `notebook_profile`) and the size in bytes of the notebook, its pages and
+    their assets. With `profile_dir`, a profile of the conversion is written
+    there in `profile_format`.
+    """
+    from notebook_profile import STAGE_TIMES
+    from notebook_utils import WRITE_STATS
+
+    log = io.StringIO()
+    writes_before = dict(WRITE_STATS)
+    stages_before = dict(STAGE_TIMES)
+    start = time.perf_counter()
+    result = {"output_paths": None, "asset_paths": None, "error": None, "page_cache": None}
+    if profile_dir is not None:
+        profile_file = profile_path(profile_dir, root_dir, notebook_path, profile_format)
+    else:
+        profile_file = None
+    if timeout:
+        signal.signal(signal.SIGALRM, _raise_timeout)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        # Imported lazily so that a no-op rebuild does not pay for loading nbconvert
+        with stage("setup"):
+            from notebook_convert import convert_notebook, set_bytecode_cache_dir
+
+        if jinja_cache:
+            set_bytecode_cache_dir(root_dir / JINJA_CACHE_PATH)
+        apply_options(options or {})
+        with profile(profile_file, profile_format):
+            if capture:
+                with redirect_stdout(log):
+                    output_paths = convert_notebook(notebook_path, notebook_path.parent, root_dir, page_cache)
+            else:
+                output_paths = convert_notebook(notebook_path, notebook_path.parent, root_dir, page_cache)
+        asset_paths = collect_assets(output_paths, root_dir / "_intermediate" / "static" / "img")
+        result.update(output_paths=output_paths, asset_paths=asset_paths, page_cache=page_cache)
+    except TimeoutError:
+        result["error"] = f"Timed out after {timeout} seconds"
+    except Exception as e:
+        result["error"] = str(e)
+    finally:
+        if timeout:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+    result["log"] = log.getvalue()
+    result["writes"] = {k: WRITE_STATS[k] - writes_before[k] for k in WRITE_STATS}
+    result["duration"] = time.perf_counter() - start
+    result["stages"] = stage_times_since(stages_before)
+    result["bytes"] = {
+        "notebook": _total_size([notebook_path]),
+        "mdx": _total_size(result["output_paths"] or []),
+        "assets": _total_size(result["asset_paths"] or []),
+    }
+    return result
+
+def _total_size(paths: List[Path]) -> int:
+    total = 0
+    for path in paths:
+        try:
+            total += path.stat().st_size
+        except FileNotFoundError:
+            pass
+    return total
+
+def _notebook_record(
+    path: str,
+    status: str,
+    duration: float = 0.0,
+    notebook_bytes: int = 0,
+    output_sizes: Optional[Dict[Path, int]] = None,
+    asset_sizes: Optional[Dict[Path, int]] = None,
+    previous_assets: Iterable[Path] = (),
+    stages: Optional[Dict[str, float]] = None,
+    error: Optional[str] = None
+) -> Dict:
+    """Describe the conversion of a notebook for the summary and `notebook_report`."""
+    output_sizes, asset_sizes = output_sizes or {}, asset_sizes or {}
+    previous_assets = set(previous_assets)
+    new_assets = [size for p, size in asset_sizes.items() if p not in previous_assets]
+    reused_assets = [size for p, size in asset_sizes.items() if p in previous_assets]
+    return {
+        "path": path,
+        "status": status,
+        "duration": duration,
+        "pages": len(output_sizes),
+        "notebook_bytes": notebook_bytes,
+        "mdx_bytes": sum(output_sizes.values()),
+        "new_assets": len(new_assets),
+        "new_asset_bytes": sum(new_assets),
+        "reused_assets": len(reused_assets),
+        "reused_asset_bytes": sum(reused_assets),
+        "stages": stages or {},
+        "error": error,
+    }
+
+def convert_all_notebooks(
+    root_dir: Path,
+    force: bool = False,
+    jobs: Optional[int] = None,
+    timeout: Optional[float] = None,
+    jinja_cache: bool = False,
+    options: Optional[Dict] = None,
+    publish: bool = True,
+    profile_dir: Optional[Path] = None,
+    profile_format: str = "cprofile",
+    budgets: Optional[Dict[str, int]] = None
+) -> Dict:
+    """Convert all notebooks in the directory to markdown files.
+
+    Notebooks whose content, converter and outputs are unchanged since the last
+    run (according to the build manifest) are skipped unless `force` is set.
+    With `jobs` > 1, notebooks are converted in a process pool, largest first,
+    and their logs are printed in discovery order. `jinja_cache` enables the
+    on-disk Jinja bytecode cache under `_intermediate/`. `options` (see
+    `apply_options()`) affect the output and are part of the manifest key.
+
+    With `publish`, the assets of each converted notebook are published to
+    `static/img/notebooks` as soon as it is done, and assets that no notebook
+    uses any more are unpublished at the end. Skipped notebooks were published
+    by an earlier run, so only the manifest's assets are touched, never the
+    whole tree (all of them if `static/img/notebooks` does not exist yet).
+
+    The returned stats include a record of each notebook (see
+    `_notebook_record()`) with its status, duration, stage times, pages and
+    byte counts, and the totals of the stage times and byte counts of the
+    converted notebooks in `stages` and `bytes`. With `profile_dir`, a profile of each
+    conversion is written there (see `notebook_profile.profile()`).
+
+    With `budgets` (see `notebook_weight.DEFAULT_BUDGETS`), the pages of all
+    notebooks are weighed after the build. The warnings for pages and
+    notebooks over budget are returned in `over_budget`, and the heaviest
+    pages in `heaviest_pages`.
+    """
+    options = options or {}
     notebooks = find_notebooks(root_dir)
     
     start_time = time.time()
     if not notebooks:
         print(f"No notebooks found in {root_dir}")
         elapsed_time = time.time() - start_time
-        return {"total": 0, "success": 0, "failed": 0, "files_created": 0, "elapsed_time": elapsed_time }
+        return {"total": 0, "success": 0, "failed": 0, "skipped": 0, "files_created": 0, "files_written": 0, "files_unchanged": 0, "pruned": 0, "published": 0, "unpublished": 0, "notebooks": [], "stages": {}, "bytes": {}, "over_budget": [], "heaviest_pages": [], "elapsed_time": elapsed_time }
     
     print(f"Found {len(notebooks)} notebooks to convert")
     
@@ -47,58 +236,379 @@ def convert_all_notebooks(root_dir: Path) -> Dict:
         "total": len(notebooks),
         "success": 0,
         "failed": 0,
-        "files_created": 0
+        "skipped": 0,
+        "files_created": 0,
+        "files_written": 0,
+        "files_unchanged": 0,
+        "pruned": 0,
+        "published": 0,
+        "unpublished": 0,
+        "notebooks": [],
+        "stages": {},
+        "bytes": {"notebook": 0, "mdx": 0, "assets": 0},
+        "over_budget": [],
+        "heaviest_pages": []
     }
     
+    manifest = BuildManifest.load(root_dir)
+    fingerprint = converter_fingerprint()
+    # Page hashes are only valid for the same converter and options
+    salt = build_key("", fingerprint, options)
+    static_dir = root_dir / "_intermediate" / "static" / "img"
+    publish_dir = root_dir / "static" / "img"
+    assets_before = manifest.all_assets()
+    # Assets of notebooks that failed, whose previous pages are still in place
+    assets_kept = set()
+    if publish and not (publish_dir / "notebooks").exists():
+        # Nothing was published yet, including the assets of notebooks that will be skipped
+        stats["published"] += publish_assets([p for p in assets_before if p.exists()], static_dir, publish_dir)
     
+    # Outputs of notebooks that were deleted or moved since the last run
+    stats["pruned"] += prune_outputs(manifest.remove_missing(notebooks))
+    
+    # Notebooks that need converting: (index, path, cache key)
+    pending = []
     for i, notebook_path in enumerate(notebooks, 1):
-        print(f"\n[{i}/{len(notebooks)}] Converting {notebook_path.relative_to(root_dir)}...")
-        
-        try:
-            notebook_dir = notebook_path.parent
-            output_paths = convert_notebook(notebook_path, notebook_dir, root_dir)
-            
-            stats["success"] += 1
-            stats["files_created"] += len(output_paths)
-            
-            print(f"  ✓ Created {len(output_paths)} files")
-        except Exception as e:
+        key = build_key(hash_file(notebook_path), fingerprint, options)
+        if not force and manifest.is_fresh(notebook_path, key):
+            stats["skipped"] += 1
+            assets = manifest.asset_sizes(notebook_path)
+            stats["notebooks"].append(_notebook_record(
+                str(notebook_path.relative_to(root_dir)), "skipped",
+                notebook_bytes=notebook_path.stat().st_size,
+                output_sizes=manifest.output_sizes(notebook_path),
+                asset_sizes=assets,
+                previous_assets=assets
+            ))
+        else:
+            pending.append((i, notebook_path, key))
+    
+    def header(i, notebook_path):
+        return f"\n[{i}/{len(notebooks)}] Converting {notebook_path.relative_to(root_dir)}..."
+    
+    def page_cache_for(notebook_path):
+        return PageCache(salt, {} if force else manifest.page_hashes(notebook_path))
+    
+    def finish(notebook_path, key, result):
+        output_paths, error = result["output_paths"], result["error"]
+        stats["files_written"] += result["writes"]["written"]
+        stats["files_unchanged"] += result["writes"]["unchanged"]
+        for name, seconds in result["stages"].items():
+            stats["stages"][name] = stats["stages"].get(name, 0.0) + seconds
+        for kind, size in result["bytes"].items():
+            stats["bytes"][kind] += size
+        previous_assets = manifest.assets(notebook_path)
+        record = dict(
+            duration=result["duration"],
+            notebook_bytes=result["bytes"]["notebook"],
+            stages=result["stages"],
+            error=error
+        )
+        if error is not None:
+            stats["notebooks"].append(_notebook_record(str(notebook_path.relative_to(root_dir)), "failed", **record))
+            assets_kept.update(previous_assets)
+            manifest.forget(notebook_path)
             stats["failed"] += 1
-            print(f"  ✗ Failed: {str(e)}")
+            print(f"  ✗ Failed: {error}")
+            return
+        
+        asset_paths = result["asset_paths"]
+        stale_outputs = manifest.record(
+            notebook_path, key, output_paths, asset_paths, result["page_cache"].hashes
+        )
+        stats["pruned"] += prune_outputs(stale_outputs)
+        stats["notebooks"].append(_notebook_record(
+            str(notebook_path.relative_to(root_dir)), "converted",
+            output_sizes=manifest.output_sizes(notebook_path),
+            asset_sizes=manifest.asset_sizes(notebook_path),
+            previous_assets=previous_assets,
+            **record
+        ))
+        if publish:
+            stats["published"] += publish_assets([p for p in asset_paths if p.exists()], static_dir, publish_dir)
+        
+        stats["success"] += 1
+        stats["files_created"] += len(output_paths)
+        
+        print(f"  ✓ Created {len(output_paths)} files")
+    
+    jobs = jobs or os.cpu_count() or 1
+    if jobs == 1 or len(pending) <= 1:
+        for i, notebook_path, key in pending:
+            print(header(i, notebook_path))
+            finish(notebook_path, key, convert_one_notebook(
+                notebook_path, root_dir, timeout,
+                jinja_cache=jinja_cache, options=options, page_cache=page_cache_for(notebook_path),
+                profile_dir=profile_dir, profile_format=profile_format
+            ))
+    else:
+        # Submit the largest notebooks first so they do not end up as stragglers
+        by_size = sorted(pending, key=lambda item: item[1].stat().st_size, reverse=True)
+        results = {}
+        next_to_print = 0
+        # Forking this process is unsafe while threads (e.g. the asset writers
+        # of `notebook_assets`) hold locks, so workers are forked from a
+        # single-threaded server that has already imported the converter
+        context = multiprocessing.get_context("forkserver")
+        context.set_forkserver_preload(["notebook_convert"])
+        with ProcessPoolExecutor(max_workers=min(jobs, len(pending)), mp_context=context) as pool:
+            futures = {
+                pool.submit(
+                    convert_one_notebook, notebook_path, root_dir, timeout, True, jinja_cache, options,
+                    page_cache_for(notebook_path), profile_dir, profile_format
+                ): i
+                for i, notebook_path, _ in by_size
+            }
+            for future in as_completed(futures):
+                try:
+                    results[futures[future]] = future.result()
+                except Exception as e:
+                    # The worker process died (e.g. out of memory)
+                    results[futures[future]] = {
+                        "output_paths": None, "asset_paths": None, "error": str(e), "page_cache": None, "log": "",
+                        "writes": {"written": 0, "unchanged": 0}, "duration": 0.0, "stages": {},
+                        "bytes": {"notebook": 0, "mdx": 0, "assets": 0}
+                    }
+                
+                # Print logs in discovery order as soon as they are complete
+                while next_to_print < len(pending) and pending[next_to_print][0] in results:
+                    i, notebook_path, key = pending[next_to_print]
+                    result = results.pop(i)
+                    print(header(i, notebook_path))
+                    print(result["log"], end="")
+                    finish(notebook_path, key, result)
+                    next_to_print += 1
+    
+    manifest.save()
+    stats["notebooks"].sort(key=lambda record: record["path"])
+    if budgets is not None:
+        # Asset sizes, shared by notebooks that use the same assets
+        sizes = {}
+        pages = []
+        for notebook_path in notebooks:
+            weight = weigh_notebook(manifest.outputs(notebook_path), static_dir, sizes)
+            stats["over_budget"] += check_budgets(str(notebook_path.relative_to(root_dir)), weight, budgets)
+            pages += [(str(Path(page["page"]).relative_to(root_dir)), page["total"]) for page in weight["pages"]]
+        stats["heaviest_pages"] = sorted(pages, key=lambda page: page[1], reverse=True)[:HEAVIEST_PAGES]
+    if publish:
+        unused_assets = set(assets_before) - set(manifest.all_assets()) - assets_kept
+        stats["unpublished"] += unpublish_assets(sorted(unused_assets), static_dir, publish_dir)
     
     elapsed_time = time.time() - start_time
     
     return {**stats, "elapsed_time": elapsed_time}
 
+def watch_notebooks(
+    root_dir: Path,
+    interval: float = 0.1,
+    debounce: float = 0.2,
+    rescan: float = 2.0,
+    jinja_cache: bool = False,
+    options: Optional[Dict] = None
+):
+    """Watch the notebooks under `root_dir` and reconvert them as they are saved.
+
+    Notebooks are polled every `interval` seconds and converted once they have
+    not changed for `debounce` seconds. Conversion runs in this process, so
+    nbconvert and the exporter stay loaded, and only pages whose sections
+    changed are rewritten. New assets are published to `static/img/notebooks`
+    right away. The directory tree is searched for new notebooks every
+    `rescan` seconds.
+    """
+    from notebook_assets import publish_assets
+    from notebook_convert import convert_notebook, get_exporter, set_bytecode_cache_dir
+
+    options = options or {}
+    if jinja_cache:
+        set_bytecode_cache_dir(root_dir / JINJA_CACHE_PATH)
+    apply_options(options)
+    # Compile the template now rather than on the first save
+    get_exporter().template
+
+    manifest = BuildManifest.load(root_dir)
+    fingerprint = converter_fingerprint()
+    salt = build_key("", fingerprint, options)
+    static_dir = root_dir / "_intermediate" / "static" / "img"
+    page_caches: Dict[Path, PageCache] = {}
+
+    def snapshot(paths):
+        mtimes = {}
+        for path in paths:
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                continue
+            mtimes[path] = (st.st_mtime_ns, st.st_size)
+        return mtimes
+
+    def convert(notebook_path):
+        start = time.perf_counter()
+        key = build_key(hash_file(notebook_path), fingerprint, options)
+        if manifest.is_fresh(notebook_path, key):
+            return
+        if notebook_path not in page_caches:
+            page_caches[notebook_path] = PageCache(salt, manifest.page_hashes(notebook_path))
+        try:
+            output_paths = convert_notebook(
+                notebook_path, notebook_path.parent, root_dir, page_caches[notebook_path]
+            )
+        except Exception as e:
+            manifest.forget(notebook_path)
+            # Its pages may be recorded as fresh although their assets were not written
+            page_caches.pop(notebook_path, None)
+            print(f"  ✗ Failed: {str(e)}")
+            return
+        asset_paths = collect_assets(output_paths, static_dir)
+        prune_outputs(manifest.record(
+            notebook_path, key, output_paths, asset_paths, page_caches[notebook_path].hashes
+        ))
+        manifest.save()
+        published = publish_assets(asset_paths, static_dir, root_dir / "static" / "img")
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        print(f"  ✓ Converted {notebook_path.relative_to(root_dir)} in {elapsed_ms:.0f} ms ({published} new assets)")
+
+    notebooks = find_notebooks(root_dir)
+    # Catch up on notebooks that changed while nothing was watching
+    for notebook_path in notebooks:
+        convert(notebook_path)
+    last_seen = snapshot(notebooks)
+    last_scan = time.monotonic()
+    changed: Dict[Path, float] = {}
+    print(f"Watching {len(notebooks)} notebooks for changes. Press Ctrl+C to stop.")
+
+    try:
+        while True:
+            time.sleep(interval)
+            now = time.monotonic()
+            if now - last_scan >= rescan:
+                notebooks = find_notebooks(root_dir)
+                last_scan = now
+
+            current = snapshot(notebooks)
+            for path, stamp in current.items():
+                if last_seen.get(path) != stamp:
+                    # Restart the debounce window on every write
+                    changed[path] = now
+            last_seen = current
+
+            for path, changed_at in list(changed.items()):
+                if now - changed_at >= debounce:
+                    del changed[path]
+                    if path in current:
+                        print(f"\nChanged: {path.relative_to(root_dir)}")
+                        convert(path)
+    except KeyboardInterrupt:
+        print("\nStopped watching.")
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Convert all Jupyter notebooks in a directory to markdown files")
     parser.add_argument("root_dir", type=Path, help="Root directory of the documentation project")
     parser.add_argument("--dry-run", action="store_true", help="Only find notebooks without converting them")
+    parser.add_argument("--include", action="append", metavar="GLOB", help="Only convert notebooks matching this glob (repeatable, default: *.ipynb)")
+    parser.add_argument("--exclude", action="append", metavar="GLOB", help="Skip files and directories matching this glob, in addition to tests, node_modules, /build, _intermediate and hidden ones (repeatable)")
+    parser.add_argument("--no-git", action="store_true", help="Walk the directory tree instead of listing notebooks with git ls-files")
+    parser.add_argument("--force", action="store_true", help="Reconvert all notebooks, ignoring the build manifest")
+    parser.add_argument("--jobs", "-j", type=int, default=os.cpu_count(), help="Number of notebooks to convert in parallel (default: CPU count)")
+    parser.add_argument("--timeout", type=float, default=None, help="Abort a notebook's conversion after this many seconds")
+    parser.add_argument("--no-jinja-cache", action="store_true", help="Do not use the on-disk Jinja bytecode cache")
+    parser.add_argument("--watch", action="store_true", help="Keep running and reconvert notebooks as they are saved")
+    parser.add_argument("--no-publish", action="store_true", help="Do not publish extracted assets to static/img/notebooks")
+    add_option_arguments(parser)
+    parser.add_argument("--page-budget", type=int, default=DEFAULT_BUDGETS["page"], help="Warn about pages heavier than this many bytes, including their assets (default: %(default)s, 0 to disable)")
+    parser.add_argument("--notebook-budget", type=int, default=DEFAULT_BUDGETS["notebook"], help="Warn about notebooks whose pages weigh more than this many bytes (default: %(default)s, 0 to disable)")
+    parser.add_argument("--strict-budgets", action="store_true", help="Fail if a page or notebook is over budget")
+    parser.add_argument("--report", type=Path, metavar="PATH", help="Write a record of each notebook and the totals to this NDJSON file")
+    parser.add_argument("--profile", type=Path, metavar="DIR", help="Write a profile of each notebook's conversion to this directory")
+    parser.add_argument("--profile-format", choices=PROFILE_FORMATS, default="cprofile", help="cProfile dumps or Chrome trace events of the stage timers (default: %(default)s)")
     
     args = parser.parse_args()
+    options = options_from_args(args)
+    try:
+        # Applied again by each conversion; checks the options and that the
+        # packages they need are installed once instead of in every worker
+        set_hash_algorithm(options["hash_algorithm"])
+        set_image_formats(options["image_formats"])
+        set_svg_settings(options["svg"])
+    except (RuntimeError, ValueError) as e:
+        parser.error(str(e))
     
     if not args.root_dir.exists() or not args.root_dir.is_dir():
         print(f"Error: {args.root_dir} is not a valid directory")
         sys.exit(1)
     
     print(f"Documentation root directory: {args.root_dir}")
+    set_discovery_options(args.include, args.exclude, use_git=not args.no_git)
     
     if args.dry_run:
+        start = time.perf_counter()
         notebooks = find_notebooks(args.root_dir)
-        print(f"Found {len(notebooks)} notebooks:")
+        print(f"Found {len(notebooks)} notebooks in {(time.perf_counter() - start) * 1000:.0f} ms:")
         for nb in notebooks:
             print(f"  - {nb.relative_to(args.root_dir)}")
         sys.exit(0)
     
-    stats = convert_all_notebooks(args.root_dir)
+    if args.watch:
+        watch_notebooks(
+            args.root_dir,
+            jinja_cache=not args.no_jinja_cache,
+            options=options
+        )
+        sys.exit(0)
+    
+    stats = convert_all_notebooks(
+        args.root_dir,
+        force=args.force,
+        jobs=args.jobs,
+        timeout=args.timeout,
+        jinja_cache=not args.no_jinja_cache,
+        options=options,
+        publish=not args.no_publish,
+        profile_dir=args.profile,
+        profile_format=args.profile_format,
+        budgets={"page": args.page_budget, "notebook": args.notebook_budget}
+    )
     
     print("\n" + "="*60)
     print(f"Conversion completed in {stats['elapsed_time']:.2f} seconds")
     print(f"Total notebooks: {stats['total']}")
     print(f"Successfully converted: {stats['success']}")
+    print(f"Skipped (up to date): {stats['skipped']}")
     print(f"Failed: {stats['failed']}")
     print(f"Total markdown files created: {stats['files_created']}")
+    print(f"Files written: {stats['files_written']} (unchanged: {stats['files_unchanged']})")
+    print(f"Stale files removed: {stats['pruned']}")
+    print(f"Assets published: {stats['published']} (unpublished: {stats['unpublished']})")
+    if stats["stages"]:
+        sizes = stats["bytes"]
+        print(f"Bytes: {sizes['notebook'] / 1e6:.1f} MB of notebooks, {sizes['mdx'] / 1e6:.1f} MB of MDX, {sizes['assets'] / 1e6:.1f} MB of assets")
+        print("Time per stage:")
+        for name, seconds in sorted(stats["stages"].items(), key=lambda item: item[1], reverse=True):
+            print(f"  {name:<12} {seconds:8.2f} s")
+        print("Slowest notebooks:")
+        for record in sorted(stats["notebooks"], key=lambda r: r["duration"], reverse=True)[:SLOWEST_NOTEBOOKS]:
+            if record["status"] == "skipped":
+                break
+            slowest_stage = max(record["stages"], key=record["stages"].get, default="-")
+            asset_bytes = record["new_asset_bytes"] + record["reused_asset_bytes"]
+            print(
+                f"  {record['duration']:8.2f} s  {record['path']} (mostly {slowest_stage}; "
+                f"{record['notebook_bytes'] / 1e6:.1f} MB in, {record['mdx_bytes'] / 1e6:.1f} MB MDX, "
+                f"{asset_bytes / 1e6:.1f} MB assets)"
+            )
+    if stats["heaviest_pages"]:
+        print("Heaviest pages:")
+        for page, total in stats["heaviest_pages"]:
+            print(f"  {total / 1e6:8.2f} MB  {page}")
+    if stats["over_budget"]:
+        print(f"Over budget: {len(stats['over_budget'])}")
+        for warning in stats["over_budget"]:
+            print(f"  ⚠ {warning}")
+    if args.profile:
+        print(f"Profiles written to {args.profile}")
+    if args.report:
+        write_report(args.report, stats)
+        print(f"Report written to {args.report}")
     print("="*60)
     
-    if stats['failed'] > 0:
+    if stats['failed'] > 0 or (args.strict_budgets and stats["over_budget"]):
         sys.exit(1)
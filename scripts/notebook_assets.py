@@ -0,0 +1,680 @@
+import base64
+import binascii
+import fcntl
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from notebook_utils import FILE_MODE
+
+# Number of base64 characters decoded at a time. Must be a multiple of 4.
+CHUNK_CHARS = 1 << 20
+
+# Length of the content hash used in asset file names
+HASH_LENGTH = 12
+
+# Hash used to name assets. See `set_hash_algorithm()`.
+HASH_ALGORITHMS = ["md5", "blake2b", "blake3"]
+HASH_ALGORITHM = "md5"
+
+# Base64 payloads up to this many characters are decoded in memory; larger
+# ones are streamed to disk in chunks of `CHUNK_CHARS`.
+IN_MEMORY_LIMIT = 8 << 20
+
+# Threads that write blobs and link them into asset directories while the
+# conversion continues (see `AssetStore.flush()`); 0 writes synchronously. At
+# most `MAX_PENDING_WRITES` writes are queued, which bounds the memory held by
+# decoded assets waiting to be written.
+WRITE_THREADS = 4
+MAX_PENDING_WRITES = 32
+
+# Directory inside the notebooks asset directory that holds the shared store.
+# It is excluded when assets are copied to the static directory.
+STORE_DIR_NAME = ".store"
+
+# Temporary files (`.<name>.tmp`, `.blob.*`) are being written by another
+# conversion or encoder unless they are older than this many seconds, after
+# which `AssetStore.gc()` deletes them as leftovers of an interrupted run
+TEMP_FILE_GRACE = 3600
+
+# Directory in the store that maps render keys (e.g. a hash of animation
+# parameters) to the blob rendered for them
+RENDERS_DIR_NAME = "renders"
+
+# MIME type of outputs that refer to an asset already in the store, e.g. videos
+# written by `utils.show_animation_video_base64()`. The value is
+# `{"blob": <blob name>, "src": <URL of the asset in the text/html output>}`;
+# the converter links the blob and replaces the URL. The store is not committed,
+# so outputs may also embed the asset as base64 under the MIME type given by an
+# optional `"fallback"` key, which is decoded where the blob is missing (e.g.
+# in a fresh checkout).
+ASSET_REFERENCE_MIME = "application/vnd.notebook-asset+json"
+
+# ioctl request that makes a file share the extents of another (Linux reflink)
+FICLONE = 0x40049409
+
+_NON_BASE64 = re.compile(r"[^A-Za-z0-9+/=]")
+
+
+def _iter_base64_chunks(text: str, start: int, end: int):
+    """Decode `text[start:end]` as base64, yielding bytes chunk by chunk.
+
+    Characters outside the base64 alphabet (e.g. line breaks) are discarded like
+    `base64.b64decode` does. Only one chunk of the input is copied at a time.
+    """
+    remainder = ""
+    for pos in range(start, end, CHUNK_CHARS):
+        chunk = remainder + _NON_BASE64.sub("", text[pos:min(pos + CHUNK_CHARS, end)])
+        usable = len(chunk) - len(chunk) % 4
+        remainder = chunk[usable:]
+        if usable:
+            yield base64.b64decode(chunk[:usable])
+    if remainder:
+        # Let b64decode raise the same padding error as decoding in one go
+        yield base64.b64decode(remainder)
+
+
+def _iter_file_chunks(path: Path):
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            yield chunk
+
+
+def clone_file(src: Path, dst: Path) -> str:
+    """Create `dst` with the content of `src` as cheaply as the filesystem allows.
+
+    Tries a hardlink, then a reflink (copy-on-write clone, e.g. on Btrfs or XFS),
+    then falls back to copying. Returns the method used.
+    """
+    try:
+        os.link(src, dst)
+        return "hardlink"
+    except OSError:
+        pass
+    with open(src, "rb") as src_file, open(dst, "wb") as dst_file:
+        try:
+            fcntl.ioctl(dst_file.fileno(), FICLONE, src_file.fileno())
+            return "reflink"
+        except OSError:
+            pass
+    shutil.copy2(src, dst)
+    return "copy"
+
+
+def parse_data_url(text: str, start: int = 0, end: Optional[int] = None):
+    """Parse the header of a `data:<mime>;base64,` URL in `text[start:end]`.
+
+    Returns the MIME type and the offset of the payload, or None if the URL is
+    not base64-encoded. The payload itself is not copied. `text` may also be a
+    `notebook_loader.LazyText`, which is only read up to the comma.
+    """
+    comma = text.find(",", start, len(text) if end is None else end)
+    if comma < 0:
+        return None
+    header = text[start:comma]
+    if not header.startswith("data:") or not header.endswith(";base64"):
+        return None
+    return header[len("data:"):].split(";", 1)[0], comma + 1
+
+
+class AssetCollisionError(ValueError):
+    """Two different assets map to the same content-hash file name."""
+
+
+def new_hash():
+    """Create a hash object for the configured `HASH_ALGORITHM`."""
+    if HASH_ALGORITHM == "md5":
+        return hashlib.md5()
+    if HASH_ALGORITHM == "blake2b":
+        return hashlib.blake2b(digest_size=16)
+    if HASH_ALGORITHM == "blake3":
+        from blake3 import blake3
+        return blake3()
+    raise ValueError(f"Unknown hash algorithm: {HASH_ALGORITHM}")
+
+
+def set_hash_algorithm(name: str):
+    """Select the hash used to name new assets (one of `HASH_ALGORITHMS`).
+
+    MD5 is the default so existing asset names stay stable. Switching changes
+    the names of all assets; the old files are removed by `gc` once the pages
+    have been regenerated.
+    """
+    global HASH_ALGORITHM
+    if name not in HASH_ALGORITHMS:
+        raise ValueError(f"Unknown hash algorithm: {name}")
+    if name == "blake3":
+        # Fail when the option is applied, not on the first asset of a conversion
+        try:
+            import blake3  # noqa: F401
+        except ImportError:
+            raise RuntimeError("Hashing assets with blake3 requires the blake3 package") from None
+    HASH_ALGORITHM = name
+
+
+class AssetStore:
+    """Content-addressed store for assets extracted from notebooks.
+
+    Every distinct asset is stored once as a blob in `<notebooks_dir>/.store/blobs`,
+    named by its content hash. The per-notebook files that pages link to
+    (`<notebooks_dir>/<notebook_name>/<filename>`) are hardlinks to the blobs, or
+    copies where hardlinks are not supported.
+
+    The existing blobs and per-notebook files are indexed in memory the first
+    time they are needed, so assets that already exist are recognized without
+    touching the filesystem. Use `get_store()` to share one index per process.
+
+    A reference index (`.store/refs.json`) records which generated page uses
+    which per-notebook files and blobs, so `gc()` can delete the ones no page
+    uses any more. Blobs rendered while running notebooks are recorded under
+    their render key (`.store/renders`) and also kept.
+
+    Assets decoded in memory are hashed right away, so their names are known
+    and pages can be rendered, but they are written and linked by a pool of
+    `WRITE_THREADS` threads. `flush()` waits for the writes and raises the
+    first error; `blob_path()` waits for a single blob.
+    """
+
+    def __init__(self, notebooks_dir: Path):
+        self.notebooks_dir = Path(notebooks_dir)
+        self.dir = self.notebooks_dir / STORE_DIR_NAME
+        self.blobs_dir = self.dir / "blobs"
+        self.refs_path = self.dir / "refs.json"
+        self.renders_dir = self.dir / RENDERS_DIR_NAME
+        # Blob name -> (size, inode), loaded lazily. The inode is None while the blob is written.
+        self._blobs: Optional[Dict[str, Tuple[int, Optional[int]]]] = None
+        # Asset directory -> {file name: inode}, loaded lazily per directory
+        self._aliases: Dict[Path, Dict[str, int]] = {}
+        # Modification time of the blob directory at the last `mark_synced()`
+        self._synced_mtime: Optional[int] = None
+        # Writes and links in progress, by blob name and by target path
+        self._pending_blobs: Dict[str, Future] = {}
+        self._pending_links: Dict[Path, Future] = {}
+        # Blob linked to each target path since the last `flush()`, i.e. in the
+        # current conversion, so that a name is not given to two assets
+        self._claims: Dict[Path, str] = {}
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_pid: Optional[int] = None
+        self._slots = threading.BoundedSemaphore(MAX_PENDING_WRITES)
+
+    @property
+    def blobs(self) -> Dict[str, Tuple[int, int]]:
+        """Index of the blobs in the store, built with one directory scan."""
+        if self._blobs is None:
+            self.blobs_dir.mkdir(parents=True, exist_ok=True)
+            self._blobs = {
+                entry.name: (entry.stat().st_size, entry.inode())
+                for entry in os.scandir(self.blobs_dir)
+                if not entry.name.startswith(".")
+            }
+        return self._blobs
+
+    def _blobs_dir_mtime(self) -> Optional[int]:
+        try:
+            return os.stat(self.blobs_dir).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def revalidate(self):
+        """Drop the in-memory index if another process changed the store since `mark_synced()`.
+
+        For long-lived processes such as the conversion server, which keep the
+        index across conversions while builds or `gc` run next to them.
+        Per-notebook directories are always rescanned.
+        """
+        self._aliases = {}
+        if self._blobs is not None and self._blobs_dir_mtime() != self._synced_mtime:
+            self._blobs = None
+
+    def mark_synced(self):
+        """Remember the state of the blob directory, including this process' own changes."""
+        self._synced_mtime = self._blobs_dir_mtime()
+
+    def _submit(self, func, *args) -> Future:
+        """Run `func(*args)` on the writer threads, blocking while too many writes are queued."""
+        if WRITE_THREADS <= 0:
+            future = Future()
+            try:
+                future.set_result(func(*args))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+        # A pool inherited from a parent process has no threads
+        if self._executor is None or self._executor_pid != os.getpid():
+            self._executor = ThreadPoolExecutor(WRITE_THREADS, thread_name_prefix="asset-writer")
+            self._executor_pid = os.getpid()
+            self._slots = threading.BoundedSemaphore(MAX_PENDING_WRITES)
+        self._slots.acquire()
+        future = self._executor.submit(func, *args)
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def flush(self):
+        """Wait until all assets are written and linked. Raises the first write error."""
+        pending = list(self._pending_blobs.values()) + list(self._pending_links.values())
+        self._pending_blobs, self._pending_links, self._claims = {}, {}, {}
+        error = None
+        for future in pending:
+            if future.exception() is not None and error is None:
+                error = future.exception()
+        if error is not None:
+            raise error
+
+    def blob_path(self, blob: str) -> Path:
+        """Return the path of a blob once it is written."""
+        future = self._pending_blobs.get(blob)
+        if future is not None:
+            future.result()
+        return self.blobs_dir / blob
+
+    def _aliases_in(self, assets_dir: Path) -> Dict[str, int]:
+        if assets_dir not in self._aliases:
+            assets_dir.mkdir(parents=True, exist_ok=True)
+            self._aliases[assets_dir] = {
+                entry.name: entry.inode()
+                for entry in os.scandir(assets_dir)
+                if not entry.name.startswith(".")
+            }
+        return self._aliases[assets_dir]
+
+    def _lookup(self, blob: str, size: int) -> bool:
+        """Check whether a blob is already stored, detecting hash collisions by size."""
+        known = self.blobs.get(blob)
+        if known is None:
+            return False
+        if known[0] != size:
+            raise AssetCollisionError(
+                f"{self.blobs_dir / blob} has {known[0]} bytes but an asset with the same hash has {size} bytes"
+            )
+        return True
+
+    def _install(self, tmp_path: str, blob: str, size: int):
+        """Move a fully written temporary file into place as a blob."""
+        # mkstemp creates files readable only by their owner
+        os.chmod(tmp_path, FILE_MODE)
+        os.replace(tmp_path, self.blobs_dir / blob)
+        self.blobs[blob] = (size, os.stat(self.blobs_dir / blob).st_ino)
+
+    def _add_chunks(self, chunks: Iterable[bytes], ext: str) -> Optional[str]:
+        """Hash and write chunks to a temporary file, then rename it to its content hash.
+
+        Returns the blob name, or None if the chunks could not be decoded.
+        """
+        self.blobs  # make sure the blob directory exists
+        fd, tmp_path = tempfile.mkstemp(dir=self.blobs_dir, prefix=".blob.", suffix=".tmp")
+        h = new_hash()
+        size = 0
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in chunks:
+                    h.update(chunk)
+                    f.write(chunk)
+                    size += len(chunk)
+        except (binascii.Error, ValueError):
+            os.unlink(tmp_path)
+            return None
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+        blob = h.hexdigest()[:HASH_LENGTH] + "." + ext
+        try:
+            found = self._lookup(blob, size)
+        except AssetCollisionError:
+            os.unlink(tmp_path)
+            raise
+        if found:
+            os.unlink(tmp_path)
+        else:
+            self._install(tmp_path, blob, size)
+        return blob
+
+    def add_bytes(self, data: bytes, ext: str) -> str:
+        """Add raw bytes to the store and return the blob name.
+
+        Nothing is written if a blob with the same content is already indexed.
+        The data is written in the background (see `flush()`).
+        """
+        h = new_hash()
+        h.update(data)
+        blob = h.hexdigest()[:HASH_LENGTH] + "." + ext
+        if not self._lookup(blob, len(data)):
+            # Indexed now so that the same content is not written twice; the
+            # inode is filled in by `_write_blob()`
+            self._blobs[blob] = (len(data), None)
+            self._pending_blobs[blob] = self._submit(self._write_blob, data, blob)
+        return blob
+
+    def _write_blob(self, data: bytes, blob: str):
+        blobs = self._blobs
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.blobs_dir, prefix=".blob.", suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(data)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+            self._install(tmp_path, blob, len(data))
+        except BaseException:
+            # Do not let later conversions in this process assume the blob exists
+            if blobs is not None:
+                blobs.pop(blob, None)
+            raise
+
+    def add_base64(self, text: str, ext: str, start: int = 0, end: Optional[int] = None) -> Optional[str]:
+        """Decode base64 `text[start:end]` into the store and return the blob name.
+
+        Payloads up to `IN_MEMORY_LIMIT` characters are decoded in one go so that
+        known blobs are recognized without writing anything. Larger payloads are
+        decoded, hashed and written in chunks, so memory use does not grow with
+        the size of the payload. `text` may be a `notebook_loader.LazyText`, of
+        which only the payload is read. Returns None if the data is not valid base64.
+        """
+        end = len(text) if end is None else end
+        if end - start <= IN_MEMORY_LIMIT:
+            try:
+                data = base64.b64decode(text[start:end])
+            except (binascii.Error, ValueError):
+                return None
+            return self.add_bytes(data, ext)
+        return self._add_chunks(_iter_base64_chunks(text, start, end), ext)
+
+    def add_file(self, path: Path, move: bool = False) -> str:
+        """Add a file's content to the store and return the blob name.
+
+        With `move`, the file itself becomes the blob (or is deleted if the blob
+        exists already) instead of being copied; it must be on the same
+        filesystem as the store, e.g. created with `new_temp_path()`.
+        """
+        path = Path(path)
+        ext = path.suffix.lstrip(".") or "bin"
+        if not move:
+            return self._add_chunks(_iter_file_chunks(path), ext)
+        h = new_hash()
+        size = 0
+        for chunk in _iter_file_chunks(path):
+            h.update(chunk)
+            size += len(chunk)
+        blob = h.hexdigest()[:HASH_LENGTH] + "." + ext
+        if self._lookup(blob, size):
+            os.unlink(path)
+        else:
+            self._install(str(path), blob, size)
+        return blob
+
+    def new_temp_path(self, suffix: str) -> Path:
+        """Create an empty temporary file in the store that `add_file(..., move=True)` can take over."""
+        self.blobs  # make sure the blob directory exists
+        fd, tmp_path = tempfile.mkstemp(dir=self.blobs_dir, prefix=".blob.", suffix=suffix)
+        os.close(fd)
+        return Path(tmp_path)
+
+    def get_render(self, key: str) -> Optional[str]:
+        """Return the blob rendered for `key`, or None if there is none or it was deleted."""
+        try:
+            with open(self.renders_dir / f"{key}.json") as f:
+                blob = json.load(f)["blob"]
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+        return blob if blob in self.blobs else None
+
+    def put_render(self, key: str, blob: str):
+        """Record the blob rendered for `key`."""
+        self.renders_dir.mkdir(parents=True, exist_ok=True)
+        path = self.renders_dir / f"{key}.json"
+        tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump({"blob": blob}, f)
+        os.replace(tmp_path, path)
+
+    def link(self, blob: str, assets_dir: Path, name: Optional[str] = None) -> str:
+        """Make a blob available as `assets_dir/name` (defaults to the blob name).
+
+        Returns the name used: if another asset was linked to `name` since the
+        last `flush()`, e.g. an image with the same file name from another
+        directory, the blob gets its content-addressed name instead.
+        """
+        name = name or blob
+        target = assets_dir / name
+        claimed = self._claims.get(target)
+        if claimed is not None and claimed != blob:
+            return self.link(blob, assets_dir)
+        self._claims[target] = blob
+        aliases = self._aliases_in(assets_dir)
+        if target in self._pending_links:
+            return name
+        if blob not in self._pending_blobs and aliases.get(name) == self.blobs[blob][1]:
+            return name
+
+        write = self._pending_blobs.get(blob)
+        self._pending_links[target] = self._submit(self._link_file, blob, target, aliases, write)
+        print(f"saving to {target}")
+        return name
+
+    def _link_file(self, blob: str, target: Path, aliases: Dict[str, int], write: Optional[Future]):
+        if write is not None:
+            # Submitted before this link, so it has started and this cannot deadlock
+            write.result()
+        source = self.blobs_dir / blob
+        tmp_path = target.with_name(f".{target.name}.{os.getpid()}.tmp")
+        clone_file(source, tmp_path)
+        os.replace(tmp_path, target)
+        # Copies get their own inode; remember that they hold the blob for this run
+        aliases[target.name] = os.stat(source).st_ino
+
+    @contextmanager
+    def _locked_refs(self):
+        """Load the reference index under an exclusive lock and save it on exit."""
+        self.dir.mkdir(parents=True, exist_ok=True)
+        with open(self.dir / "refs.lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                with open(self.refs_path) as f:
+                    refs = json.load(f)
+            except (OSError, ValueError):
+                refs = {}
+            yield refs
+            tmp_path = self.refs_path.with_name(self.refs_path.name + ".tmp")
+            with open(tmp_path, "w") as f:
+                json.dump(refs, f, indent=1, sort_keys=True)
+            os.replace(tmp_path, self.refs_path)
+
+    def record_refs(self, page_path: Path, refs: Dict[str, str]):
+        """Record the assets used by a generated page.
+
+        `refs` maps per-notebook asset paths (`<notebook_name>/<filename>`) to
+        blob names. Pages are stored relative to the store directory so the
+        index stays valid if the checkout is moved.
+        """
+        page = os.path.relpath(page_path, self.dir)
+        with self._locked_refs() as index:
+            index[page] = dict(sorted(refs.items()))
+
+    def gc(self) -> Tuple[int, int, int]:
+        """Delete per-notebook files and blobs that no generated page references.
+
+        Returns the number of pages dropped from the index, files removed and
+        blobs removed.
+        """
+        self.flush()
+        if not self.refs_path.exists():
+            raise FileNotFoundError(
+                f"No reference index at {self.refs_path}; convert the notebooks before collecting garbage"
+            )
+
+        with self._locked_refs() as index:
+            missing_pages = [page for page in index if not (self.dir / page).exists()]
+            for page in missing_pages:
+                del index[page]
+
+            used_files = set()
+            used_blobs = set()
+            for refs in index.values():
+                used_files.update(refs)
+                used_blobs.update(refs.values())
+            if self.renders_dir.exists():
+                for path in self.renders_dir.glob("*.json"):
+                    try:
+                        used_blobs.add(json.loads(path.read_text())["blob"])
+                    except (OSError, ValueError, KeyError, TypeError):
+                        pass
+
+            removed_files = 0
+            for notebook_dir in self.notebooks_dir.iterdir():
+                if notebook_dir.name == STORE_DIR_NAME or not notebook_dir.is_dir():
+                    continue
+                for path in notebook_dir.iterdir():
+                    if _is_recent_temp_file(path):
+                        continue
+                    if path.is_file() and f"{notebook_dir.name}/{path.name}" not in used_files:
+                        path.unlink()
+                        removed_files += 1
+                if not any(notebook_dir.iterdir()):
+                    notebook_dir.rmdir()
+
+            removed_blobs = 0
+            if self.blobs_dir.exists():
+                for path in self.blobs_dir.iterdir():
+                    if path.name not in used_blobs and not _is_recent_temp_file(path):
+                        path.unlink()
+                        removed_blobs += 1
+
+            # The in-memory index no longer matches the filesystem
+            self._blobs = None
+            self._aliases = {}
+
+        return len(missing_pages), removed_files, removed_blobs
+
+
+def _is_recent_temp_file(path: Path) -> bool:
+    # A file another process may still be writing (see `TEMP_FILE_GRACE`)
+    if not path.name.startswith("."):
+        return False
+    try:
+        return time.time() - path.stat().st_mtime < TEMP_FILE_GRACE
+    except FileNotFoundError:
+        return True
+
+
+def publish_assets(asset_paths: Iterable[Path], src_dir: Path, dst_dir: Path) -> int:
+    """Publish assets from `src_dir` to the same relative paths under `dst_dir`.
+
+    Assets that are already published (hardlinks to the source, or files with
+    its size and modification time) are left alone. New or changed ones are
+    hardlinked or reflinked where possible and copied otherwise (see
+    `clone_file()`), keeping the modification time of the source. Returns the
+    number of assets published.
+    """
+    published = 0
+    for src in asset_paths:
+        src = Path(src)
+        dst = Path(dst_dir) / src.relative_to(src_dir)
+        src_stat = src.stat()
+        try:
+            dst_stat = dst.stat()
+            if (dst_stat.st_dev, dst_stat.st_ino) == (src_stat.st_dev, src_stat.st_ino) or (
+                (dst_stat.st_size, dst_stat.st_mtime_ns) == (src_stat.st_size, src_stat.st_mtime_ns)
+            ):
+                continue
+        except FileNotFoundError:
+            pass
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = dst.with_name(f".{dst.name}.{os.getpid()}.tmp")
+        if clone_file(src, tmp_path) != "hardlink":
+            os.utime(tmp_path, ns=(src_stat.st_atime_ns, src_stat.st_mtime_ns))
+        os.replace(tmp_path, dst)
+        published += 1
+    return published
+
+
+def unpublish_assets(asset_paths: Iterable[Path], src_dir: Path, dst_dir: Path) -> int:
+    """Delete the published copies of assets and the directories left empty. Returns the number deleted."""
+    removed = 0
+    for src in asset_paths:
+        dst = Path(dst_dir) / Path(src).relative_to(src_dir)
+        try:
+            dst.unlink()
+        except FileNotFoundError:
+            continue
+        removed += 1
+        try:
+            dst.parent.rmdir()
+        except OSError:
+            pass  # Not empty
+    return removed
+
+
+def sync_published(notebooks_dir: Path, published_dir: Path) -> Tuple[int, int]:
+    """Make `published_dir` mirror the per-notebook asset directories of `notebooks_dir`.
+
+    Walks both trees, so use it to repair the published assets; conversions
+    publish their own assets. Returns the number of assets published and removed.
+    """
+    notebooks_dir, published_dir = Path(notebooks_dir), Path(published_dir)
+
+    def asset_files(root: Path) -> List[Path]:
+        if not root.exists():
+            return []
+        return [
+            path
+            for notebook_dir in root.iterdir()
+            if notebook_dir.is_dir() and notebook_dir.name != STORE_DIR_NAME
+            for path in notebook_dir.iterdir()
+            if path.is_file() and not path.name.startswith(".")
+        ]
+
+    sources = asset_files(notebooks_dir)
+    wanted = {path.relative_to(notebooks_dir) for path in sources}
+    stale = [
+        notebooks_dir / path.relative_to(published_dir)
+        for path in asset_files(published_dir)
+        if path.relative_to(published_dir) not in wanted
+    ]
+    published = publish_assets(sources, notebooks_dir, published_dir)
+    return published, unpublish_assets(stale, notebooks_dir, published_dir)
+
+
+_stores: Dict[Path, AssetStore] = {}
+
+
+def get_store(notebooks_dir: Path) -> AssetStore:
+    """Return the store for `notebooks_dir`, keeping its index for the whole process."""
+    notebooks_dir = Path(notebooks_dir)
+    if notebooks_dir not in _stores:
+        _stores[notebooks_dir] = AssetStore(notebooks_dir)
+    return _stores[notebooks_dir]
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Manage assets extracted from notebooks")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    gc_parser = subparsers.add_parser("gc", help="Delete assets that no generated page references")
+    gc_parser.add_argument("root_dir", type=Path, nargs="?", default=".", help="Root directory of the project")
+    publish_parser = subparsers.add_parser("publish", help="Make static/img/notebooks mirror the extracted assets")
+    publish_parser.add_argument("root_dir", type=Path, nargs="?", default=".", help="Root directory of the project")
+
+    args = parser.parse_args()
+
+    if args.command == "gc":
+        store = AssetStore(args.root_dir / "_intermediate" / "static" / "img" / "notebooks")
+        pages, files, blobs = store.gc()
+        print(f"Dropped {pages} deleted pages from the reference index")
+        print(f"Removed {files} unreferenced files and {blobs} unreferenced blobs")
+    elif args.command == "publish":
+        published, removed = sync_published(
+            args.root_dir / "_intermediate" / "static" / "img" / "notebooks",
+            args.root_dir / "static" / "img" / "notebooks",
+        )
+        print(f"Published {published} assets and removed {removed} stale ones")
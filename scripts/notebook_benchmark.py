@@ -0,0 +1,501 @@
+import argparse
+import base64
+import copy
+import json
+import platform
+import random
+import resource
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import nbformat
+
+from convert_all_notebooks import find_notebooks
+from notebook_loader import orjson, read_notebook
+
+
+def _nbformat_read(path: Path):
+    with open(path) as f:
+        return nbformat.read(f, as_version=4)
+
+
+def time_calls(func: Callable, paths: List[Path], repeat: int) -> float:
+    """Return the best time, over `repeat` runs, to call `func` on every path."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for path in paths:
+            func(path)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def time_runs(setup: Callable, run: Callable, repeat: int) -> float:
+    """Return the best time, over `repeat` runs, of `run(setup())`, not counting `setup()`."""
+    best = float("inf")
+    for _ in range(repeat):
+        state = setup()
+        start = time.perf_counter()
+        run(state)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def benchmark_loaders(paths: List[Path], repeat: int = 5) -> Dict[str, float]:
+    """Time `nbformat.read()` against the fast loader on the given notebooks."""
+    return {
+        "nbformat.read": time_calls(_nbformat_read, paths, repeat),
+        "read_notebook": time_calls(lambda path: read_notebook(path, validate=False), paths, repeat),
+    }
+
+
+def print_results(results: Dict[str, float], total_bytes: int):
+    baseline = next(iter(results.values()))
+    for name, seconds in results.items():
+        mb_per_s = total_bytes / seconds / 1e6 if seconds else float("inf")
+        print(f"{name:<16} {seconds * 1000:9.1f} ms {mb_per_s:8.1f} MB/s {baseline / seconds:6.1f}x")
+
+
+# Synthetic notebooks
+
+def _png(rng: random.Random, size: int) -> bytes:
+    """A valid PNG of random (incompressible) pixels, about `size` bytes large."""
+    width = 256
+    rows = max(1, size // (width * 3))
+    raw = b"".join(b"\x00" + rng.randbytes(width * 3) for _ in range(rows))
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    header = struct.pack(">IIBBBBB", width, rows, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(raw, 1)) + chunk(b"IEND", b"")
+
+
+def _svg(rng: random.Random, size: int) -> str:
+    """A matplotlib-like SVG with one long path, about `size` bytes large."""
+    points = []
+    length = 0
+    while length < size:
+        point = f"L {rng.uniform(0, 400):.6f} {rng.uniform(0, 300):.6f}"
+        points.append(point)
+        length += len(point) + 1
+    return (
+        '<svg xmlns="http://www.w3.org/2000/svg" width="400pt" height="300pt" viewBox="0 0 400 300">\n'
+        f' <path d="M 0 0 {" ".join(points)}" style="fill: none; stroke: #1f77b4"/>\n'
+        "</svg>\n"
+    )
+
+
+def _video_html(rng: random.Random, size: int) -> str:
+    """HTML as written by `utils.show_animation_video_base64()`, with random video data."""
+    b64 = base64.b64encode(rng.randbytes(size)).decode()
+    return f'''
+    <video playsinline autoplay muted controls loop  class="retina">
+      <source src="data:video/mp4;base64,{b64}" type="video/mp4">
+    </video>
+    '''
+
+
+def _stream(rng: random.Random, size: int) -> str:
+    lines = []
+    length = 0
+    while length < size:
+        line = f"step {len(lines)}: loss={rng.random():.6f} accuracy={rng.random():.4f}"
+        lines.append(line)
+        length += len(line) + 1
+    return "\n".join(lines) + "\n"
+
+
+def generate_notebook(
+    cells: int = 100,
+    pagebreaks: int = 0,
+    png_bytes: int = 0,
+    svg_bytes: int = 0,
+    video_bytes: int = 0,
+    stream_bytes: int = 0,
+    hidden_ratio: float = 0.0,
+    seed: int = 0,
+) -> nbformat.NotebookNode:
+    """Generate a notebook with the given shape for benchmarking.
+
+    `cells` markdown and code cells alternate. With `pagebreaks`, the notebook
+    starts with a chapter cell and is split into that many evenly sized
+    sections. Each code cell gets one output, cycling through PNG, SVG, video
+    (base64 in HTML) and text stream outputs of the given sizes; kinds with a
+    size of 0 are left out. A `hidden_ratio` share of the code cells is hidden
+    entirely. Payloads are random, so assets are not deduplicated.
+    """
+    rng = random.Random(seed)
+    kinds = [
+        kind for kind, size in
+        [("png", png_bytes), ("svg", svg_bytes), ("video", video_bytes), ("stream", stream_bytes)]
+        if size
+    ]
+
+    nb = nbformat.v4.new_notebook()
+    nb.metadata["kernelspec"] = {"name": "python3", "display_name": "Python 3", "language": "python"}
+    if pagebreaks:
+        nb.cells.append(nbformat.v4.new_raw_cell("# !chapter\n---\nchapter-title: Synthetic notebook\n---"))
+    outputs = sections = 0
+    for i in range(cells):
+        if sections < pagebreaks and i >= sections * cells / pagebreaks:
+            sections += 1
+            nb.cells.append(nbformat.v4.new_raw_cell(
+                f"# !pagebreak\n---\ntitle: Section {sections}\nslug: section-{sections}\n---"
+            ))
+        if i % 2 == 0:
+            nb.cells.append(nbformat.v4.new_markdown_cell(
+                f"## Heading {i}\n\nSome *text* with a [link](other.ipynb) and `code`, paragraph {i}."
+            ))
+            continue
+        cell = nbformat.v4.new_code_cell(f"x = compute({i})\nplot(x)\nprint('```')")
+        if rng.random() < hidden_ratio:
+            cell.metadata.update(hide=True, hide_input=True)
+        if kinds:
+            kind = kinds[outputs % len(kinds)]
+            outputs += 1
+            if kind == "png":
+                output = nbformat.v4.new_output("display_data", data={
+                    "image/png": base64.b64encode(_png(rng, png_bytes)).decode(),
+                    "text/plain": "<Figure size 640x480 with 1 Axes>",
+                })
+            elif kind == "svg":
+                output = nbformat.v4.new_output("display_data", data={
+                    "image/svg+xml": _svg(rng, svg_bytes),
+                    "text/plain": "<Figure size 640x480 with 1 Axes>",
+                })
+            elif kind == "video":
+                output = nbformat.v4.new_output("display_data", data={"text/html": _video_html(rng, video_bytes)})
+            else:
+                output = nbformat.v4.new_output("stream", name="stdout", text=_stream(rng, stream_bytes))
+            cell.outputs.append(output)
+        nb.cells.append(cell)
+    return nb
+
+
+# Pipeline benchmarks
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1 << 20) if sys.platform == "darwin" else peak / (1 << 10)
+
+
+def _fresh_root(notebooks: List[Path]) -> Path:
+    """Copy notebooks into the docs directory of a new temporary project root."""
+    root_dir = Path(tempfile.mkdtemp(prefix="nb-bench-"))
+    (root_dir / "docs").mkdir()
+    for path in notebooks:
+        shutil.copy(path, root_dir / "docs" / path.name)
+    return root_dir
+
+
+def _record(name: str, seconds: float, input_bytes: int, repeat: int) -> Dict:
+    return {
+        "name": name,
+        "seconds": seconds,
+        "mb_per_s": input_bytes / seconds / 1e6 if seconds else None,
+        "input_bytes": input_bytes,
+        "repeat": repeat,
+        "peak_rss_mb": _peak_rss_mb(),
+    }
+
+
+def benchmark_convert_notebook(notebook: Path, repeat: int) -> List[Dict]:
+    """Time `convert_notebook()` into a new project (cold) and again into the same one (warm)."""
+    from notebook_convert import convert_notebook
+
+    size = notebook.stat().st_size
+    roots = []
+
+    def setup():
+        root_dir = _fresh_root([notebook])
+        roots.append(root_dir)
+        return root_dir
+
+    def run(root_dir):
+        path = root_dir / "docs" / notebook.name
+        convert_notebook(path, path.parent, root_dir)
+
+    # Convert once so the template is compiled before timing
+    run(setup())
+    cold = time_runs(setup, run, repeat)
+    warm = time_runs(lambda: roots[-1], run, repeat)
+    for root_dir in roots:
+        shutil.rmtree(root_dir, ignore_errors=True)
+    return [
+        _record("convert_notebook (cold)", cold, size, repeat),
+        _record("convert_notebook (warm)", warm, size, repeat),
+    ]
+
+
+def benchmark_convert_all(notebooks: List[Path], repeat: int, jobs: int) -> List[Dict]:
+    """Time `convert_all_notebooks()` on a new project and a no-op rebuild of it."""
+    from convert_all_notebooks import convert_all_notebooks
+
+    size = sum(path.stat().st_size for path in notebooks)
+    roots = []
+
+    def setup():
+        roots.append(_fresh_root(notebooks))
+        return roots[-1]
+
+    def run(root_dir):
+        stats = convert_all_notebooks(root_dir, jobs=jobs)
+        if stats["failed"]:
+            raise RuntimeError(f"{stats['failed']} notebooks failed to convert")
+
+    full = time_runs(setup, run, repeat)
+    noop = time_runs(lambda: roots[-1], run, repeat)
+    for root_dir in roots:
+        shutil.rmtree(root_dir, ignore_errors=True)
+    return [
+        _record(f"convert_all_notebooks (jobs={jobs})", full, size, repeat),
+        _record("convert_all_notebooks (no-op)", noop, size, repeat),
+    ]
+
+
+def benchmark_preprocessors(notebook: Path, repeat: int) -> List[Dict]:
+    """Time each preprocessor on its own on a copy of the notebook."""
+    from nbconvert.preprocessors import ExtractOutputPreprocessor
+    from notebook_assets import get_store
+    from notebook_convert import CellRewriter, EscapePreprocessor, HideCellProcessor, ResourceProcessor
+
+    size = notebook.stat().st_size
+    nb = read_notebook(notebook)
+    records = []
+    for cls in [ExtractOutputPreprocessor, HideCellProcessor, EscapePreprocessor, ResourceProcessor, CellRewriter]:
+        preprocessor = cls()
+        static_dirs = []
+
+        def setup():
+            static_dirs.append(Path(tempfile.mkdtemp(prefix="nb-bench-")))
+            resources = {"static_dir": static_dirs[-1], "notebook_name": notebook.stem, "outputs": {}}
+            return copy.deepcopy(nb), resources
+
+        def run(state):
+            preprocessor.preprocess(*state)
+            get_store(state[1]["static_dir"] / "notebooks").flush()
+
+        seconds = time_runs(setup, run, repeat)
+        for static_dir in static_dirs:
+            shutil.rmtree(static_dir, ignore_errors=True)
+        records.append(_record(cls.__name__, seconds, size, repeat))
+    return records
+
+
+def benchmark_engines(notebook: Path, repeat: int) -> List[Dict]:
+    """Time preprocessing and rendering the notebook with each engine, once its assets are stored."""
+    from notebook_assets import get_store
+    from notebook_convert import export_native, get_exporter
+    from notebook_render import ENGINES
+
+    size = notebook.stat().st_size
+    nb = read_notebook(notebook)
+    static_dir = Path(tempfile.mkdtemp(prefix="nb-bench-"))
+    resources = {"static_dir": static_dir, "notebook_name": notebook.stem}
+    renderers = {
+        "nbconvert": lambda: get_exporter().from_notebook_node(nb, resources=dict(resources)),
+        "native": lambda: export_native(nb, resources),
+    }
+    records = []
+    try:
+        for engine in ENGINES:
+            # Render once so the template is compiled and the assets are stored
+            renderers[engine]()
+            seconds = time_runs(lambda: None, lambda _: renderers[engine](), repeat)
+            get_store(static_dir / "notebooks").flush()
+            records.append(_record(f"render ({engine})", seconds, size, repeat))
+    finally:
+        shutil.rmtree(static_dir, ignore_errors=True)
+    return records
+
+
+def benchmark_daemon(notebook: Path, repeat: int) -> List[Dict]:
+    """Time `notebook_daemon.py convert` from process start to result, in-process and through a server."""
+    from notebook_daemon import SOCKET_PATH
+
+    script = Path(__file__).parent / "notebook_daemon.py"
+    root_dir = _fresh_root([notebook])
+    path = root_dir / "docs" / notebook.name
+    size = notebook.stat().st_size
+
+    def run(*extra):
+        subprocess.run(
+            [sys.executable, str(script), "convert", str(path), str(root_dir), *extra],
+            capture_output=True, check=True
+        )
+
+    records = []
+    try:
+        # Convert once so the Jinja bytecode cache is filled for both
+        run("--no-server")
+        records.append(_record("client (in-process)", time_runs(lambda: None, lambda _: run("--no-server"), repeat), size, repeat))
+
+        server = subprocess.Popen(
+            [sys.executable, str(script), "serve", str(root_dir)], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        try:
+            deadline = time.monotonic() + 60
+            while not (root_dir / SOCKET_PATH).exists():
+                if server.poll() is not None or time.monotonic() > deadline:
+                    raise RuntimeError("The conversion server did not start")
+                time.sleep(0.05)
+            records.append(_record("client (server)", time_runs(lambda: None, lambda _: run(), repeat), size, repeat))
+        finally:
+            server.terminate()
+            server.wait()
+    finally:
+        shutil.rmtree(root_dir, ignore_errors=True)
+    return records
+
+
+BENCHMARKS = {
+    "convert_notebook": lambda notebooks, args: benchmark_convert_notebook(notebooks[0], args["repeat"]),
+    "convert_all_notebooks": lambda notebooks, args: benchmark_convert_all(notebooks, args["repeat"], args["jobs"]),
+    "preprocessors": lambda notebooks, args: benchmark_preprocessors(notebooks[0], args["repeat"]),
+    "engines": lambda notebooks, args: benchmark_engines(notebooks[0], args["repeat"]),
+    "daemon": lambda notebooks, args: benchmark_daemon(notebooks[0], args["repeat"]),
+}
+
+
+def _run_in_child(name: str, notebooks: List[Path], args: Dict) -> List[Dict]:
+    """Run a benchmark in a fresh interpreter, so its peak RSS is not inflated by earlier ones."""
+    script = (
+        "import json, sys\n"
+        f"sys.path.insert(0, {str(Path(__file__).parent)!r})\n"
+        "from pathlib import Path\n"
+        "from notebook_benchmark import BENCHMARKS\n"
+        "name, notebooks, args = json.loads(sys.argv[1])\n"
+        "print(json.dumps(BENCHMARKS[name]([Path(p) for p in notebooks], args)))\n"
+    )
+    payload = json.dumps([name, [str(p) for p in notebooks], args])
+    result = subprocess.run(
+        [sys.executable, "-c", script, payload], capture_output=True, text=True, check=True
+    )
+    # Conversion logs come first; the results are the last line
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def run_suite(
+    notebooks: List[Path],
+    benchmarks: Optional[List[str]] = None,
+    repeat: int = 3,
+    jobs: int = 1,
+    isolate: bool = True,
+) -> List[Dict]:
+    """Run benchmarks (default: all of `BENCHMARKS`) on the given notebooks.
+
+    With `isolate`, each benchmark runs in its own interpreter and reports that
+    interpreter's peak RSS. Returns one record per measurement with its best
+    wall time, throughput over the input notebooks and peak RSS.
+    """
+    args = {"repeat": repeat, "jobs": jobs}
+    records = []
+    for name in benchmarks or list(BENCHMARKS):
+        if isolate:
+            records.extend(_run_in_child(name, notebooks, args))
+        else:
+            records.extend(BENCHMARKS[name](notebooks, args))
+    return records
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        result = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return result.stdout.strip()
+
+
+def write_results(path: Path, records: List[Dict], params: Dict):
+    """Write benchmark results with enough context to compare runs."""
+    data = {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": params,
+        "results": records,
+    }
+    with open(path, "w") as f:
+        json.dump(data, f, indent=1)
+
+
+def print_records(records: List[Dict]):
+    for record in records:
+        mb_per_s = f"{record['mb_per_s']:8.1f} MB/s" if record["mb_per_s"] is not None else " " * 13
+        print(f"{record['name']:<36} {record['seconds'] * 1000:9.1f} ms {mb_per_s} {record['peak_rss_mb']:8.1f} MB RSS")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark parts of the notebook conversion")
+    parser.add_argument("benchmark", choices=["loaders", "generate", "pipeline"], help="What to benchmark, or generate a synthetic notebook")
+    parser.add_argument("root_dir", type=Path, nargs="?", default=Path("."), help="Root directory of the documentation project; for generate, the notebook to write")
+    parser.add_argument("--repeat", type=int, default=5, help="Number of runs; the best is reported (default: 5)")
+    parser.add_argument("--output", type=Path, help="Write the results as JSON to this file")
+    synthetic = parser.add_argument_group("synthetic notebooks (generate, pipeline)")
+    synthetic.add_argument("--cells", type=int, default=200, help="Number of markdown and code cells (default: 200)")
+    synthetic.add_argument("--pagebreaks", type=int, default=4, help="Number of sections (default: 4)")
+    synthetic.add_argument("--png-kb", type=int, default=100, help="Size of PNG outputs in KB, 0 for none (default: 100)")
+    synthetic.add_argument("--svg-kb", type=int, default=100, help="Size of SVG outputs in KB, 0 for none (default: 100)")
+    synthetic.add_argument("--video-kb", type=int, default=0, help="Size of videos embedded in HTML outputs in KB, 0 for none (default: 0)")
+    synthetic.add_argument("--stream-kb", type=int, default=10, help="Size of text stream outputs in KB, 0 for none (default: 10)")
+    synthetic.add_argument("--hidden-ratio", type=float, default=0.1, help="Share of hidden code cells (default: 0.1)")
+    synthetic.add_argument("--notebooks", type=int, default=4, help="Number of notebooks for pipeline (default: 4)")
+    synthetic.add_argument("--benchmarks", nargs="+", choices=list(BENCHMARKS), help="Pipeline benchmarks to run (default: all)")
+    synthetic.add_argument("--jobs", "-j", type=int, default=1, help="Worker processes for convert_all_notebooks (default: 1)")
+    synthetic.add_argument("--no-isolate", action="store_true", help="Run all pipeline benchmarks in this process")
+    args = parser.parse_args()
+
+    shape = {
+        "cells": args.cells,
+        "pagebreaks": args.pagebreaks,
+        "png_bytes": args.png_kb << 10,
+        "svg_bytes": args.svg_kb << 10,
+        "video_bytes": args.video_kb << 10,
+        "stream_bytes": args.stream_kb << 10,
+        "hidden_ratio": args.hidden_ratio,
+    }
+
+    if args.benchmark == "generate":
+        nbformat.write(generate_notebook(**shape), args.root_dir)
+        print(f"Wrote {args.root_dir} ({args.root_dir.stat().st_size / 1e6:.1f} MB)")
+        sys.exit(0)
+
+    if args.benchmark == "loaders":
+        paths = find_notebooks(args.root_dir / "docs")
+        total_bytes = sum(path.stat().st_size for path in paths)
+        print(f"{len(paths)} notebooks, {total_bytes / 1e6:.1f} MB, JSON decoder: {'orjson' if orjson else 'json'}")
+        results = benchmark_loaders(paths, args.repeat)
+        print_results(results, total_bytes)
+        records = [
+            {"name": name, "seconds": seconds, "mb_per_s": total_bytes / seconds / 1e6, "input_bytes": total_bytes,
+             "repeat": args.repeat, "peak_rss_mb": _peak_rss_mb()}
+            for name, seconds in results.items()
+        ]
+        params = {"root_dir": str(args.root_dir), "notebooks": len(paths)}
+    else:
+        with tempfile.TemporaryDirectory(prefix="nb-bench-") as tmp_dir:
+            notebooks = []
+            for seed in range(args.notebooks):
+                path = Path(tmp_dir) / f"synthetic-{seed}.ipynb"
+                nbformat.write(generate_notebook(**shape, seed=seed), path)
+                notebooks.append(path)
+            total_bytes = sum(path.stat().st_size for path in notebooks)
+            print(f"{len(notebooks)} synthetic notebooks, {total_bytes / 1e6:.1f} MB")
+            records = run_suite(notebooks, args.benchmarks, args.repeat, args.jobs, not args.no_isolate)
+        print_records(records)
+        params = {**shape, "notebooks": args.notebooks, "repeat": args.repeat, "jobs": args.jobs}
+
+    if args.output:
+        write_results(args.output, records, {"benchmark": args.benchmark, **params})
+        print(f"Results written to {args.output}")
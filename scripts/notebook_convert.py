@@ -1,17 +1,42 @@
+import copy
 import re
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple
-import shutil
+from textwrap import dedent
+from typing import Dict, List, Optional, Sequence, Tuple, Union
 
 import nbformat
 from nbconvert.exporters import MarkdownExporter
-from nbconvert.preprocessors import Preprocessor
+from nbconvert.preprocessors import ExtractOutputPreprocessor, Preprocessor
+from traitlets.config import Config
 
 # Import utility functions
 from notebook_utils import (
-    escape_html, extract_frontmatter, has_pagebreaks, 
-    append_to_gitignore, generate_directory_gitignore
+    CellRange, NotebookLayout, escape_html, extract_frontmatter, 
+    append_to_gitignore, generate_directory_gitignore, write_if_changed
 )
+from notebook_manifest import PageCache, collect_assets
+from notebook_assets import (
+    ASSET_REFERENCE_MIME, HASH_ALGORITHMS, get_store, parse_data_url, publish_assets, set_hash_algorithm
+)
+import notebook_images
+from notebook_images import (
+    DEFAULT_SVG_SETTINGS, MIME_TYPES, SUPPORTED_IMAGE_FORMATS, optimize_image, optimize_svg,
+    set_image_formats, set_svg_settings
+)
+from notebook_loader import LazyText, read_notebook, set_validate_notebooks
+from notebook_profile import stage
+import notebook_render
+from notebook_render import ENGINES, highlight_magics, render_notebook, rewrite_attachments, set_engine
+
+# Rewrite .ipynb links to .md links
+IPYNB_LINK_PATTERN = re.compile(r"\[([^\]]*)\]\((?![^\)]*//)([^)]*)\.ipynb\)")
+# Demote headings by one level. Without re.MULTILINE this only matches the first line.
+HEADING_PATTERN = re.compile(r"(^#)(#.*) (.*)")
+MARKDOWN_IMAGE_PATTERN = re.compile(r"!\[([^\]]*)\]\(([^)]+)\)")
+# The <source> tag around a `data:video/` URL, matched in the text before the URL
+HTML_VIDEO_PATTERN = re.compile(r'<source\s+([^>]*?)src=(["\'])\Z')
+# Number of characters before a `data:video/` URL searched for its <source> tag
+SOURCE_TAG_WINDOW = 4096
 
 
 class HideCellProcessor(Preprocessor):
@@ -129,13 +154,36 @@ class EscapePreprocessor(Preprocessor):
 
 
 class ResourceProcessor(Preprocessor):
-    """Handle notebook resources like images."""
+    """Handle notebook resources like images.
+
+    The static directory and notebook name are read from `resources` on every
+    call, so a single exporter can be reused across notebooks.
+
+    Assets are added to the shared content-addressed asset store and linked into
+    the notebook's asset directory. The files used by the page are collected in
+    `resources["asset_refs"]`.
+    """
     
-    def __init__(self, static_dir: Path, notebook_name: str):
-        super().__init__()
-        self.notebook_name = notebook_name
-        self.assets_dir = static_dir / "notebooks" / notebook_name
+    def preprocess(self, nb, resources):
+        self._begin(resources)
+        with stage("preprocess"):
+            return super().preprocess(nb, resources)
+
+    def _begin(self, resources):
+        """Look up the asset store and directory of the notebook being converted."""
+        self.notebook_name = resources["notebook_name"]
+        self.store = get_store(Path(resources["static_dir"]) / "notebooks")
+        self.assets_dir = self.store.notebooks_dir / self.notebook_name
         self.assets_dir.mkdir(parents=True, exist_ok=True)
+        self.refs = resources.setdefault("asset_refs", {})
+
+    def _link_asset(self, blob: Optional[str], name: Optional[str] = None) -> Optional[str]:
+        """Link a stored blob into the notebook's asset directory and record the reference."""
+        if blob is None:
+            return None
+        name = self.store.link(blob, self.assets_dir, name)
+        self.refs[f"{self.notebook_name}/{name}"] = blob
+        return name
         
     def preprocess_cell(self, cell, resources, cell_index):
         if cell.cell_type == "markdown":
@@ -149,42 +197,33 @@ class ResourceProcessor(Preprocessor):
     
     def _process_markdown_images(self, source: str) -> str:
         """Process and save images in markdown content."""
+        if "![" not in source:
+            return source
+
         def replace_image(match):
-            img_path = match.group(2)
-            if img_path.startswith("data:"):
-                # Handle base64 embedded images
-                import base64
-                import hashlib
-                
-                # Extract mime type and data
-                mime_match = re.match(r"data:([^;]+);base64,(.+)", img_path)
-                if mime_match:
-                    mime_type, b64_data = mime_match.groups()
+            if source.startswith("data:", match.start(2)):
+                # Handle base64 embedded images. The payload is decoded straight
+                # from the source string without copying it out of the match.
+                parsed = parse_data_url(source, match.start(2), match.end(2))
+                if parsed:
+                    mime_type, data_start = parsed
                     ext = mime_type.split('/')[-1]
-                    
-                    # Generate filename from content hash
-                    data = base64.b64decode(b64_data)
-                    filename = hashlib.md5(data).hexdigest()[:12] + '.' + ext
-                    
-                    # Save image only if it doesn't exist
-                    img_file = self.assets_dir / filename
-                    if not img_file.exists():
-                        img_file.write_bytes(data)
-                    
-                    # Return relative path
-                    return f"![{match.group(1)}](/notebooks/{self.notebook_name}/{filename})"
+                    filename = self._link_asset(self.store.add_base64(source, ext, data_start, match.end(2)))
+                    if filename:
+                        # Return relative path
+                        return f"![{match.group(1)}](/notebooks/{self.notebook_name}/{filename})"
             else:
                 # Handle regular image files
+                img_path = match.group(2)
                 src_path = Path(img_path)
                 if src_path.exists():
-                    new_name = src_path.name
-                    dst_path = self.assets_dir / new_name
-                    shutil.copy2(src_path, dst_path)
+                    new_name = self._link_asset(self.store.add_file(src_path), src_path.name)
                     return f"![{match.group(1)}](/notebooks/{self.notebook_name}/{new_name})"
             return match.group(0)
         
         # Find and process all image references
-        return re.sub(r"!\[([^\]]*)\]\(([^)]+)\)", replace_image, source)
+        with stage("assets"):
+            return MARKDOWN_IMAGE_PATTERN.sub(replace_image, source)
 
     def _process_output_media(self, outputs: List[Dict]) -> List[Dict]:
         """Process and save images and videos in cell outputs.
@@ -193,138 +232,324 @@ class ResourceProcessor(Preprocessor):
         in the same asset directory. For videos, not only direct MIME types ("video/...") 
         are handled but also those embedded within HTML (MIME type "text/html") containing 
         <source src="data:video/...">.
+
+        Base64 payloads are decoded, hashed and written in chunks (see
+        `notebook_assets`), so memory use does not grow with the media size.
+        """
+        new_outputs = []
+        for output in outputs:
+            if "data" in output:
+                self._resolve_asset_reference(output)
+                with stage("assets"):
+                    output["data"] = {
+                        mime_type: self._process_output_data(mime_type, data, output)
+                        for mime_type, data in output["data"].items()
+                    }
+            new_outputs.append(output)
+        return new_outputs
+
+    def _resolve_asset_reference(self, output: Dict):
+        """Link the asset an output refers to (see `ASSET_REFERENCE_MIME`) and point its HTML at it.
+
+        If the asset is in the store, nothing is decoded or hashed. Otherwise its
+        embedded fallback copy is decoded into the store.
+        """
+        reference = output["data"].pop(ASSET_REFERENCE_MIME, None)
+        if reference is None:
+            return
+        blob = reference["blob"]
+        fallback_mime = reference.get("fallback")
+        fallback = output["data"].pop(fallback_mime, None) if fallback_mime else None
+        with stage("assets"):
+            if blob not in self.store.blobs:
+                if fallback is None:
+                    raise ValueError(
+                        f"Output refers to missing asset {blob}, which is only in the (uncommitted) asset "
+                        "store of the checkout that ran the notebook; run the notebook again to recreate "
+                        "it, or show it with fallback=True to embed a copy for other checkouts"
+                    )
+                blob = self.store.add_base64(fallback, fallback_mime.split("/")[-1])
+                if blob is None:
+                    raise ValueError(f"Invalid base64 data in {fallback_mime} output")
+            url = f"/docs/img/notebooks/{self.notebook_name}/{self._link_asset(blob)}"
+        if "text/html" in output["data"]:
+            output["data"]["text/html"] = str(output["data"]["text/html"]).replace(reference["src"], url)
+
+    def _process_output_data(self, mime_type: str, data, output: Optional[Dict] = None):
+        """Save the media of a single output MIME bundle entry and return its new value.
+
+        With image optimization enabled (see `notebook_images`), PNG and JPEG
+        outputs are replaced by their optimized version, and the URLs of their
+        WebP/AVIF variants are added to `output.metadata.picture[mime_type]`
+        for the template to render a `<picture>`. With SVG optimization enabled,
+        SVGs are minified, and SVGs too large to display efficiently get a
+        rasterized `picture` linking to the SVG.
         """
-        import re
-        import base64
-        import hashlib
+        # For SVG images, handle differently since they are plain text
+        if mime_type == "image/svg+xml":
+            # If data is a string, encode it to bytes; otherwise, assume it's already bytes
+            if isinstance(data, str):
+                media_data = data.encode("utf-8")
+            else:
+                media_data = data
+
+            # Save the media file under its content hash
+            blob = self.store.add_bytes(media_data, "svg")
+            if notebook_images.SVG_SETTINGS is not None:
+                with stage("optimize"):
+                    blob, raster = optimize_svg(self.store, blob)
+                if raster is not None and output is not None:
+                    output.setdefault("metadata", {}).setdefault("picture", {})[mime_type] = {
+                        **self._picture(*raster),
+                        "href": f"/docs/img/notebooks/{self.notebook_name}/{self._link_asset(blob)}",
+                    }
+            filename = self._link_asset(blob)
+
+            # Create new URL and update the reference for SVG
+            return f"/img/notebooks/{self.notebook_name}/{filename}"
+
+        # For images or direct video data (excluding SVG which is handled above)
+        elif mime_type.startswith("image/") or mime_type.startswith("video/"):
+            # Determine the file extension from the MIME type
+            ext = mime_type.split('/')[-1]
+            # Decode base64 data from a data URL or a raw base64 string
+            if isinstance(data, (str, LazyText)):
+                # Skip the header of data URLs
+                data_start = data.find(",") + 1 if data.startswith("data:") else 0
+                blob = self.store.add_base64(data, ext, data_start)
+                if blob is None:
+                    raise ValueError(f"Invalid base64 data in {mime_type} output")
+            else:
+                blob = self.store.add_bytes(data, ext)
+
+            if notebook_images.IMAGE_FORMATS and mime_type in ("image/png", "image/jpeg") and output is not None:
+                with stage("optimize"):
+                    blob, variants = optimize_image(self.store, blob)
+                output.setdefault("metadata", {}).setdefault("picture", {})[mime_type] = self._picture(blob, variants)
+            filename = self._link_asset(blob)
+
+            # Update the reference with the new URL
+            return f"/img/notebooks/{self.notebook_name}/{filename}"
+
+        # For video sources embedded in HTML output
+        elif mime_type == "text/html":
+            # Retrieve the HTML content as a string
+            html_content = data if isinstance(data, (str, LazyText)) else ""
+            return self._process_html_videos(html_content)
+        return data
+
+    def _picture(self, fallback: str, variants: List[Tuple[str, str]]) -> Dict:
+        """Link an image and its variants and describe them for the template's `picture` macro."""
+        return {
+            "src": f"/docs/img/notebooks/{self.notebook_name}/{self._link_asset(fallback)}",
+            "sources": [
+                {"srcSet": f"/docs/img/notebooks/{self.notebook_name}/{self._link_asset(variant)}",
+                 "type": MIME_TYPES[fmt]}
+                for fmt, variant in variants
+            ],
+        }
+
+    def _process_html_videos(self, html_content: Union[str, LazyText]) -> str:
+        """Save videos embedded in <source src="data:video/..."> tags and link to the files.
+
+        The URLs are located with `find()` and only the text just before each
+        one is matched by the regex. The payloads are decoded in place, so they
+        are never copied as a whole and `LazyText` is never read into one string.
+        """
+        url_start = html_content.find("data:video/")
+        if url_start < 0:
+            return str(html_content)
+        parts = []
+        pos = 0
+        while url_start >= 0:
+            match = HTML_VIDEO_PATTERN.search(html_content[max(pos, url_start - SOURCE_TAG_WINDOW):url_start])
+            url_end = html_content.find(match.group(2), url_start) if match else -1
+            # Verify that the data URL is in the correct format (e.g., data:video/mp4;base64,...)
+            parsed = parse_data_url(html_content, url_start, url_end) if url_end >= 0 else None
+            filename = None
+            if parsed:
+                mime, data_start = parsed
+                ext = mime.split("/")[-1]
+                filename = self._link_asset(self.store.add_base64(html_content, ext, data_start, url_end))
+            if filename is None:
+                url_start = html_content.find("data:video/", url_start + 1)
+                continue
+            new_url = f"/docs/img/notebooks/{self.notebook_name}/{filename}"
+            # Update the src attribute in the <source> tag
+            parts.append(html_content[pos:url_start - len(match.group())])
+            parts.append(f'<source {match.group(1)}src="{new_url}"')
+            pos = url_end + 1
+            url_start = html_content.find("data:video/", pos)
+        parts.append(html_content[pos:])
+        return "".join(parts)
+
+
+class CellRewriter(ResourceProcessor):
+    """Single-pass equivalent of HideCellProcessor, EscapePreprocessor and ResourceProcessor.
+
+    Each cell and each output is visited once, with all three rewrites applied
+    in the order the separate preprocessors ran. Regexes are precompiled and
+    only run when a substring check shows they can match.
+
+    It also dedents HTML outputs, the only effect ExtractOutputPreprocessor had
+    on our templates. Image and video data loaded as `LazyText` is streamed
+    into the asset store; other lazy data is read once its cell is known to be
+    visible, so hidden outputs are never read.
+    """
+
+    def preprocess(self, nb, resources):
+        self._begin(resources)
+        with stage("preprocess"):
+            nb.cells = self._rewrite_cells(nb.cells)
+        return nb, resources
+
+    def _rewrite_cells(self, cells: List) -> List:
+        """Hide, escape and save the media of the cells, returning the visible ones."""
+        new_cells = []
+        for cell in cells:
+            if cell.cell_type == "code":
+                hide_input = cell.get("metadata", {}).get("hide_input", False)
+                hide = cell.get("metadata", {}).get("hide", False)
+                if hide_input and hide:
+                    continue
+                elif hide_input:
+                    cell.source = ""
+                elif hide:
+                    cell.outputs = []
+
+                # Escape triple backticks and replace tabs with 4 spaces
+                source = cell.source
+                if "```" in source:
+                    source = source.replace("```", r"\`\`\`")
+                if "\t" in source:
+                    source = source.replace("\t", r"    ")
+                cell.source = source
+
+                if "outputs" in cell:
+                    cell["outputs"] = self._rewrite_outputs(cell["outputs"])
 
+            elif cell.cell_type == "markdown":
+                if cell.get("metadata", {}).get("hide", False):
+                    continue
+                source = cell.source
+                if ".ipynb)" in source:
+                    source = IPYNB_LINK_PATTERN.sub(r"[\1](\2.md)", source)
+                if source.startswith("##"):
+                    source = HEADING_PATTERN.sub(r"\2 \3", source)
+                cell.source = self._process_markdown_images(source)
+
+            new_cells.append(cell)
+        return new_cells
+
+    def _rewrite_outputs(self, outputs: List[Dict]) -> List[Dict]:
+        """Drop blank text outputs, escape the rest and save their media."""
         new_outputs = []
         for output in outputs:
+            # Like EscapePreprocessor, only escape the data of outputs without text
+            escape_data = "text" not in output
+            if not escape_data:
+                if not output["text"].strip():
+                    continue
+                output["text"] = escape_html(output["text"].replace("```", r"\`\`\`"))
             if "data" in output:
+                self._resolve_asset_reference(output)
+                if output.get("output_type") in ("display_data", "execute_result") and "text/html" in output["data"]:
+                    html = output["data"]["text/html"]
+                    output["data"]["text/html"] = html.dedent() if isinstance(html, LazyText) else dedent(html)
                 new_data = {}
                 for mime_type, data in output["data"].items():
-                    # For SVG images, handle differently since they are plain text
-                    if mime_type == "image/svg+xml":
-                        ext = "svg"
-                        # If data is a string, encode it to bytes; otherwise, assume it's already bytes
-                        if isinstance(data, str):
-                            media_data = data.encode("utf-8")
-                        else:
-                            media_data = data
-
-                        # Generate a filename from the content hash
-                        filename = hashlib.md5(media_data).hexdigest()[:12] + '.' + ext
-
-                        # Use the same asset directory for all media
-                        asset_dir = self.assets_dir
-                        url_prefix = "/img/notebooks"
-
-                        # Create the asset directory if it does not exist
-                        asset_dir.mkdir(parents=True, exist_ok=True)
-
-                        # Save the media file if not already present
-                        media_file = asset_dir / filename
-                        if not media_file.exists():
-                            print(f"saving to {media_file}")
-                            media_file.write_bytes(media_data)
-
-                        # Create new URL and update the reference for SVG
-                        new_url = f"{url_prefix}/{self.notebook_name}/{filename}"
-                        new_data[mime_type] = new_url
-
-                    # For images or direct video data (excluding SVG which is handled above)
-                    elif mime_type.startswith("image/") or mime_type.startswith("video/"):
-                        # Determine the file extension from the MIME type
-                        ext = mime_type.split('/')[-1]
-                        # Decode base64 data from a data URL or a raw base64 string
-                        if isinstance(data, str):
-                            if data.startswith("data:"):
-                                # Handle data URLs
-                                b64_data = data.split(",", 1)[1]
-                                media_data = base64.b64decode(b64_data)
-                            else:
-                                # Handle raw base64 strings
-                                media_data = base64.b64decode(data)
-                        else:
-                            media_data = data
-
-                        # Generate a filename from the content hash
-                        filename = hashlib.md5(media_data).hexdigest()[:12] + '.' + ext
-
-                        # Use the same asset directory for both images and videos
-                        asset_dir = self.assets_dir
-                        url_prefix = "/img/notebooks"
-
-                        # Create the asset directory if it does not exist
-                        asset_dir.mkdir(parents=True, exist_ok=True)
-
-                        # Save the media file if not already present
-                        media_file = asset_dir / filename
-                        if not media_file.exists():
-                            print(f"saving to {media_file}")
-                            media_file.write_bytes(media_data)
-
-                        # Update the reference with the new URL
-                        new_data[mime_type] = f"{url_prefix}/{self.notebook_name}/{filename}"
-
-                    # For video sources embedded in HTML output
-                    elif mime_type == "text/html":
-                        # Retrieve the HTML content as a string
-                        html_content = data if isinstance(data, str) else ""
-                        # Use a regex to detect <source> tags with a video data URL
-                        pattern = r'<source\s+([^>]*?)src=["\'](data:video/[^"\']+)["\']'
-
-                        def replace_source(match):
-                            pre_attrs = match.group(1)
-                            data_url = match.group(2)
-                            # Verify that the data URL is in the correct format (e.g., data:video/mp4;base64,...)
-                            try:
-                                header, b64_str = data_url.split(",", 1)
-                            except Exception:
-                                return match.group(0)
-                            # Example header: "data:video/mp4;base64"
-                            mime = header.split(";")[0].split(":")[1]
-                            ext = mime.split("/")[-1]
-                            try:
-                                video_data = base64.b64decode(b64_str)
-                            except Exception:
-                                return match.group(0)
-
-                            # Generate a filename from the content hash
-                            filename = hashlib.md5(video_data).hexdigest()[:12] + '.' + ext
-
-                            # Save the file in the same img directory
-                            asset_dir = self.assets_dir
-                            url_prefix = "/docs/img/notebooks"
-                            asset_dir.mkdir(parents=True, exist_ok=True)
-                            video_file = asset_dir / filename
-                            if not video_file.exists():
-                                print(f"saving to {video_file}")
-                                video_file.write_bytes(video_data)
-                            new_url = f"{url_prefix}/{self.notebook_name}/{filename}"
-                            # Update the src attribute in the <source> tag and return the new tag
-                            return f'<source {pre_attrs}src="{new_url}"'
-
-                        new_html = re.sub(pattern, replace_source, html_content)
-                        new_data[mime_type] = new_html
-                    else:
-                        new_data[mime_type] = data
+                    if isinstance(data, LazyText) and mime_type == "text/html":
+                        # Extract the videos, so that only the rest of the HTML is
+                        # read into a string. Escaping afterwards is equivalent, as
+                        # the replaced URLs contain no backticks.
+                        with stage("assets"):
+                            data = self._process_html_videos(data)
+                    elif isinstance(data, LazyText) and (
+                        mime_type == "image/svg+xml" or not mime_type.startswith(("image/", "video/"))
+                    ):
+                        data = str(data)
+                    if escape_data and isinstance(data, str):
+                        data = data.replace("```", r"\`\`\`")
+                        if mime_type != "text/html":
+                            data = escape_html(data)
+                    with stage("assets"):
+                        new_data[mime_type] = self._process_output_data(mime_type, data, output)
                 output["data"] = new_data
             new_outputs.append(output)
         return new_outputs
 
 
-def setup_exporter(static_dir: Path, notebook_name: str) -> MarkdownExporter:
+# The separate preprocessors that CellRewriter replaces, kept as its reference
+LEGACY_PREPROCESSORS = [ExtractOutputPreprocessor, HideCellProcessor, EscapePreprocessor, ResourceProcessor]
+PREPROCESSORS = [CellRewriter]
+
+
+# Directory for Jinja's on-disk bytecode cache. Disabled when None.
+BYTECODE_CACHE_DIR: Optional[Path] = None
+
+_exporter_cache: Dict[Optional[Path], MarkdownExporter] = {}
+_rewriter: Optional[CellRewriter] = None
+
+
+def set_bytecode_cache_dir(cache_dir: Optional[Path]):
+    """Enable (or disable with None) the on-disk Jinja bytecode cache.
+
+    The bytecode cache lets new processes skip compiling the template chain.
+    """
+    global BYTECODE_CACHE_DIR
+    BYTECODE_CACHE_DIR = cache_dir
+
+
+def setup_exporter(preprocessors: Optional[List] = None) -> MarkdownExporter:
     """Create and configure a markdown exporter with the necessary preprocessors."""
-    return MarkdownExporter(
-        preprocessors=[
-            HideCellProcessor,
-            EscapePreprocessor,
-            ResourceProcessor(static_dir, notebook_name)
-        ],
+    exporter = MarkdownExporter(
+        # Our templates link to the assets saved by CellRewriter, so the outputs
+        # extracted by ExtractOutputPreprocessor were never used
+        config=Config({"ExtractOutputPreprocessor": {"enabled": False}}),
+        preprocessors=preprocessors or PREPROCESSORS,
         template_name="mdoutput",
         extra_template_basedirs=["./scripts/notebook_convert_templates"],
     )
+    # Validate once after the last preprocessor instead of after each one.
+    # Lazily loaded output data only becomes valid once CellRewriter has run.
+    exporter.optimistic_validation = True
+    if BYTECODE_CACHE_DIR is not None:
+        from jinja2 import FileSystemBytecodeCache
+
+        Path(BYTECODE_CACHE_DIR).mkdir(parents=True, exist_ok=True)
+        exporter.environment.bytecode_cache = FileSystemBytecodeCache(str(BYTECODE_CACHE_DIR))
+    return exporter
+
+
+def get_exporter() -> MarkdownExporter:
+    """Return the exporter for this process, creating it on first use.
+
+    The exporter keeps its Jinja environment and compiled template, so they are
+    only resolved and compiled once per process instead of once per page.
+    """
+    if BYTECODE_CACHE_DIR not in _exporter_cache:
+        _exporter_cache[BYTECODE_CACHE_DIR] = setup_exporter()
+    return _exporter_cache[BYTECODE_CACHE_DIR]
+
+
+def export_native(nb: nbformat.NotebookNode, resources: Dict) -> Tuple[str, Dict]:
+    """Convert a notebook like `get_exporter().from_notebook_node()`, without the exporter.
+
+    Runs the enabled steps of the exporter's preprocessing (magics detection,
+    attachment references and CellRewriter) on a copy of the notebook and
+    renders it with `notebook_render`. The notebook is copied once and not
+    normalized or validated; `--validate` checks it when it is read.
+    """
+    global _rewriter
+    if _rewriter is None:
+        _rewriter = CellRewriter()
+    nb = copy.deepcopy(nb)
+    for cell in nb.cells:
+        highlight_magics(cell)
+        rewrite_attachments(cell)
+    nb, resources = _rewriter.preprocess(nb, dict(resources))
+    return render_notebook(nb), resources
+
 
 def export_notebook_cell_to_mdx(
     nb: nbformat.NotebookNode, 
@@ -332,7 +557,9 @@ def export_notebook_cell_to_mdx(
     static_dir: Path, 
     notebook_name: str,
     frontmatter: str = None,
-    notebook_path: str = None
+    notebook_path: str = None,
+    page_cache: Optional[PageCache] = None,
+    layout: Optional[NotebookLayout] = None
 ) -> Path:
     """Convert a notebook to a single MDX file with frontmatter.
     
@@ -343,6 +570,9 @@ def export_notebook_cell_to_mdx(
         notebook_name: Name of the notebook (used for image paths)
         frontmatter: Optional frontmatter string. If None, extracted from notebook.
         notebook_path: Path to the notebook file (to construct the edit URL)
+        page_cache: Optional cache of page hashes. The page is not rendered again
+            if its content is unchanged since it was last written.
+        layout: Optional precomputed layout of `nb`, used to find the frontmatter
     """
     # Make a copy of the notebook to avoid modifying the original
     nb_copy = nbformat.v4.new_notebook(metadata=nb.metadata)
@@ -350,22 +580,38 @@ def export_notebook_cell_to_mdx(
     
     # Extract frontmatter if not provided
     if frontmatter is None:
-        frontmatter, frontmatter_idx = extract_frontmatter(nb_copy, notebook_path)
+        frontmatter, frontmatter_idx = extract_frontmatter(nb_copy, notebook_path, layout)
         # Remove frontmatter cell if found
         if frontmatter_idx is not None:
             nb_copy.cells.pop(frontmatter_idx)
     
-    # Set up exporter
-    exporter = setup_exporter(static_dir, notebook_name)
+    # Skip pages whose content has not changed
+    if page_cache is not None:
+        page_key = page_cache.page_key(nb_copy, frontmatter, notebook_name)
+        if page_cache.is_fresh(output_path, page_key):
+            print(f"Unchanged {output_path}")
+            return output_path
     
     # Convert to markdown
-    body, resources = exporter.from_notebook_node(nb_copy)
+    resources = {"static_dir": static_dir, "notebook_name": notebook_name}
+    # Preprocessing is timed separately, so this is mostly the Jinja template
+    with stage("render"):
+        if notebook_render.ENGINE == "native":
+            body, resources = export_native(nb_copy, resources)
+        else:
+            body, resources = get_exporter().from_notebook_node(nb_copy, resources=resources)
+    
+    with stage("write"):
+        # Write markdown file with frontmatter
+        written = write_if_changed(output_path, frontmatter + "\n\n" + body)
+        
+        # Record which assets the page uses so unreferenced ones can be collected
+        get_store(static_dir / "notebooks").record_refs(output_path, resources.get("asset_refs", {}))
     
-    # Write markdown file with frontmatter
-    with open(output_path, "w") as f:
-        f.write(frontmatter + "\n\n" + body)
+    if page_cache is not None:
+        page_cache.update(output_path, page_key)
     
-    print(f"Created {output_path}")
+    print(f"{'Created' if written else 'Unchanged'} {output_path}")
     return output_path
 
 
@@ -398,21 +644,20 @@ def generate_chapter_index_md(
     nb: nbformat.NotebookNode, 
     output_dir: Path, 
     static_dir: Path,
-    notebook_path: str = None
+    notebook_path: str = None,
+    page_cache: Optional[PageCache] = None,
+    layout: Optional[NotebookLayout] = None
 ) -> Tuple[Path, str]:
     """Generate index.md file for a chapter with content up to first pagebreak."""
+    layout = layout or NotebookLayout(nb)
+    
     # Extract frontmatter with the notebook path (to get correct edit URL)
-    frontmatter, frontmatter_idx = extract_frontmatter(nb, notebook_path)
+    frontmatter, frontmatter_idx = extract_frontmatter(nb, notebook_path, layout)
     
     # Create directories
     output_dir.mkdir(parents=True, exist_ok=True)
 
-    # Find first pagebreak
-    first_pagebreak_idx = None
-    for i, cell in enumerate(nb.cells):
-        if cell.cell_type == "raw" and "# !pagebreak" in cell.source:
-            first_pagebreak_idx = i
-            break
+    first_pagebreak_idx = layout.first_pagebreak_index
     
     # Create a notebook with cells up to first pagebreak for index.md
     index_nb = nbformat.v4.new_notebook(metadata=nb.metadata)
@@ -421,7 +666,7 @@ def generate_chapter_index_md(
     if frontmatter_idx is not None:
         start_idx = frontmatter_idx + 1
         end_idx = first_pagebreak_idx if first_pagebreak_idx is not None else len(nb.cells)
-        index_nb.cells = nb.cells[start_idx:end_idx]
+        index_nb.cells = CellRange(nb.cells, start_idx, end_idx)
     
     # Output file
     index_path = output_dir / "index.mdx"
@@ -434,68 +679,34 @@ def generate_chapter_index_md(
             index_path, 
             static_dir, 
             notebook_name, 
-            frontmatter=frontmatter
+            frontmatter=frontmatter,
+            page_cache=page_cache
         ), frontmatter
     else:
         # Just write frontmatter if no content cells
-        with open(index_path, "w") as f:
-            f.write(frontmatter)
+        with stage("write"):
+            write_if_changed(index_path, frontmatter)
+            get_store(static_dir / "notebooks").record_refs(index_path, {})
         return index_path, frontmatter
 
 
-def split_notebook_cells(nb: nbformat.NotebookNode) -> List[Tuple[List[nbformat.NotebookNode], Optional[str]]]:
-    """Split notebook cells into sections based on # !pagebreak markers, returning cells and frontmatter."""
-    # Find all indices of cells containing pagebreaks
-    pagebreak_indices = []
-    for i, cell in enumerate(nb.cells):
-        if cell.cell_type == "raw" and "# !pagebreak" in cell.source:
-            pagebreak_indices.append(i)
+def split_notebook_cells(
+    nb: nbformat.NotebookNode,
+    layout: Optional[NotebookLayout] = None
+) -> List[Tuple[Sequence[nbformat.NotebookNode], Optional[str]]]:
+    """Split notebook cells into sections based on # !pagebreak markers, returning cells and frontmatter.
+
+    The cells of each section are a view over `nb.cells`, not a copy.
+    """
+    layout = layout or NotebookLayout(nb)
     
     # If no pagebreaks found, return the entire notebook as one section
     # (excluding chapter frontmatter)
-    if not pagebreak_indices:
-        return [([cell for cell in nb.cells if "# !chapter" not in cell.source], None)]
+    if not layout.has_pagebreaks:
+        excluded = set(layout.chapter_marker_indices)
+        return [([cell for i, cell in enumerate(nb.cells) if i not in excluded], None)]
     
-    # Split cells into sections
-    sections = []
-    
-    # Process each pagebreak
-    for i, pb_idx in enumerate(pagebreak_indices):
-        # Get the raw cell with pagebreak
-        pb_cell = nb.cells[pb_idx]
-        
-        # Extract content after pagebreak
-        parts = pb_cell.source.split("# !pagebreak", 1)
-        content_after_pb = parts[1].strip() if len(parts) > 1 else ""
-        
-        # Extract frontmatter if it exists
-        section_frontmatter = None
-        if content_after_pb:
-            # Check if the content has frontmatter
-            if content_after_pb.startswith("---"):
-                # Extract frontmatter between --- markers
-                fm_end = content_after_pb.find("---", 3)
-                if fm_end > 0:
-                    section_frontmatter = content_after_pb[:fm_end + 3]
-                    content_after_pb = content_after_pb[fm_end + 3:].strip()
-        
-        # Start a new section
-        section_cells = []
-        
-        # Add the content after pagebreak as a new raw cell if it exists
-        if content_after_pb:
-            new_cell = nbformat.v4.new_raw_cell(content_after_pb)
-            section_cells.append(new_cell)
-        
-        # Add all cells until the next pagebreak (or end of notebook)
-        next_pb_idx = pagebreak_indices[i + 1] if i + 1 < len(pagebreak_indices) else len(nb.cells)
-        section_cells.extend(nb.cells[pb_idx + 1:next_pb_idx])
-        
-        # Add the section if it has cells
-        if section_cells:
-            sections.append((section_cells, section_frontmatter))
-    
-    return sections
+    return [(section.cells(nb), section.frontmatter) for section in layout.sections]
 
 
 def add_edit_url_to_frontmatter(frontmatter: str, edit_url: str) -> str:
@@ -517,11 +728,35 @@ def add_edit_url_to_frontmatter(frontmatter: str, edit_url: str) -> str:
         return frontmatter + f"\ncustom_edit_url: \"{edit_url}\"\n---\n"
 
 
-def convert_notebook(notebook_path: Path, notebook_dir: Path, root_dir: Path) -> List[Path]:
-    """Convert a notebook to markdown files, handling both single and multi-page notebooks."""
+def convert_notebook(
+    notebook_path: Path,
+    notebook_dir: Path,
+    root_dir: Path,
+    page_cache: Optional[PageCache] = None
+) -> List[Path]:
+    """Convert a notebook to markdown files, handling both single and multi-page notebooks.
+
+    With a `page_cache`, only pages whose content changed are rendered again.
+    Assets are written in the background while the pages are rendered; this
+    returns once they are all written and raises if any write failed.
+    """
+    store = get_store(root_dir / "_intermediate" / "static" / "img" / "notebooks")
+    try:
+        return _convert_pages(notebook_path, notebook_dir, root_dir, page_cache)
+    finally:
+        with stage("write"):
+            store.flush()
+
+
+def _convert_pages(
+    notebook_path: Path,
+    notebook_dir: Path,
+    root_dir: Path,
+    page_cache: Optional[PageCache] = None
+) -> List[Path]:
     # Read notebook
-    with open(notebook_path) as f:
-        nb = nbformat.read(f, as_version=4)
+    with stage("read"):
+        nb = read_notebook(notebook_path)
     
     # Setup static directory for resources
     notebook_name = notebook_path.stem
@@ -531,8 +766,11 @@ def convert_notebook(notebook_path: Path, notebook_dir: Path, root_dir: Path) ->
     # Calculate relative path for GitHub edit URL - always use the original notebook path
     original_notebook_path = str(notebook_path.relative_to(root_dir))
     
+    # Find the chapter and pagebreak cells once for all stages
+    layout = NotebookLayout(nb)
+    
     # Check if this is a single-pager notebook (no pagebreaks)
-    if not has_pagebreaks(nb):
+    if not layout.has_pagebreaks:
         # For single-pagers, create a single MDX file in the same directory
         output_path = notebook_dir / f"{notebook_name}.mdx"
         result = export_notebook_cell_to_mdx(
@@ -540,7 +778,9 @@ def convert_notebook(notebook_path: Path, notebook_dir: Path, root_dir: Path) ->
             output_path, 
             static_dir, 
             notebook_name, 
-            notebook_path=original_notebook_path
+            notebook_path=original_notebook_path,
+            page_cache=page_cache,
+            layout=layout
         )
         append_to_gitignore(output_path)
         return [result]
@@ -557,14 +797,16 @@ def convert_notebook(notebook_path: Path, notebook_dir: Path, root_dir: Path) ->
         nb, 
         multi_page_dir, 
         static_dir, 
-        notebook_path=original_notebook_path
+        notebook_path=original_notebook_path,
+        page_cache=page_cache,
+        layout=layout
     )
     
     # Extract edit URL from chapter frontmatter - this will be the URL to the original notebook
     edit_url = extract_edit_url_from_frontmatter(chapter_frontmatter)
     
     # Split notebook into sections
-    sections = split_notebook_cells(nb)
+    sections = split_notebook_cells(nb, layout)
     
     if not sections:
         print(f"Warning: No valid sections found in {notebook_path}")
@@ -591,15 +833,23 @@ def convert_notebook(notebook_path: Path, notebook_dir: Path, root_dir: Path) ->
                 output_path, 
                 static_dir, 
                 notebook_name, 
-                frontmatter=section_frontmatter
+                frontmatter=section_frontmatter,
+                page_cache=page_cache
             )
             
             output_paths.append(output_path)
             
         except Exception as e:
+            # Fail the notebook, so its pages are kept and it is converted again
             print(f"Error processing section {i}: {e}")
-            continue
-    
+            raise
+
+    # Remove pages left over from sections that no longer exist
+    for stale_page in multi_page_dir.glob("autogen-page-*.mdx"):
+        if stale_page not in output_paths:
+            stale_page.unlink()
+            print(f"Removed stale {stale_page}")
+
     return output_paths
 
 
@@ -608,10 +858,45 @@ if __name__ == "__main__":
     import sys
     
     parser = argparse.ArgumentParser(description="Convert Jupyter notebooks to multiple markdown files")
-    parser.add_argument("notebook", type=Path, help="Input notebook path")
+    parser.add_argument("notebook", type=Path, nargs="?", help="Input notebook path (the root directory with --serve)")
     parser.add_argument("root_dir", type=Path, nargs="?", default=".", help="Root directory of the project")
+    parser.add_argument("--serve", action="store_true", help="Keep running and convert notebooks sent by `notebook_daemon.py convert`")
+    parser.add_argument("--no-jinja-cache", action="store_true", help="Do not use the on-disk Jinja bytecode cache")
+    parser.add_argument("--engine", choices=ENGINES, default="nbconvert", help="Page renderer (default: %(default)s)")
+    parser.add_argument("--publish", action="store_true", help="Publish the notebook's assets to static/img/notebooks")
+    parser.add_argument("--hash", choices=HASH_ALGORITHMS, default="md5", help="Hash used to name extracted assets (default: md5)")
+    parser.add_argument("--validate", action="store_true", help="Validate the notebook against the nbformat schema")
+    parser.add_argument("--optimize-images", action="store_true", help="Recompress PNG outputs and add smaller WebP/AVIF variants (requires Pillow)")
+    parser.add_argument("--image-formats", nargs="+", choices=SUPPORTED_IMAGE_FORMATS, default=SUPPORTED_IMAGE_FORMATS, help="Variant formats for --optimize-images, in order of preference (default: avif webp)")
+    parser.add_argument("--optimize-svg", action="store_true", help="Minify SVG outputs and rasterize very large ones (rasterizing requires cairosvg)")
+    parser.add_argument("--svg-precision", type=int, default=DEFAULT_SVG_SETTINGS["precision"], help="Decimal places kept in SVG coordinates (default: %(default)s)")
+    parser.add_argument("--svg-max-bytes", type=int, default=DEFAULT_SVG_SETTINGS["max_bytes"], help="Rasterize minified SVGs larger than this (default: %(default)s)")
+    parser.add_argument("--svg-max-elements", type=int, default=DEFAULT_SVG_SETTINGS["max_elements"], help="Rasterize SVGs with more elements than this (default: %(default)s)")
     
     args = parser.parse_args()
+    if args.serve:
+        from notebook_daemon import serve
+
+        # Options are sent with each request
+        serve(args.notebook or args.root_dir)
+        sys.exit(0)
+    if args.notebook is None:
+        parser.error("the notebook argument is required")
+    set_engine(args.engine)
+    try:
+        set_hash_algorithm(args.hash)
+        set_image_formats(args.image_formats if args.optimize_images else [])
+        set_svg_settings({
+            "precision": args.svg_precision,
+            "max_bytes": args.svg_max_bytes,
+            "max_elements": args.svg_max_elements,
+        } if args.optimize_svg else None)
+    except (RuntimeError, ValueError) as e:
+        parser.error(str(e))
+    set_validate_notebooks(args.validate)
+    
+    if not args.no_jinja_cache:
+        set_bytecode_cache_dir(args.root_dir / "_intermediate" / "jinja-cache")
     
     if not args.notebook.exists():
         print(f"Error: Notebook {args.notebook} does not exist")
@@ -620,3 +905,8 @@ if __name__ == "__main__":
     notebook_dir = args.notebook.parent
     output_paths = convert_notebook(args.notebook, notebook_dir, args.root_dir)
     print(f"\nCreated {len(output_paths)} files")
+    if args.publish:
+        static_dir = args.root_dir / "_intermediate" / "static" / "img"
+        asset_paths = [p for p in collect_assets(output_paths, static_dir) if p.exists()]
+        published = publish_assets(asset_paths, static_dir, args.root_dir / "static" / "img")
+        print(f"Published {published} new assets")
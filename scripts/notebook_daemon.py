@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""Conversion server that keeps nbconvert, the compiled template and the asset index loaded.
+
+`serve()` (or `notebook_convert.py --serve`) listens on a Unix socket and
+converts notebooks in its own process. The client (`convert`) sends it a
+request and prints the result, or converts in-process if no server is running.
+The client itself imports nothing but the standard library, so a conversion
+through the server costs one interpreter startup and no module loading.
+
+Requests and responses are single lines of JSON. A request names the notebook,
+the root directory and the conversion options as command line arguments of
+`convert_all_notebooks.py` (e.g. `["--optimize-svg"]`), which the server
+parses. The server stops when the converter sources change, and the client
+then converts in-process.
+"""
+import argparse
+import io
+import json
+import signal
+import socket
+import sys
+from contextlib import redirect_stderr, redirect_stdout
+from pathlib import Path
+from typing import Dict, List, Optional
+
+# Socket of the conversion server, relative to the root directory
+SOCKET_PATH = Path("_intermediate") / "convert.sock"
+
+
+def convert_request(request: Dict) -> Dict:
+    """Convert the notebook of a request in this process and return the response.
+
+    The response holds the output paths (None on failure), the number of
+    published assets, the conversion log and the error message if any.
+    """
+    from convert_all_notebooks import JINJA_CACHE_PATH, apply_options, parse_options
+    from notebook_assets import get_store, publish_assets
+    from notebook_convert import convert_notebook, set_bytecode_cache_dir
+    from notebook_manifest import collect_assets
+
+    root_dir = Path(request["root_dir"])
+    notebook_path = Path(request["notebook"])
+    static_dir = root_dir / "_intermediate" / "static" / "img"
+    log = io.StringIO()
+    response = {"output_paths": None, "published": 0, "error": None}
+    try:
+        with redirect_stdout(log), redirect_stderr(log):
+            apply_options(parse_options(request.get("args", [])))
+            set_bytecode_cache_dir(root_dir / JINJA_CACHE_PATH)
+            if not notebook_path.exists():
+                raise FileNotFoundError(f"Notebook {notebook_path} does not exist")
+            store = get_store(static_dir / "notebooks")
+            store.revalidate()
+            output_paths = convert_notebook(notebook_path, notebook_path.parent, root_dir)
+            store.mark_synced()
+            if request.get("publish"):
+                asset_paths = [p for p in collect_assets(output_paths, static_dir) if p.exists()]
+                response["published"] = publish_assets(asset_paths, static_dir, root_dir / "static" / "img")
+        response["output_paths"] = [str(p) for p in output_paths]
+    except SystemExit:
+        # Invalid options, reported by argparse in the log
+        response["error"] = f"Invalid options: {' '.join(request.get('args', []))}"
+    except Exception as e:
+        response["error"] = str(e)
+    response["log"] = log.getvalue()
+    return response
+
+
+def _send(conn: socket.socket, message: Dict):
+    conn.sendall(json.dumps(message).encode() + b"\n")
+
+
+def _receive(conn: socket.socket) -> Optional[Dict]:
+    with conn.makefile("rb") as f:
+        line = f.readline()
+    return json.loads(line) if line else None
+
+
+def _is_serving(socket_path: Path) -> bool:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as conn:
+        try:
+            conn.connect(str(socket_path))
+        except OSError:
+            return False
+    return True
+
+
+def serve(root_dir: Path, socket_path: Optional[Path] = None):
+    """Serve conversion requests on a Unix socket until interrupted.
+
+    Requests are handled one at a time. nbconvert, the compiled template and
+    the asset store index are loaded before the socket accepts connections and
+    kept across requests; the index is rescanned if another process changed
+    the store in between (see `AssetStore.revalidate()`).
+    """
+    from convert_all_notebooks import JINJA_CACHE_PATH
+    from notebook_assets import get_store
+    from notebook_convert import get_exporter, set_bytecode_cache_dir
+    from notebook_manifest import converter_fingerprint
+
+    root_dir = Path(root_dir).resolve()
+    socket_path = Path(socket_path or root_dir / SOCKET_PATH)
+    if _is_serving(socket_path):
+        raise RuntimeError(f"A conversion server is already listening on {socket_path}")
+
+    fingerprint = converter_fingerprint()
+    set_bytecode_cache_dir(root_dir / JINJA_CACHE_PATH)
+    get_exporter().template
+    store = get_store(root_dir / "_intermediate" / "static" / "img" / "notebooks")
+    store.blobs
+    store.mark_synced()
+
+    socket_path.parent.mkdir(parents=True, exist_ok=True)
+    if socket_path.exists() or socket_path.is_symlink():
+        # Left behind by a server that did not shut down cleanly
+        socket_path.unlink()
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(str(socket_path))
+    server.listen()
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    print(f"Serving conversions for {root_dir} on {socket_path}. Press Ctrl+C to stop.", flush=True)
+    try:
+        while True:
+            conn, _ = server.accept()
+            with conn:
+                request = _receive(conn)
+                if request is None:
+                    continue
+                if converter_fingerprint() != fingerprint:
+                    _send(conn, {"restart": True})
+                    print("The converter changed; stopping so that it is reloaded.")
+                    break
+                response = convert_request(request)
+                _send(conn, response)
+                status = "✗ " + response["error"] if response["error"] else f"✓ {len(response['output_paths'])} files"
+                print(f"{request['notebook']}: {status}", flush=True)
+    except KeyboardInterrupt:
+        print("\nStopped serving.")
+    finally:
+        server.close()
+        socket_path.unlink(missing_ok=True)
+
+
+def request_conversion(request: Dict, socket_path: Path) -> Optional[Dict]:
+    """Send a request to the conversion server. Returns None if no server handled it."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as conn:
+        try:
+            conn.connect(str(socket_path))
+        except OSError:
+            return None
+        _send(conn, request)
+        conn.shutdown(socket.SHUT_WR)
+        response = _receive(conn)
+    if response is None or response.get("restart"):
+        return None
+    return response
+
+
+def convert(
+    notebook_path: Path,
+    root_dir: Path,
+    args: Optional[List[str]] = None,
+    publish: bool = False,
+    socket_path: Optional[Path] = None,
+    use_server: bool = True
+) -> Dict:
+    """Convert a notebook through the conversion server, or in-process if none is running.
+
+    `args` are conversion options as `convert_all_notebooks.py` arguments.
+    Returns the response of `convert_request()` with `served` set to whether
+    the server converted the notebook.
+    """
+    root_dir = Path(root_dir).resolve()
+    request = {
+        "notebook": str(Path(notebook_path).resolve()),
+        "root_dir": str(root_dir),
+        "args": list(args or []),
+        "publish": publish,
+    }
+    if use_server:
+        response = request_conversion(request, Path(socket_path or root_dir / SOCKET_PATH))
+        if response is not None:
+            return {**response, "served": True}
+    return {**convert_request(request), "served": False}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert notebooks through a long-lived conversion server")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    serve_parser = subparsers.add_parser("serve", help="Run the conversion server")
+    serve_parser.add_argument("root_dir", type=Path, nargs="?", default=".", help="Root directory of the project")
+    serve_parser.add_argument("--socket", type=Path, help=f"Socket to listen on (default: <root_dir>/{SOCKET_PATH})")
+    convert_parser = subparsers.add_parser(
+        "convert", help="Convert a notebook with the server, or in-process if none is running",
+        epilog="Other options (e.g. --optimize-svg) are passed on as for convert_all_notebooks.py."
+    )
+    convert_parser.add_argument("notebook", type=Path, help="Input notebook path")
+    convert_parser.add_argument("root_dir", type=Path, nargs="?", default=".", help="Root directory of the project")
+    convert_parser.add_argument("--publish", action="store_true", help="Publish the notebook's assets to static/img/notebooks")
+    convert_parser.add_argument("--socket", type=Path, help=f"Socket of the server (default: <root_dir>/{SOCKET_PATH})")
+    convert_parser.add_argument("--no-server", action="store_true", help="Convert in-process even if a server is running")
+
+    args, option_args = parser.parse_known_args()
+    if args.command == "serve":
+        if option_args:
+            parser.error(f"unrecognized arguments: {' '.join(option_args)}")
+        serve(args.root_dir, args.socket)
+        sys.exit(0)
+
+    response = convert(args.notebook, args.root_dir, option_args, args.publish, args.socket, not args.no_server)
+    print(response["log"], end="")
+    if response["error"] is not None:
+        print(f"Error: {response['error']}")
+        sys.exit(1)
+    print(f"\nCreated {len(response['output_paths'])} files" + ("" if response["served"] else " (no server running)"))
+    if args.publish:
+        print(f"Published {response['published']} new assets")
@@ -0,0 +1,122 @@
+import os
+import re
+import subprocess
+from functools import lru_cache
+from pathlib import Path
+from typing import List, Optional, Sequence
+
+# Globs of the notebooks to convert and of the files and directories to skip,
+# relative to the root directory. Globs without a "/" match a name at any
+# depth, globs starting with "/" only match from the root. "**" matches any
+# number of directories. Excluded directories are not descended into.
+DEFAULT_INCLUDE = ["*.ipynb"]
+DEFAULT_EXCLUDE = ["tests", "node_modules", "/build", "_intermediate", ".*"]
+
+INCLUDE: List[str] = list(DEFAULT_INCLUDE)
+EXCLUDE: List[str] = list(DEFAULT_EXCLUDE)
+# List notebooks with `git ls-files` when the root is inside a git repository
+USE_GIT = True
+
+
+def set_discovery_options(
+    include: Optional[Sequence[str]] = None,
+    exclude: Optional[Sequence[str]] = None,
+    use_git: bool = True
+):
+    """Set the globs of `find_notebooks()`. `exclude` globs are added to `DEFAULT_EXCLUDE`."""
+    global INCLUDE, EXCLUDE, USE_GIT
+    INCLUDE = list(include or DEFAULT_INCLUDE)
+    EXCLUDE = DEFAULT_EXCLUDE + list(exclude or [])
+    USE_GIT = use_git
+
+
+@lru_cache(maxsize=None)
+def _compile(pattern: str) -> re.Pattern:
+    """Translate a glob into a regex matching relative POSIX paths."""
+    if "/" not in pattern.rstrip("/"):
+        pattern = "**/" + pattern
+    pattern = pattern.lstrip("/").rstrip("/")
+    parts = []
+    i = 0
+    while i < len(pattern):
+        if pattern.startswith("**/", i):
+            parts.append("(?:.*/)?")
+            i += 3
+        elif pattern.startswith("**", i):
+            parts.append(".*")
+            i += 2
+        elif pattern[i] == "*":
+            parts.append("[^/]*")
+            i += 1
+        elif pattern[i] == "?":
+            parts.append("[^/]")
+            i += 1
+        else:
+            parts.append(re.escape(pattern[i]))
+            i += 1
+    return re.compile("".join(parts) + r"\Z")
+
+
+def matches(rel_path: str, patterns: Sequence[str]) -> bool:
+    """Check whether a relative POSIX path matches any of the globs."""
+    return any(_compile(pattern).match(rel_path) for pattern in patterns)
+
+
+def _is_selected(rel_path: str, include: Sequence[str], exclude: Sequence[str]) -> bool:
+    """Check a file and each of its parent directories against the globs."""
+    parts = rel_path.split("/")
+    for depth in range(1, len(parts)):
+        if matches("/".join(parts[:depth]), exclude):
+            return False
+    return matches(rel_path, include) and not matches(rel_path, exclude)
+
+
+def _walk(directory: Path, include: Sequence[str], exclude: Sequence[str]) -> List[str]:
+    found = []
+    for root, dirs, files in os.walk(directory):
+        rel_root = os.path.relpath(root, directory).replace(os.sep, "/")
+        prefix = "" if rel_root == "." else rel_root + "/"
+        # Prune excluded directories before os.walk descends into them
+        dirs[:] = [d for d in dirs if not matches(prefix + d, exclude)]
+        for file in files:
+            rel_path = prefix + file
+            if file.endswith(".ipynb") and matches(rel_path, include) and not matches(rel_path, exclude):
+                found.append(rel_path)
+    return found
+
+
+def _git_ls_files(directory: Path) -> Optional[List[str]]:
+    """List the tracked and untracked, not ignored notebooks below `directory`, or None outside of git."""
+    try:
+        result = subprocess.run(
+            ["git", "ls-files", "-z", "--cached", "--others", "--exclude-standard", "--", "*.ipynb"],
+            cwd=directory, capture_output=True, check=True
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    # Deleted notebooks are still listed until the deletion is committed
+    return sorted({p for p in result.stdout.decode().split("\0") if p and (directory / p).is_file()})
+
+
+def find_notebooks(
+    directory: Path,
+    include: Optional[Sequence[str]] = None,
+    exclude: Optional[Sequence[str]] = None,
+    use_git: Optional[bool] = None
+) -> List[Path]:
+    """Find the `.ipynb` files below `directory` selected by the include and exclude globs.
+
+    Defaults to the globs set with `set_discovery_options()`. Inside a git
+    repository, the candidates are listed with `git ls-files`, which skips
+    files ignored by git; otherwise the tree is walked, pruning excluded
+    directories. Returns sorted paths.
+    """
+    directory = Path(directory)
+    include = INCLUDE if include is None else include
+    exclude = EXCLUDE if exclude is None else exclude
+    candidates = _git_ls_files(directory) if (USE_GIT if use_git is None else use_git) else None
+    if candidates is None:
+        found = _walk(directory, include, exclude)
+    else:
+        found = [p for p in candidates if _is_selected(p, include, exclude)]
+    return [directory / p for p in sorted(found)]
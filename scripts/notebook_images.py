@@ -0,0 +1,297 @@
+import hashlib
+import io
+import json
+import os
+import re
+import xml.etree.ElementTree as ET
+from typing import Dict, List, Optional, Tuple
+
+from notebook_assets import AssetStore
+
+# Modern formats to generate for PNG and JPEG outputs, in order of preference.
+# Empty to disable image optimization. See `set_image_formats()`.
+IMAGE_FORMATS: List[str] = []
+SUPPORTED_IMAGE_FORMATS = ["avif", "webp"]
+
+# Encoder settings. Part of the cache key, so changing them re-optimizes every image.
+IMAGE_SETTINGS = {
+    "png": {"optimize": True},
+    "webp": {"lossless_png": True, "quality": 80, "method": 4},
+    "avif": {"quality": 70, "speed": 6},
+}
+
+# Directory in the asset store that caches optimization results per source blob
+CACHE_DIR_NAME = "images"
+
+MIME_TYPES = {"avif": "image/avif", "webp": "image/webp"}
+
+# SVG optimization settings, or None to keep SVG outputs as they are. See `set_svg_settings()`.
+SVG_SETTINGS: Optional[Dict] = None
+DEFAULT_SVG_SETTINGS = {
+    # Decimal places kept for coordinates; transforms keep three more
+    "precision": 2,
+    # Minified SVGs larger than this, or with more elements, are rasterized
+    "max_bytes": 1 << 20,
+    "max_elements": 20000,
+    # Pixels per SVG user unit of the rasterized image
+    "raster_scale": 2,
+}
+
+SVG_NAMESPACE = "http://www.w3.org/2000/svg"
+XLINK_NAMESPACE = "http://www.w3.org/1999/xlink"
+ET.register_namespace("", SVG_NAMESPACE)
+ET.register_namespace("xlink", XLINK_NAMESPACE)
+
+_SVG_NUMBER = re.compile(r"-?\d*\.\d+(?:[eE][-+]?\d+)?")
+_SVG_URL_REFERENCE = re.compile(r"url\(#([^)]+)\)")
+# Elements whose whitespace is rendered
+_SVG_TEXT_ELEMENTS = {"text", "tspan", "textPath", "title", "desc"}
+
+
+def set_image_formats(formats: List[str]):
+    """Enable image optimization with variants in the given formats (empty to disable).
+
+    Requires Pillow, with AVIF support for "avif".
+    """
+    global IMAGE_FORMATS
+    if formats:
+        try:
+            from PIL import features
+        except ImportError:
+            raise RuntimeError("Optimizing images requires Pillow") from None
+
+        for fmt in formats:
+            if fmt not in SUPPORTED_IMAGE_FORMATS:
+                raise ValueError(f"Unknown image format: {fmt}")
+            if not features.check(fmt):
+                raise ValueError(f"Pillow was built without {fmt} support")
+    IMAGE_FORMATS = list(formats)
+
+
+def set_svg_settings(settings: Optional[Dict]):
+    """Enable SVG optimization with settings overriding `DEFAULT_SVG_SETTINGS` (None to disable)."""
+    global SVG_SETTINGS
+    if settings is None:
+        SVG_SETTINGS = None
+        return
+    unknown = set(settings) - set(DEFAULT_SVG_SETTINGS)
+    if unknown:
+        raise ValueError(f"Unknown SVG settings: {', '.join(sorted(unknown))}")
+    SVG_SETTINGS = {**DEFAULT_SVG_SETTINGS, **settings}
+
+
+def _settings_key(formats: List[str], **extra) -> str:
+    payload = json.dumps({"formats": formats, "settings": IMAGE_SETTINGS, **extra}, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()[:12]
+
+
+def _read_cache(store: AssetStore, cache_path) -> Optional[Dict]:
+    """Return a cached optimization result if all the blobs it names still exist."""
+    try:
+        with open(cache_path) as f:
+            cached = json.load(f)
+        blobs = [b for b in cached.pop("blobs") if b is not None]
+        if all(name in store.blobs for name in blobs):
+            return cached
+    except (OSError, ValueError, KeyError, TypeError, AttributeError):
+        pass
+    return None
+
+
+def _write_cache(cache_path, result: Dict, blobs: List[str]):
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = cache_path.with_name(f".{cache_path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump({**result, "blobs": blobs}, f)
+    os.replace(tmp_path, cache_path)
+
+
+def _encode(image, fmt: str, lossless: bool) -> bytes:
+    buffer = io.BytesIO()
+    if fmt == "png":
+        image.save(buffer, "PNG", **IMAGE_SETTINGS["png"])
+    elif fmt == "webp":
+        settings = IMAGE_SETTINGS["webp"]
+        if lossless and settings["lossless_png"]:
+            image.save(buffer, "WEBP", lossless=True, method=settings["method"])
+        else:
+            image.save(buffer, "WEBP", quality=settings["quality"], method=settings["method"])
+    else:
+        image.save(buffer, fmt.upper(), **IMAGE_SETTINGS[fmt])
+    return buffer.getvalue()
+
+
+def optimize_image(store: AssetStore, blob: str, formats: Optional[List[str]] = None) -> Tuple[str, List[Tuple[str, str]]]:
+    """Optimize a PNG or JPEG blob and create smaller variants in modern formats.
+
+    PNGs are recompressed losslessly and replaced if that makes them smaller;
+    JPEGs are kept as they are. A variant is only kept if it is smaller than the
+    fallback. Returns the fallback blob and `(format, blob)` pairs of the
+    variants, in order of preference.
+
+    Results are cached in the store by source blob and settings, so an image is
+    only optimized once across builds.
+    """
+    formats = IMAGE_FORMATS if formats is None else formats
+    cache_path = store.dir / CACHE_DIR_NAME / f"{blob}.{_settings_key(formats)}.json"
+    cached = _read_cache(store, cache_path)
+    if cached is not None:
+        return cached["fallback"], [tuple(v) for v in cached["variants"]]
+
+    from PIL import Image
+
+    source_path = store.blob_path(blob)
+    with Image.open(source_path) as image:
+        image.load()
+        lossless = image.format == "PNG"
+        fallback, fallback_size = blob, os.path.getsize(source_path)
+        if lossless:
+            data = _encode(image, "png", lossless)
+            if len(data) < fallback_size:
+                fallback, fallback_size = store.add_bytes(data, "png"), len(data)
+        variants = []
+        for fmt in formats:
+            data = _encode(image, fmt, lossless)
+            if len(data) < fallback_size:
+                variants.append((fmt, store.add_bytes(data, fmt)))
+
+    _write_cache(cache_path, {"fallback": fallback, "variants": variants}, [fallback] + [b for _, b in variants])
+    return fallback, variants
+
+
+def _local_name(tag) -> str:
+    return tag.rsplit("}", 1)[-1] if isinstance(tag, str) else ""
+
+
+def _round_numbers(value: str, precision: int) -> str:
+    def round_number(match):
+        number = f"{float(match.group()):.{precision}f}".rstrip("0").rstrip(".")
+        return "0" if number in ("", "-0") else number
+
+    return _SVG_NUMBER.sub(round_number, value)
+
+
+def minify_svg(data: bytes, precision: int = 2) -> Tuple[bytes, int]:
+    """Minify an SVG and return it with its number of elements.
+
+    Removes `<metadata>`, comments and whitespace between elements, rounds
+    decimal numbers in attributes to `precision` places (transforms keep three
+    more, since they scale everything inside of them) and merges identical
+    elements in `<defs>`, pointing references to the duplicates at the first
+    one. Raises `xml.etree.ElementTree.ParseError` for invalid SVGs.
+    """
+    root = ET.fromstring(data)
+    href_keys = ("href", f"{{{XLINK_NAMESPACE}}}href")
+
+    for parent in list(root.iter()):
+        for child in list(parent):
+            if _local_name(child.tag) == "metadata":
+                parent.remove(child)
+
+    for element in root.iter():
+        name = _local_name(element.tag)
+        for key, value in element.attrib.items():
+            if key == "id" or key in href_keys:
+                continue
+            if key in ("d", "points"):
+                value = " ".join(value.split())
+            places = precision + 3 if key.endswith("transform") else precision
+            element.set(key, _round_numbers(value, places))
+        if name == "style" and element.text:
+            element.text = " ".join(element.text.split())
+        if name not in _SVG_TEXT_ELEMENTS:
+            if element.text is not None and not element.text.strip():
+                element.text = None
+            for child in element:
+                if child.tail is not None and not child.tail.strip():
+                    child.tail = None
+
+    # Merge identical definitions, e.g. the markers matplotlib defines for every line
+    first_ids = {}
+    duplicates = {}
+    for parent in list(root.iter()):
+        for defs in list(parent):
+            if _local_name(defs.tag) != "defs":
+                continue
+            for child in list(defs):
+                element_id = child.attrib.pop("id", None)
+                key = ET.tostring(child)
+                if element_id is not None:
+                    child.set("id", element_id)
+                if key not in first_ids:
+                    first_ids[key] = element_id
+                elif element_id is None or first_ids[key] is not None:
+                    defs.remove(child)
+                    if element_id is not None:
+                        duplicates[element_id] = first_ids[key]
+            if len(defs) == 0:
+                parent.remove(defs)
+
+    if duplicates:
+        for element in root.iter():
+            for key, value in element.attrib.items():
+                if key in href_keys:
+                    if value.startswith("#") and value[1:] in duplicates:
+                        element.set(key, "#" + duplicates[value[1:]])
+                elif "url(#" in value:
+                    element.set(key, _SVG_URL_REFERENCE.sub(lambda m: f"url(#{duplicates.get(m.group(1), m.group(1))})", value))
+
+    # ElementTree escapes ">" in attribute values, so " />" only ends empty elements
+    minified = ET.tostring(root, encoding="utf-8", xml_declaration=False).replace(b" />", b"/>")
+    return minified, sum(1 for _ in root.iter())
+
+
+def _cairosvg():
+    try:
+        import cairosvg
+    except (ImportError, OSError):  # OSError: the cairo library itself is missing
+        return None
+    return cairosvg
+
+
+def rasterize_svg(data: bytes, scale: float) -> bytes:
+    """Render an SVG to PNG. Requires cairosvg."""
+    cairosvg = _cairosvg()
+    if cairosvg is None:
+        raise RuntimeError("Rasterizing SVGs requires cairosvg and the cairo library")
+    return cairosvg.svg2png(bytestring=data, scale=scale)
+
+
+def optimize_svg(store: AssetStore, blob: str) -> Tuple[str, Optional[Tuple[str, List[Tuple[str, str]]]]]:
+    """Minify an SVG blob and rasterize it if it is still too large to display efficiently.
+
+    Returns the minified SVG blob (or the original one if it cannot be parsed or
+    minifying does not make it smaller) and, for SVGs above the `max_bytes` or
+    `max_elements` thresholds of `SVG_SETTINGS`, the PNG fallback blob and
+    variants of the rasterized image as returned by `optimize_image()`. The
+    rasterized image is None if cairosvg is not available.
+
+    Results are cached in the store by source blob and settings.
+    """
+    settings = SVG_SETTINGS or DEFAULT_SVG_SETTINGS
+    can_rasterize = _cairosvg() is not None
+    key = _settings_key(IMAGE_FORMATS, svg=settings, rasterize=can_rasterize)
+    cache_path = store.dir / CACHE_DIR_NAME / f"{blob}.{key}.json"
+    cached = _read_cache(store, cache_path)
+    if cached is not None:
+        raster = cached["raster"]
+        return cached["svg"], raster and (raster[0], [tuple(v) for v in raster[1]])
+
+    with open(store.blob_path(blob), "rb") as f:
+        data = f.read()
+    svg_blob, raster = blob, None
+    try:
+        minified, num_elements = minify_svg(data, settings["precision"])
+    except ET.ParseError:
+        minified, num_elements = data, 0
+    else:
+        if len(minified) < len(data):
+            svg_blob = store.add_bytes(minified, "svg")
+
+    if can_rasterize and (len(minified) > settings["max_bytes"] or num_elements > settings["max_elements"]):
+        png_blob = store.add_bytes(rasterize_svg(minified, settings["raster_scale"]), "png")
+        raster = optimize_image(store, png_blob) if IMAGE_FORMATS else (png_blob, [])
+
+    blobs = [svg_blob] + ([raster[0]] + [b for _, b in raster[1]] if raster else [])
+    _write_cache(cache_path, {"svg": svg_blob, "raster": raster}, blobs)
+    return svg_blob, raster
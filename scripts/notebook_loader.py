@@ -0,0 +1,316 @@
+import hashlib
+import json
+import mmap
+import os
+import re
+from bisect import bisect_right
+from pathlib import Path
+from textwrap import dedent
+from typing import List, Optional, Tuple, Union
+
+import nbformat
+from nbformat.notebooknode import NotebookNode, from_dict
+from nbformat.v4.rwbase import rejoin_lines, strip_transient
+
+try:
+    import orjson
+except ImportError:  # Optional, the standard library decoder is used instead
+    orjson = None
+
+# Run nbformat's full jsonschema validation on every notebook instead of only
+# when the fast loader finds something unexpected.
+VALIDATE_NOTEBOOKS = False
+
+CELL_TYPES = {"code", "markdown", "raw"}
+OUTPUT_TYPES = {"stream", "display_data", "execute_result", "error"}
+
+# Notebooks at least this large are memory-mapped, and the large base64
+# payloads of their outputs are only read from the file when needed.
+LAZY_LOAD_MIN_SIZE = 32 << 20
+
+# Runs of base64 characters at least this long are left in the file
+LAZY_MIN_CHARS = 64 << 10
+
+# Output data of these MIME types is kept lazy; other data is read at load time
+LAZY_MIME_PREFIXES = ("image/", "video/", "text/")
+
+# Candidate runs are matched with a small minimum length, so runs that turn out
+# too short are not rescanned from every position inside them.
+_BASE64_RUN = re.compile(rb"[A-Za-z0-9+/=]{256,}")
+
+# Number of characters searched at a time by `LazyText.find()`
+_FIND_CHUNK = 1 << 20
+
+
+def _release(buffer, start: int, end: int):
+    """Drop the pages of `buffer[start:end]` from memory once they have been read.
+
+    The pages are read from the file again if they are needed later, so the
+    resident size does not grow with the amount of the file that was read.
+    """
+    start -= start % mmap.PAGESIZE
+    if end - start >= mmap.PAGESIZE and hasattr(buffer, "madvise"):
+        buffer.madvise(mmap.MADV_DONTNEED, start, end - start - (end - start) % mmap.PAGESIZE)
+
+
+class LazyText:
+    """Read-only text whose large base64 runs stay in a memory-mapped notebook file.
+
+    `segments` are strings or `(start, end)` byte ranges of `buffer`. The ranges
+    only contain base64 characters, which JSON stores verbatim, so they are
+    decoded as ASCII. Slicing reads only the requested characters and `str()`
+    reads everything. Copies share the same object.
+    """
+
+    __slots__ = ("buffer", "segments", "offsets", "length")
+
+    def __init__(self, buffer, segments: List[Union[str, Tuple[int, int]]]):
+        self.buffer = buffer
+        self.segments = segments
+        # Character offset at which each segment starts
+        self.offsets = []
+        length = 0
+        for segment in segments:
+            self.offsets.append(length)
+            length += len(segment) if isinstance(segment, str) else segment[1] - segment[0]
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+    def __repr__(self):
+        return f"<LazyText of {self.length} characters>"
+
+    def __str__(self):
+        return self[:]
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            if index < 0:
+                index += self.length
+            if not 0 <= index < self.length:
+                raise IndexError("string index out of range")
+            return self[index:index + 1]
+        start, stop, step = index.indices(self.length)
+        if step != 1:
+            return str(self)[index]
+        parts = []
+        i = max(bisect_right(self.offsets, start) - 1, 0)
+        while start < stop and i < len(self.segments):
+            segment, offset = self.segments[i], self.offsets[i]
+            begin, end = start - offset, stop - offset
+            if isinstance(segment, str):
+                part = segment[begin:end]
+            else:
+                range_start, range_end = segment[0] + begin, min(segment[0] + end, segment[1])
+                part = self.buffer[range_start:range_end].decode("ascii")
+                _release(self.buffer, range_start, range_end)
+            parts.append(part)
+            start += len(part)
+            i += 1
+        return "".join(parts)
+
+    def startswith(self, prefix: str) -> bool:
+        return self[:len(prefix)] == prefix
+
+    def find(self, sub: str, start: int = 0, end: Optional[int] = None) -> int:
+        """Like `str.find()`, reading the text a chunk at a time."""
+        end = self.length if end is None else min(end, self.length)
+        for pos in range(start, end, _FIND_CHUNK):
+            index = self[pos:min(pos + _FIND_CHUNK + len(sub) - 1, end)].find(sub)
+            if index >= 0:
+                return pos + index
+        return -1
+
+    def dedent(self) -> "LazyText":
+        """Like `textwrap.dedent()`, without reading the base64 runs.
+
+        The runs contain no whitespace, so they only count as line content:
+        each is replaced by a placeholder character while the margin is removed.
+        """
+        if any(isinstance(segment, str) and "\x00" in segment for segment in self.segments):
+            return LazyText(self.buffer, [dedent(str(self))])
+        ranges = [segment for segment in self.segments if not isinstance(segment, str)]
+        skeleton = "".join(segment if isinstance(segment, str) else "\x00" for segment in self.segments)
+        segments = []
+        for i, part in enumerate(dedent(skeleton).split("\x00")):
+            if part:
+                segments.append(part)
+            if i < len(ranges):
+                segments.append(ranges[i])
+        return LazyText(self.buffer, segments)
+
+    def digest(self) -> str:
+        """SHA-256 of the text, computed without reading it all into memory."""
+        h = hashlib.sha256()
+        for segment in self.segments:
+            if isinstance(segment, str):
+                h.update(segment.encode())
+            else:
+                for pos in range(segment[0], segment[1], _FIND_CHUNK):
+                    h.update(self.buffer[pos:min(pos + _FIND_CHUNK, segment[1])])
+                    _release(self.buffer, pos, min(pos + _FIND_CHUNK, segment[1]))
+        return h.hexdigest()
+
+
+def set_validate_notebooks(validate: bool):
+    """Always load notebooks with `nbformat.read()` and its schema validation."""
+    global VALIDATE_NOTEBOOKS
+    VALIDATE_NOTEBOOKS = validate
+
+
+def parse_notebook_json(data: bytes) -> NotebookNode:
+    """Parse notebook JSON straight into `NotebookNode` objects."""
+    if orjson is not None:
+        return from_dict(orjson.loads(data))
+    return json.loads(data, object_hook=NotebookNode)
+
+
+def is_plain_v4(nb) -> bool:
+    """Cheap structural check that a parsed notebook is a v4 notebook nbformat would accept as is.
+
+    Anything unusual (other versions, unknown cell or output types, wrong
+    types) makes the loader fall back to `nbformat.read()`.
+    """
+    if not isinstance(nb, dict) or nb.get("nbformat") != 4 or not isinstance(nb.get("nbformat_minor"), int):
+        return False
+    if not isinstance(nb.get("metadata"), dict) or not isinstance(nb.get("cells"), list):
+        return False
+    for cell in nb.cells:
+        if not isinstance(cell, dict) or cell.get("cell_type") not in CELL_TYPES:
+            return False
+        if not isinstance(cell.get("source"), (str, list)) or not isinstance(cell.get("metadata"), dict):
+            return False
+        if cell.cell_type == "code":
+            outputs = cell.get("outputs")
+            if not isinstance(outputs, list):
+                return False
+            for output in outputs:
+                if not isinstance(output, dict) or output.get("output_type") not in OUTPUT_TYPES:
+                    return False
+    return True
+
+
+def _run_start(buffer, start: int) -> int:
+    """Move the start of a base64 run past a JSON escape sequence it begins inside of."""
+    backslashes = 0
+    while start - backslashes > 0 and buffer[start - backslashes - 1] == ord("\\"):
+        backslashes += 1
+    if backslashes % 2:
+        # The first character belongs to an escape such as \n or \u00e9
+        return start + (5 if buffer[start] == ord("u") else 1)
+    return start
+
+
+def _read_mapped(notebook_path: Path) -> Optional[NotebookNode]:
+    """Memory-map a notebook and parse it without its long base64 runs.
+
+    Each long run is replaced by a marker before parsing. In output data, the
+    markers become `LazyText` segments pointing into the file; anywhere else
+    the run is read back right away. Returns None if the notebook is not a
+    plain v4 notebook.
+    """
+    with open(notebook_path, "rb") as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    nonce = os.urandom(6).hex()
+    ranges = []
+    parts = []
+    pos = released = 0
+    for match in _BASE64_RUN.finditer(buffer):
+        start = _run_start(buffer, match.start())
+        if match.end() - start < LAZY_MIN_CHARS:
+            continue
+        parts.append(buffer[pos:start])
+        parts.append(b"\\u0000%s%d\\u0000" % (nonce.encode(), len(ranges)))
+        ranges.append((start, match.end()))
+        pos = match.end()
+        _release(buffer, released, pos)
+        released = pos
+    parts.append(buffer[pos:])
+    try:
+        nb = parse_notebook_json(b"".join(parts))
+    except ValueError:
+        return None
+    del parts
+    if not is_plain_v4(nb):
+        return None
+    if not ranges:
+        return nb
+
+    marker = re.compile("\x00%s(\\d+)\x00" % nonce)
+
+    def segments(text: str):
+        for i, part in enumerate(marker.split(text)):
+            if i % 2:
+                yield ranges[int(part)]
+            elif part:
+                yield part
+
+    def expand(value):
+        if isinstance(value, str):
+            if "\x00" not in value:
+                return value
+            return "".join(s if isinstance(s, str) else buffer[s[0]:s[1]].decode("ascii") for s in segments(value))
+        if isinstance(value, list):
+            value[:] = [expand(v) for v in value]
+        elif isinstance(value, dict):
+            for key in value:
+                value[key] = expand(value[key])
+        return value
+
+    lazy_ranges = 0
+    for cell in nb.cells:
+        for output in cell.get("outputs", ()):
+            data = output.get("data")
+            if not isinstance(data, dict):
+                continue
+            for mime_type, value in data.items():
+                if not mime_type.startswith(LAZY_MIME_PREFIXES) or mime_type.endswith("json"):
+                    continue
+                texts = [value] if isinstance(value, str) else value
+                if not isinstance(texts, list) or not all(isinstance(t, str) for t in texts):
+                    continue
+                if any("\x00" in t for t in texts):
+                    lazy = LazyText(buffer, [s for t in texts for s in segments(t)])
+                    lazy_ranges += sum(not isinstance(s, str) for s in lazy.segments)
+                    data[mime_type] = lazy
+    if lazy_ranges < len(ranges):
+        # Some runs are outside of output data, e.g. in markdown images
+        expand(nb)
+    return nb
+
+
+def read_notebook(notebook_path: Path, validate: bool = None) -> NotebookNode:
+    """Read a notebook as v4, skipping schema validation for plain v4 notebooks.
+
+    The notebook is parsed with a fast JSON decoder and only normalized the way
+    nbformat's reader does it (multi-line strings joined, transient metadata
+    removed). Notebooks of at least `LAZY_LOAD_MIN_SIZE` bytes are memory-mapped
+    and large base64 output data is returned as `LazyText` (see `_read_mapped()`).
+    Notebooks that fail the structural check, or all notebooks when `validate`
+    (default: `VALIDATE_NOTEBOOKS`) is set, are read with `nbformat.read()`,
+    which converts and validates them.
+    """
+    if validate is None:
+        validate = VALIDATE_NOTEBOOKS
+    if not validate:
+        if os.path.getsize(notebook_path) >= LAZY_LOAD_MIN_SIZE:
+            nb = _read_mapped(notebook_path)
+        else:
+            with open(notebook_path, "rb") as f:
+                data = f.read()
+            try:
+                nb = parse_notebook_json(data)
+            except ValueError:
+                nb = None
+        if is_plain_v4(nb):
+            return strip_transient(rejoin_lines(nb))
+    with open(notebook_path) as f:
+        return nbformat.read(f, as_version=4)
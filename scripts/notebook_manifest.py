@@ -0,0 +1,248 @@
+import hashlib
+import json
+import os
+import re
+from importlib import metadata
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+# Bump this when the manifest layout changes so old manifests are discarded.
+MANIFEST_VERSION = 1
+
+# Location of the manifest, relative to the documentation root.
+MANIFEST_PATH = Path("_intermediate") / "build-manifest.json"
+
+SCRIPTS_DIR = Path(__file__).parent
+
+# URLs of extracted assets in generated pages, e.g. `/img/notebooks/<notebook_name>/<filename>`
+# or `/docs/img/notebooks/...`. The group is `<notebook_name>/<filename>`.
+ASSET_URL_PATTERN = re.compile(r"/notebooks/([^/\s\"')]+/[^/\s\"')]+)")
+
+# Files whose content affects the generated output. Any change to one of them
+# invalidates every entry in the manifest.
+CONVERTER_SOURCES = [
+    SCRIPTS_DIR / "notebook_convert.py",
+    SCRIPTS_DIR / "notebook_utils.py",
+    SCRIPTS_DIR / "notebook_loader.py",
+    SCRIPTS_DIR / "notebook_assets.py",
+    SCRIPTS_DIR / "notebook_images.py",
+    SCRIPTS_DIR / "notebook_render.py",
+]
+TEMPLATES_DIR = SCRIPTS_DIR / "notebook_convert_templates"
+
+
+def hash_file(path: Path) -> str:
+    """Return the SHA-256 hex digest of a file's content."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def converter_fingerprint() -> str:
+    """Hash the converter sources, templates and nbconvert version.
+
+    This does not import nbconvert, so checking the manifest stays cheap.
+    """
+    h = hashlib.sha256()
+    sources = list(CONVERTER_SOURCES) + sorted(TEMPLATES_DIR.rglob("*"))
+    for path in sources:
+        if path.is_file():
+            h.update(str(path.relative_to(SCRIPTS_DIR)).encode())
+            h.update(path.read_bytes())
+    try:
+        h.update(metadata.version("nbconvert").encode())
+    except metadata.PackageNotFoundError:
+        pass
+    return h.hexdigest()
+
+
+def build_key(notebook_hash: str, fingerprint: str, options: Optional[Dict] = None) -> str:
+    """Combine notebook content hash, converter fingerprint and options into a cache key."""
+    payload = json.dumps(
+        {"notebook": notebook_hash, "converter": fingerprint, "options": options or {}},
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _json_default(obj):
+    # Lazily loaded output data provides a digest, so hashing does not read it into memory
+    digest = getattr(obj, "digest", None)
+    return digest() if digest is not None else str(obj)
+
+
+class PageCache:
+    """Hashes of the content each generated page was rendered from.
+
+    A page whose section (cells, notebook metadata, frontmatter and notebook
+    name) hashes the same as last time, and which still exists, does not need
+    to be rendered again. `salt` should identify the converter and options so
+    that a converter change invalidates every page.
+    """
+
+    def __init__(self, salt: str = "", hashes: Optional[Dict[Path, str]] = None):
+        self.salt = salt
+        self.hashes: Dict[Path, str] = dict(hashes or {})
+
+    def page_key(self, nb, frontmatter: Optional[str], notebook_name: str) -> str:
+        # Cell ids are random for cells created while splitting, and do not affect the output
+        cells = [{k: v for k, v in cell.items() if k != "id"} for cell in nb.cells]
+        payload = json.dumps(
+            [self.salt, notebook_name, frontmatter, nb.metadata, cells], sort_keys=True, default=_json_default
+        )
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def is_fresh(self, output_path: Path, key: str) -> bool:
+        return self.hashes.get(Path(output_path)) == key and Path(output_path).exists()
+
+    def update(self, output_path: Path, key: str):
+        self.hashes[Path(output_path)] = key
+
+
+def collect_assets(output_paths: Iterable[Path], static_dir: Path) -> List[Path]:
+    """Find the extracted assets referenced by the generated MDX files.
+
+    Asset URLs look like `/img/notebooks/<notebook_name>/<filename>`, which map to
+    `<static_dir>/notebooks/<notebook_name>/<filename>`.
+    """
+    assets = set()
+    for output_path in output_paths:
+        try:
+            content = Path(output_path).read_text()
+        except OSError:
+            continue
+        for ref in ASSET_URL_PATTERN.findall(content):
+            assets.add(static_dir / "notebooks" / ref)
+    return sorted(assets)
+
+
+class BuildManifest:
+    """Persistent record of converted notebooks, their cache keys and outputs.
+
+    Entries are keyed by the notebook path relative to the root directory:
+
+        {"key": <cache key>, "outputs": {<path>: <size>}, "assets": {<path>: <size>},
+         "pages": {<path>: <page hash>}}
+
+    All paths are stored relative to the root directory.
+    """
+
+    def __init__(self, root_dir: Path):
+        self.root_dir = Path(root_dir)
+        self.path = self.root_dir / MANIFEST_PATH
+        self.entries: Dict[str, Dict] = {}
+
+    @classmethod
+    def load(cls, root_dir: Path) -> "BuildManifest":
+        """Load the manifest from disk, or start an empty one if missing or outdated."""
+        manifest = cls(root_dir)
+        try:
+            with open(manifest.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return manifest
+        if data.get("version") == MANIFEST_VERSION:
+            manifest.entries = data.get("notebooks", {})
+        return manifest
+
+    def save(self):
+        """Write the manifest atomically."""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump({"version": MANIFEST_VERSION, "notebooks": self.entries}, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+    def _rel(self, path: Path) -> str:
+        return os.path.relpath(path, self.root_dir)
+
+    def _sizes(self, paths: Iterable[Path]) -> Dict[str, int]:
+        return {self._rel(p): Path(p).stat().st_size for p in paths}
+
+    def is_fresh(self, notebook_path: Path, key: str) -> bool:
+        """Check that the notebook was converted with the same key and its outputs are intact."""
+        entry = self.entries.get(self._rel(notebook_path))
+        if entry is None or entry.get("key") != key:
+            return False
+        for rel_path, size in {**entry["outputs"], **entry["assets"]}.items():
+            try:
+                if (self.root_dir / rel_path).stat().st_size != size:
+                    return False
+            except OSError:
+                return False
+        return True
+
+    def outputs(self, notebook_path: Path) -> List[Path]:
+        """Return the recorded outputs of a notebook."""
+        entry = self.entries.get(self._rel(notebook_path), {})
+        return [self.root_dir / p for p in entry.get("outputs", {})]
+
+    def assets(self, notebook_path: Path) -> List[Path]:
+        """Return the recorded assets of a notebook."""
+        entry = self.entries.get(self._rel(notebook_path), {})
+        return [self.root_dir / p for p in entry.get("assets", {})]
+
+    def output_sizes(self, notebook_path: Path) -> Dict[Path, int]:
+        """Return the recorded outputs of a notebook with their sizes."""
+        entry = self.entries.get(self._rel(notebook_path), {})
+        return {self.root_dir / p: size for p, size in entry.get("outputs", {}).items()}
+
+    def asset_sizes(self, notebook_path: Path) -> Dict[Path, int]:
+        """Return the recorded assets of a notebook with their sizes."""
+        entry = self.entries.get(self._rel(notebook_path), {})
+        return {self.root_dir / p: size for p, size in entry.get("assets", {}).items()}
+
+    def all_assets(self) -> List[Path]:
+        """Return the recorded assets of all notebooks."""
+        return sorted({self.root_dir / p for entry in self.entries.values() for p in entry.get("assets", {})})
+
+    def page_hashes(self, notebook_path: Path) -> Dict[Path, str]:
+        """Return the recorded page hashes of a notebook, for use with `PageCache`."""
+        entry = self.entries.get(self._rel(notebook_path), {})
+        return {self.root_dir / p: h for p, h in entry.get("pages", {}).items()}
+
+    def record(
+        self,
+        notebook_path: Path,
+        key: str,
+        output_paths: List[Path],
+        asset_paths: List[Path],
+        page_hashes: Optional[Dict[Path, str]] = None
+    ) -> List[Path]:
+        """Record a successful conversion and return outputs that are no longer produced."""
+        previous = set(self.entries.get(self._rel(notebook_path), {}).get("outputs", {}))
+        outputs = self._sizes(output_paths)
+        pages = {self._rel(p): h for p, h in (page_hashes or {}).items()}
+        self.entries[self._rel(notebook_path)] = {
+            "key": key,
+            "outputs": outputs,
+            "assets": self._sizes(p for p in asset_paths if Path(p).exists()),
+            "pages": {p: h for p, h in pages.items() if p in outputs},
+        }
+        return [self.root_dir / p for p in sorted(previous - set(outputs))]
+
+    def forget(self, notebook_path: Path):
+        """Drop a notebook from the manifest so it is reconverted on the next run."""
+        self.entries.pop(self._rel(notebook_path), None)
+
+    def remove_missing(self, notebook_paths: Iterable[Path]) -> List[Path]:
+        """Drop entries for notebooks that no longer exist and return their outputs."""
+        current = {self._rel(p) for p in notebook_paths}
+        stale_outputs = []
+        for rel_path in sorted(set(self.entries) - current):
+            stale_outputs.extend(self.root_dir / p for p in self.entries.pop(rel_path)["outputs"])
+        return stale_outputs
+
+
+def prune_outputs(paths: Iterable[Path]) -> int:
+    """Delete generated files that are no longer produced. Returns the number removed."""
+    removed = 0
+    for path in paths:
+        path = Path(path)
+        if path.exists():
+            path.unlink()
+            print(f"Removed stale {path}")
+            removed += 1
+    return removed
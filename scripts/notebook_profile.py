@@ -0,0 +1,95 @@
+import cProfile
+import json
+import os
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional
+
+# Seconds spent in each conversion stage in this process. Times are exclusive:
+# a stage nested in another one (e.g. "assets" in "preprocess") is not counted
+# in its parent, so the stages add up to the instrumented time.
+STAGE_TIMES: Dict[str, float] = {}
+
+# Trace events of the notebook being profiled, or None when not tracing
+TRACE_EVENTS: Optional[List[Dict]] = None
+
+PROFILE_FORMATS = ["cprofile", "trace"]
+PROFILE_SUFFIXES = {"cprofile": ".prof", "trace": ".trace.json"}
+
+# Time spent in the nested stages of each open stage
+_child_times: List[float] = []
+
+
+@contextmanager
+def stage(name: str):
+    """Time a stage of the conversion into `STAGE_TIMES` (and `TRACE_EVENTS` when tracing)."""
+    start = time.perf_counter()
+    _child_times.append(0.0)
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_TIMES[name] = STAGE_TIMES.get(name, 0.0) + elapsed - _child_times.pop()
+        if _child_times:
+            _child_times[-1] += elapsed
+        if TRACE_EVENTS is not None:
+            TRACE_EVENTS.append(_trace_event(name, start, elapsed))
+
+
+def stage_times_since(before: Dict[str, float]) -> Dict[str, float]:
+    """Return the time spent in each stage since `before`, a copy of `STAGE_TIMES`."""
+    return {
+        name: seconds - before.get(name, 0.0)
+        for name, seconds in STAGE_TIMES.items()
+        if seconds > before.get(name, 0.0)
+    }
+
+
+def _trace_event(name: str, start: float, elapsed: float, **args) -> Dict:
+    # Complete ("X") events of the Chrome trace event format, in microseconds
+    event = {"name": name, "ph": "X", "ts": start * 1e6, "dur": elapsed * 1e6, "pid": os.getpid(), "tid": 0}
+    if args:
+        event["args"] = args
+    return event
+
+
+def profile_path(profile_dir: Path, root_dir: Path, notebook_path: Path, fmt: str) -> Path:
+    """Return the profile file of a notebook, named after its path relative to `root_dir`."""
+    relative = notebook_path.resolve().relative_to(root_dir.resolve()).with_suffix("")
+    return profile_dir / ("__".join(relative.parts) + PROFILE_SUFFIXES[fmt])
+
+
+@contextmanager
+def profile(path: Optional[Path], fmt: str = "cprofile"):
+    """Profile the code inside the block and write the result to `path` (no-op for None).
+
+    "cprofile" writes a `pstats` dump (open it with `python -m pstats` or
+    snakeviz). "trace" writes the stage timers as Chrome trace events (open it
+    in Perfetto or chrome://tracing), which is much cheaper than cProfile.
+    """
+    global TRACE_EVENTS
+    if path is None:
+        yield
+        return
+    if fmt not in PROFILE_FORMATS:
+        raise ValueError(f"Unknown profile format: {fmt}")
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if fmt == "cprofile":
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            profiler.dump_stats(path)
+        return
+    TRACE_EVENTS = []
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        events, TRACE_EVENTS = TRACE_EVENTS, None
+        events.append(_trace_event("convert", start, time.perf_counter() - start))
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
@@ -0,0 +1,170 @@
+"""Direct-to-MDX renderer, the `native` engine of `notebook_convert`.
+
+Renders a preprocessed notebook (see `notebook_convert.CellRewriter`) to the
+same MDX as nbconvert's `MarkdownExporter` with our `mdoutput` template
+(`notebook_convert_templates/mdoutput/index.md.j2`), without the exporter,
+its Jinja template chain and its traitlets configuration. The whitespace of
+each block follows the templates it replaces: `mdoutput`, nbconvert's
+`markdown/index.md.j2` and the `base/null.j2` skeleton it extends.
+
+Changes to the template must be mirrored here; the differential test in
+`tests/test-notebook-convert.py` compares both engines on every notebook.
+"""
+import os
+import re
+from typing import Dict, List
+
+# Renderers of the pages: nbconvert's MarkdownExporter with the mdoutput
+# template, or `render_notebook()`
+ENGINES = ["nbconvert", "native"]
+ENGINE = "nbconvert"
+
+# Output MIME types in the order the markdown exporter prefers them
+DISPLAY_PRIORITY = [
+    "text/html", "text/markdown", "image/svg+xml", "text/latex", "image/png", "image/jpeg", "text/plain",
+]
+
+# Raw cells are only rendered with one of these `raw_mimetype`s
+RAW_MIMETYPES = ["text/markdown", "text/html", ""]
+
+# Cell magics whose cells are highlighted in another language, as in
+# nbconvert's HighlightMagicsPreprocessor
+MAGIC_LANGUAGES = {
+    "%%R": "r",
+    "%%bash": "bash",
+    "%%cython": "cython",
+    "%%javascript": "javascript",
+    "%%julia": "julia",
+    "%%latex": "latex",
+    "%%octave": "octave",
+    "%%perl": "perl",
+    "%%ruby": "ruby",
+    "%%sh": "sh",
+    "%%sql": "sql",
+}
+MAGIC_PATTERN = re.compile(rf"^\s*({'|'.join(MAGIC_LANGUAGES)})\s+")
+
+ANSI_PATTERN = re.compile("\x1b\\[(.*?)([@-~])")
+
+
+def set_engine(engine: str):
+    """Select the renderer used by `notebook_convert`, one of `ENGINES`."""
+    global ENGINE
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown engine: {engine}")
+    ENGINE = engine
+
+
+def highlight_magics(cell: Dict):
+    """Set `magics_language` on code cells starting with a language magic such as `%%bash`."""
+    if cell["cell_type"] == "code":
+        match = MAGIC_PATTERN.match(cell["source"])
+        if match:
+            cell["metadata"]["magics_language"] = MAGIC_LANGUAGES[match.group(1)]
+
+
+def rewrite_attachments(cell: Dict):
+    """Replace `attachment:` references like nbconvert's ExtractAttachmentsPreprocessor.
+
+    The exporter never writes the extracted files, so only the references
+    change: `attachment:<name>` becomes the bare file name.
+    """
+    for name in cell.get("attachments", {}):
+        safe_name = os.path.basename(name)
+        if safe_name:
+            cell["source"] = cell["source"].replace("attachment:" + name, safe_name)
+
+
+def _picture(image: Dict) -> str:
+    # The `picture` macro of the template
+    sources = "".join(f'\n<source srcSet="{source["srcSet"]}" type="{source["type"]}" />' for source in image["sources"])
+    picture = f'<picture>{sources}\n<img src="{image["src"]}" />\n</picture>'
+    if image.get("href"):
+        return f'<a href="{image["href"]}">\n{picture}\n</a>'
+    return picture
+
+
+def _image(output: Dict, mime_type: str, src: str, block: str = "<CodeOutputImageBlock>") -> str:
+    picture = output["metadata"].get("picture", {})
+    image = _picture(picture[mime_type]) if mime_type in picture else f"![]({src})"
+    return f"{block}\n{image}\n</CodeOutputImageBlock>"
+
+
+def _code_block(text: str) -> str:
+    return f"<CodeOutputBlock>\n```\n{text.rstrip()}\n```\n</CodeOutputBlock>"
+
+
+def render_data(output: Dict) -> str:
+    """Render the preferred representation of a display or execute result output."""
+    data = output["data"]
+    mime_type = next((mime_type for mime_type in DISPLAY_PRIORITY if mime_type in data), None)
+    if mime_type == "text/html":
+        return f"<HTMLOutputBlock>\n```\n{data[mime_type]} \n```\n</HTMLOutputBlock>"
+    elif mime_type in ("text/markdown", "text/latex"):
+        return f"\n{data[mime_type]}\n"
+    elif mime_type == "image/svg+xml":
+        return _image(output, mime_type, data[mime_type], '<CodeOutputImageBlock class="svg">')
+    elif mime_type == "image/png":
+        return _image(output, mime_type, data[mime_type])
+    elif mime_type == "image/jpeg":
+        # The template reads the data as "image/jpg", which never exists
+        return _image(output, mime_type, data.get("image/jpg", ""))
+    elif mime_type == "text/plain":
+        return _code_block(data[mime_type])
+    return ""
+
+
+def render_output(output: Dict) -> str:
+    """Render a code cell output."""
+    output_type = output["output_type"]
+    if output_type == "stream":
+        return _code_block(output["text"])
+    elif output_type == "display_data":
+        return f"\n{render_data(output)}\n"
+    elif output_type == "execute_result":
+        return f"\n\n\n{render_data(output)}\n\n"
+    elif output_type == "error":
+        lines = "".join(
+            f"<CodeOutputBlock>\n{ANSI_PATTERN.sub('', line.rstrip())}\n</CodeOutputBlock>"
+            for line in output["traceback"]
+        )
+        return f"\n{lines}\n"
+    return ""
+
+
+def render_input(cell: Dict, language: str) -> str:
+    """Render the source of a code cell as a fenced block, titled with `metadata.title`."""
+    if not cell["source"]:
+        return "\n"
+    metadata = cell["metadata"]
+    fence = "```" + (str(metadata["magics_language"]) if "magics_language" in metadata else language)
+    if "title" in metadata:
+        fence += f' title="{metadata["title"]}"'
+    return f"{fence}\n{cell['source']}\n```\n"
+
+
+def render_cell(cell: Dict, language: str = "") -> str:
+    """Render a cell. `language` is the kernel language, used for code cells without a magic."""
+    if cell["metadata"].get("transient", {}).get("remove_source", False):
+        if cell["cell_type"] != "code":
+            return ""
+        parts = []
+    elif cell["cell_type"] == "code":
+        # The empty input prompt of the markdown template renders a blank line
+        parts = ["\n", render_input(cell, language)]
+    elif cell["cell_type"] == "markdown":
+        return f"\n{cell['source']}\n"
+    elif cell["cell_type"] == "raw":
+        return cell["source"] if cell["metadata"].get("raw_mimetype", "").lower() in RAW_MIMETYPES else ""
+    else:
+        return "\nunknown type  \n"
+    parts.extend(render_output(output) for output in cell.get("outputs", []))
+    return "".join(parts)
+
+
+def render_notebook(nb: Dict) -> str:
+    """Render the cells of a preprocessed notebook to MDX (without frontmatter)."""
+    kernelspec = nb["metadata"].get("kernelspec", {})
+    language = str(kernelspec["language"]) if "language" in kernelspec else ""
+    body: List[str] = [render_cell(cell, language) for cell in nb["cells"]]
+    return "".join(body).lstrip("\r\n")
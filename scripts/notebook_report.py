@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""Machine-readable build reports of `convert_all_notebooks.py --report`.
+
+A report is a newline-delimited JSON file with one record per notebook:
+
+    {"type": "notebook", "path": ..., "status": "converted" | "skipped" | "failed",
+     "duration": <seconds>, "pages": ..., "notebook_bytes": ..., "mdx_bytes": ...,
+     "new_assets": ..., "new_asset_bytes": ..., "reused_assets": ..., "reused_asset_bytes": ...,
+     "stages": {<stage>: <seconds>}, "error": ...}
+
+followed by one `{"type": "totals", ...}` record with the build stats. Assets
+are new if the notebook did not use them in the previous build. Skipped
+notebooks report the pages and assets recorded in the build manifest.
+"""
+import argparse
+import json
+import sys
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+REPORT_VERSION = 1
+
+# Metrics compared by `diff_reports()`, with the minimum increase that counts
+# as a regression regardless of the relative threshold
+DIFF_METRICS = {"duration": 0.1, "mdx_bytes": 1024, "asset_bytes": 1024}
+
+
+def write_report(path: Path, stats: Dict):
+    """Write the notebook records and totals of a `convert_all_notebooks()` run."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    totals = {k: v for k, v in stats.items() if k != "notebooks"}
+    with open(path, "w") as f:
+        for record in stats["notebooks"]:
+            f.write(json.dumps({"type": "notebook", **record}) + "\n")
+        f.write(json.dumps({"type": "totals", "version": REPORT_VERSION, **totals}) + "\n")
+
+
+def read_report(path: Path) -> Tuple[Dict[str, Dict], Dict]:
+    """Read a report and return its notebook records by path and its totals."""
+    notebooks, totals = {}, {}
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if record.get("type") == "notebook":
+                notebooks[record["path"]] = record
+            elif record.get("type") == "totals":
+                totals = record
+    return notebooks, totals
+
+
+def _metric(record: Dict, name: str) -> float:
+    if name == "asset_bytes":
+        return record["new_asset_bytes"] + record["reused_asset_bytes"]
+    return record[name]
+
+
+def diff_reports(old: Dict[str, Dict], new: Dict[str, Dict], time_threshold: float = 0.25,
+                 size_threshold: float = 0.1) -> List[Dict]:
+    """Compare the notebook records of two reports and return the regressions.
+
+    A notebook regressed if it failed in `new` but not in `old`, or if its
+    duration grew by more than `time_threshold` or its MDX or asset bytes by
+    more than `size_threshold` (as fractions of the old value, and by at least
+    the minimum of `DIFF_METRICS`). Durations are only compared between
+    notebooks converted in both builds, since skipped notebooks take no time.
+    """
+    regressions = []
+    for path in sorted(set(old) & set(new)):
+        before, after = old[path], new[path]
+        if after["status"] == "failed":
+            if before["status"] != "failed":
+                regressions.append({"path": path, "metric": "status", "old": before["status"], "new": "failed"})
+            continue
+        if before["status"] == "failed":
+            continue
+        for name, minimum in DIFF_METRICS.items():
+            if name == "duration" and not before["status"] == after["status"] == "converted":
+                continue
+            threshold = time_threshold if name == "duration" else size_threshold
+            old_value, new_value = _metric(before, name), _metric(after, name)
+            if new_value - old_value >= minimum and new_value > old_value * (1 + threshold):
+                regressions.append({"path": path, "metric": name, "old": old_value, "new": new_value})
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Work with build reports of convert_all_notebooks.py --report")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    diff_parser = subparsers.add_parser("diff", help="Flag notebooks whose conversion time or output size regressed")
+    diff_parser.add_argument("old", type=Path, help="Report of the baseline build")
+    diff_parser.add_argument("new", type=Path, help="Report of the build to check")
+    diff_parser.add_argument("--time-threshold", type=float, default=0.25, help="Allowed relative increase of the duration (default: %(default)s)")
+    diff_parser.add_argument("--size-threshold", type=float, default=0.1, help="Allowed relative increase of MDX and asset bytes (default: %(default)s)")
+
+    args = parser.parse_args()
+    old_notebooks, old_totals = read_report(args.old)
+    new_notebooks, new_totals = read_report(args.new)
+    regressions = diff_reports(old_notebooks, new_notebooks, args.time_threshold, args.size_threshold)
+
+    for name in sorted(set(new_notebooks) - set(old_notebooks)):
+        print(f"New notebook: {name}")
+    for name in sorted(set(old_notebooks) - set(new_notebooks)):
+        print(f"Removed notebook: {name}")
+    if old_totals and new_totals:
+        print(f"Build time: {old_totals['elapsed_time']:.2f} s -> {new_totals['elapsed_time']:.2f} s")
+    for regression in regressions:
+        old_value, new_value = regression["old"], regression["new"]
+        if regression["metric"] == "status":
+            change = f"{old_value} -> {new_value}"
+        elif regression["metric"] == "duration":
+            change = f"{old_value:.2f} s -> {new_value:.2f} s"
+        else:
+            change = f"{old_value} -> {new_value} bytes"
+        print(f"REGRESSION {regression['path']}: {regression['metric']} {change}")
+    print(f"{len(regressions)} regressions")
+    sys.exit(1 if regressions else 0)
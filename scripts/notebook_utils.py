@@ -1,5 +1,8 @@
+import os
+import tempfile
+from collections.abc import Sequence
 from pathlib import Path
-from typing import Tuple
+from typing import List, Optional, Tuple
 import nbformat
 
 # GitHub configuration
@@ -25,26 +28,142 @@ def escape_html(text):
     # text = text.replace("'", "&#39;")
     return text
 
-def extract_frontmatter(nb: nbformat.NotebookNode, notebook_path: str = None) -> Tuple[str, int]:
+class CellRange(Sequence):
+    """Read-only view of `cells[start:end]`, optionally preceded by one extra cell.
+
+    Sections of a notebook are views like this instead of copied lists.
+    """
+
+    def __init__(self, cells: List, start: int, end: int, prefix=None):
+        self.cells = cells
+        self.start = start
+        self.end = end
+        self.prefix = prefix
+
+    def __len__(self):
+        return (self.end - self.start) + (self.prefix is not None)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if self.prefix is not None:
+            if index == 0:
+                return self.prefix
+            index -= 1
+        if not 0 <= index < self.end - self.start:
+            raise IndexError("cell index out of range")
+        return self.cells[self.start + index]
+
+    def __iter__(self):
+        if self.prefix is not None:
+            yield self.prefix
+        for i in range(self.start, self.end):
+            yield self.cells[i]
+
+
+class Section:
+    """A page of a multi-page notebook: the cells after a `# !pagebreak` cell."""
+
+    def __init__(self, pagebreak_index: int, end: int, frontmatter: Optional[str], extra_content: str):
+        self.pagebreak_index = pagebreak_index
+        self.end = end
+        self.frontmatter = frontmatter
+        # Content of the pagebreak cell after its frontmatter, if any
+        self.extra_content = extra_content
+
+    def cells(self, nb: nbformat.NotebookNode) -> CellRange:
+        """Return the cells of this section as a view over `nb.cells`."""
+        prefix = nbformat.v4.new_raw_cell(self.extra_content) if self.extra_content else None
+        return CellRange(nb.cells, self.pagebreak_index + 1, self.end, prefix)
+
+
+def parse_pagebreak(source: str) -> Tuple[Optional[str], str]:
+    """Split a pagebreak cell into its frontmatter and the remaining content."""
+    # Extract content after pagebreak
+    parts = source.split("# !pagebreak", 1)
+    content_after_pb = parts[1].strip() if len(parts) > 1 else ""
+    
+    # Extract frontmatter if it exists
+    section_frontmatter = None
+    if content_after_pb:
+        # Check if the content has frontmatter
+        if content_after_pb.startswith("---"):
+            # Extract frontmatter between --- markers
+            fm_end = content_after_pb.find("---", 3)
+            if fm_end > 0:
+                section_frontmatter = content_after_pb[:fm_end + 3]
+                content_after_pb = content_after_pb[fm_end + 3:].strip()
+    return section_frontmatter, content_after_pb
+
+
+class NotebookLayout:
+    """Positions of the chapter and pagebreak markers in a notebook, found in one pass.
+
+    Attributes:
+        chapter_index: Index of the first raw `# !chapter` cell, or None.
+        chapter_marker_indices: Indices of all cells (of any type) containing `# !chapter`.
+        pagebreak_indices: Indices of the raw `# !pagebreak` cells.
+        sections: The non-empty sections, in order, with their parsed frontmatter.
+    """
+
+    def __init__(self, nb: nbformat.NotebookNode):
+        self.num_cells = len(nb.cells)
+        self.chapter_index = None
+        self.chapter_marker_indices = []
+        self.pagebreak_indices = []
+        for i, cell in enumerate(nb.cells):
+            source = cell.source
+            # Cheap check that rules out almost every cell
+            if "# !" not in source:
+                continue
+            if "# !chapter" in source:
+                self.chapter_marker_indices.append(i)
+                if cell.cell_type == "raw" and self.chapter_index is None:
+                    self.chapter_index = i
+            if cell.cell_type == "raw" and "# !pagebreak" in source:
+                self.pagebreak_indices.append(i)
+
+        self.sections = []
+        for i, pb_idx in enumerate(self.pagebreak_indices):
+            frontmatter, extra_content = parse_pagebreak(nb.cells[pb_idx].source)
+            next_pb_idx = self.pagebreak_indices[i + 1] if i + 1 < len(self.pagebreak_indices) else self.num_cells
+            # Skip sections without any cells
+            if extra_content or next_pb_idx > pb_idx + 1:
+                self.sections.append(Section(pb_idx, next_pb_idx, frontmatter, extra_content))
+
+    @property
+    def has_pagebreaks(self) -> bool:
+        return bool(self.pagebreak_indices)
+
+    @property
+    def first_pagebreak_index(self) -> Optional[int]:
+        return self.pagebreak_indices[0] if self.pagebreak_indices else None
+
+
+def extract_frontmatter(
+    nb: nbformat.NotebookNode,
+    notebook_path: str = None,
+    layout: Optional[NotebookLayout] = None
+) -> Tuple[str, int]:
     """Extract frontmatter from notebook if it exists.
     
     Args:
         nb: The notebook object
         notebook_path: Path to the original notebook file (to construct the edit URL)
+        layout: Optional precomputed layout of `nb`, to avoid scanning the cells again
     
     Returns:
         Tuple[str, int]: The frontmatter content and the index of the frontmatter cell.
     """
     frontmatter = ""
-    cell_index = None
+    cell_index = (layout or NotebookLayout(nb)).chapter_index
     
-    for i, cell in enumerate(nb.cells):
-        if cell.cell_type == "raw" and "# !chapter" in cell.source:
-            frontmatter = cell.source.split("# !chapter", 1)[1].strip()
-            # Replace "chapter-title:" with "title:" in frontmatter
-            frontmatter = frontmatter.replace("chapter-title:", "title:")
-            cell_index = i
-            break
+    if cell_index is not None:
+        frontmatter = nb.cells[cell_index].source.split("# !chapter", 1)[1].strip()
+        # Replace "chapter-title:" with "title:" in frontmatter
+        frontmatter = frontmatter.replace("chapter-title:", "title:")
     
     # Default frontmatter if none found
     if not frontmatter:
@@ -85,12 +204,9 @@ def extract_frontmatter(nb: nbformat.NotebookNode, notebook_path: str = None) ->
     
     return frontmatter, cell_index
 
-def has_pagebreaks(nb: nbformat.NotebookNode) -> bool:
+def has_pagebreaks(nb: nbformat.NotebookNode, layout: Optional[NotebookLayout] = None) -> bool:
     """Check if notebook contains pagebreak markers."""
-    for cell in nb.cells:
-        if cell.cell_type == "raw" and "# !pagebreak" in cell.source:
-            return True
-    return False
+    return (layout or NotebookLayout(nb)).has_pagebreaks
 
 
 def append_to_gitignore(file_path: Path):
@@ -99,16 +215,14 @@ def append_to_gitignore(file_path: Path):
     
     # Create gitignore if it doesn't exist
     if not gitignore_path.exists():
-        with open(gitignore_path, "w") as f:
-            f.write(f"{file_path.name}\n")
+        write_if_changed(gitignore_path, f"{file_path.name}\n")
     else:
         # Append to existing gitignore if the pattern isn't already there
         with open(gitignore_path, "r") as f:
             content = f.read()
         
         if file_path.name not in content:
-            with open(gitignore_path, "a") as f:
-                f.write(f"\n{file_path.name}\n")
+            write_if_changed(gitignore_path, content + f"\n{file_path.name}\n")
     
     return gitignore_path
 
@@ -119,9 +233,74 @@ def generate_directory_gitignore(dir: Path):
 
     # This ignores auto-generated markdown files
     if not gitignore_path.exists():
-        with open(gitignore_path, "w") as f:
-            f.write("autogen-*.mdx\n")
-            f.write("index.mdx\n")
+        write_if_changed(gitignore_path, "autogen-*.mdx\nindex.mdx\n")
     
     return gitignore_path
 
+
+def _file_mode() -> int:
+    """Permissions of new files, as `open(..., "w")` would create them.
+
+    The umask is read without `os.umask()`, which would briefly change it for
+    every thread of the process: from /proc on Linux, or else from a file
+    created for the purpose.
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("Umask:"):
+                    return 0o666 & ~int(line.split()[1], 8)
+    except (OSError, ValueError):
+        pass
+    probe_dir = tempfile.mkdtemp()
+    probe = os.path.join(probe_dir, "probe")
+    try:
+        os.close(os.open(probe, os.O_CREAT | os.O_WRONLY, 0o666))
+        return os.stat(probe).st_mode & 0o777
+    finally:
+        if os.path.exists(probe):
+            os.unlink(probe)
+        os.rmdir(probe_dir)
+
+
+FILE_MODE = _file_mode()
+
+# Number of generated files written and left unchanged by `write_if_changed()`
+# in this process
+WRITE_STATS = {"written": 0, "unchanged": 0}
+
+
+def write_bytes_atomic(path: Path, data: bytes):
+    """Write bytes to a file through a temporary file and an atomic rename.
+
+    Readers (and Docusaurus' file watcher) never see a partially written
+    file, and a crashed conversion leaves the previous version in place.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.chmod(tmp_path, FILE_MODE)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def write_if_changed(path: Path, content: str) -> bool:
+    """Write a generated text file unless it already has exactly this content.
+
+    Unchanged files are not touched, so their mtime is preserved and file
+    watchers do not see them as modified. Returns True if the file was written.
+    """
+    data = content.encode("utf-8")
+    try:
+        # Only read the existing file if the sizes match
+        if path.stat().st_size == len(data) and path.read_bytes() == data:
+            WRITE_STATS["unchanged"] += 1
+            return False
+    except FileNotFoundError:
+        pass
+    write_bytes_atomic(path, data)
+    WRITE_STATS["written"] += 1
+    return True
@@ -0,0 +1,90 @@
+import re
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+from notebook_manifest import ASSET_URL_PATTERN
+
+# Default budgets in bytes for the weight of a generated page and of all pages
+# of a notebook. 0 disables a budget.
+DEFAULT_BUDGETS = {"page": 5 << 20, "notebook": 20 << 20}
+
+# Number of assets listed for each page over budget
+LARGEST_ASSETS = 3
+
+_PICTURE = re.compile(r"<picture>.*?</picture>", re.DOTALL)
+# Links to a full-size SVG are only loaded when clicked
+_LINK_HREF = re.compile(r"<a href=\"[^\"]*\"")
+
+
+def page_assets(content: str) -> List[str]:
+    """Return the asset paths (`<notebook_name>/<filename>`) a page loads.
+
+    Of the sources of a `<picture>`, only the first (the preferred format) is
+    counted, since browsers download a single one.
+    """
+    assets = []
+
+    def first_source(match):
+        found = ASSET_URL_PATTERN.search(match.group())
+        if found:
+            assets.append(found.group(1))
+        return ""
+
+    content = _LINK_HREF.sub("", _PICTURE.sub(first_source, content))
+    assets.extend(ASSET_URL_PATTERN.findall(content))
+    return list(dict.fromkeys(assets))
+
+
+def weigh_page(page_path: Path, static_dir: Path, sizes: Optional[Dict[Path, int]] = None) -> Dict:
+    """Weigh a generated page: its MDX bytes plus the bytes of the assets it loads.
+
+    Returns a dict with the page path, `mdx_bytes`, `assets` (asset path ->
+    bytes, largest first) and the `total`. Missing assets count as 0 bytes.
+    `sizes` caches asset sizes across calls.
+    """
+    sizes = {} if sizes is None else sizes
+    content = Path(page_path).read_text()
+    assets = {}
+    for ref in page_assets(content):
+        path = static_dir / "notebooks" / ref
+        if path not in sizes:
+            try:
+                sizes[path] = path.stat().st_size
+            except OSError:
+                sizes[path] = 0
+        assets[path] = sizes[path]
+    mdx_bytes = len(content.encode("utf-8"))
+    assets = dict(sorted(assets.items(), key=lambda item: item[1], reverse=True))
+    return {"page": Path(page_path), "mdx_bytes": mdx_bytes, "assets": assets, "total": mdx_bytes + sum(assets.values())}
+
+
+def weigh_notebook(output_paths: Iterable[Path], static_dir: Path, sizes: Optional[Dict[Path, int]] = None) -> Dict:
+    """Weigh all pages of a notebook. Assets used by several pages count once in the `total`."""
+    sizes = {} if sizes is None else sizes
+    pages = [weigh_page(p, static_dir, sizes) for p in output_paths if Path(p).exists()]
+    assets = {path: size for page in pages for path, size in page["assets"].items()}
+    return {
+        "pages": pages,
+        "total": sum(page["mdx_bytes"] for page in pages) + sum(assets.values()),
+    }
+
+
+def check_budgets(notebook: str, weight: Dict, budgets: Dict[str, int]) -> List[str]:
+    """Return a warning for each page of a notebook, and the notebook itself, over its budget."""
+    warnings = []
+    page_budget, notebook_budget = budgets.get("page", 0), budgets.get("notebook", 0)
+    for page in weight["pages"]:
+        if page_budget and page["total"] > page_budget:
+            largest = ", ".join(
+                f"{path.name} ({size / 1e6:.1f} MB)" for path, size in list(page["assets"].items())[:LARGEST_ASSETS]
+            )
+            warnings.append(
+                f"{page['page']} weighs {page['total'] / 1e6:.1f} MB (budget {page_budget / 1e6:.1f} MB)"
+                + (f"; largest assets: {largest}" if largest else "")
+            )
+    if notebook_budget and weight["total"] > notebook_budget:
+        warnings.append(
+            f"{notebook} weighs {weight['total'] / 1e6:.1f} MB over {len(weight['pages'])} pages "
+            f"(budget {notebook_budget / 1e6:.1f} MB)"
+        )
+    return warnings
@@ -1,3 +1,8 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+
 from matplotlib.colors import ListedColormap
 
 colors_cbfp = [
@@ -45,6 +50,229 @@ def get_cbfp_cmap(n):
         raise ValueError("Invalid CBFP color palette number.")
 
 
+# Disk-backed cache of rendered figures and encoded animations, so re-running a
+# notebook does not render what has not changed. See `set_render_cache()`.
+RENDER_CACHE_ENABLED = os.environ.get("NOTEBOOK_RENDER_CACHE", "1") not in ("0", "off", "false")
+RENDER_CACHE_DIR = Path(
+    os.environ.get("NOTEBOOK_RENDER_CACHE_DIR")
+    or Path(__file__).resolve().parent.parent / "_intermediate" / "render-cache"
+)
+# Least recently used entries are evicted once the cache is larger than this
+RENDER_CACHE_MAX_BYTES = int(os.environ.get("NOTEBOOK_RENDER_CACHE_MAX_BYTES", 2 << 30))
+RENDER_CACHE_STATS = {"hits": 0, "misses": 0, "evictions": 0}
+
+
+def set_render_cache(enabled=None, cache_dir=None, max_bytes=None):
+    """
+    Configure the render cache used by `show_fig_svg()` and `show_animation_video_base64()`.
+
+    Parameters:
+    enabled : bool
+        Use the cache. When False, everything is rendered and nothing is stored.
+    cache_dir : str or Path
+        Directory of the cache. Default is `_intermediate/render-cache`.
+    max_bytes : int
+        Total size above which the least recently used entries are evicted.
+    """
+    global RENDER_CACHE_ENABLED, RENDER_CACHE_DIR, RENDER_CACHE_MAX_BYTES
+    if enabled is not None:
+        RENDER_CACHE_ENABLED = enabled
+    if cache_dir is not None:
+        RENDER_CACHE_DIR = Path(cache_dir)
+    if max_bytes is not None:
+        RENDER_CACHE_MAX_BYTES = max_bytes
+
+
+def render_cache_stats():
+    """Return the hits, misses and evictions of this session, and the cache's entries and size."""
+    entries = list(RENDER_CACHE_DIR.glob("*.*")) if RENDER_CACHE_DIR.exists() else []
+    entries = [path for path in entries if not path.name.startswith(".")]
+    return {
+        **RENDER_CACHE_STATS,
+        "entries": len(entries),
+        "bytes": sum(path.stat().st_size for path in entries),
+    }
+
+
+# Getters whose values determine how an artist is drawn. Transforms are left
+# out since they change with the layout; their inputs (limits, sizes) are in.
+_ARTIST_GETTERS = (
+    "get_xydata", "get_offsets", "get_paths", "get_path", "get_patch_transform", "get_array",
+    "get_extent", "get_clim", "get_cmap", "get_text", "get_position", "get_xlim", "get_ylim",
+    "get_xscale", "get_yscale", "get_size_inches", "get_dpi", "get_color", "get_facecolor",
+    "get_edgecolor", "get_linewidth", "get_linestyle", "get_marker", "get_markersize", "get_sizes",
+    "get_fontsize", "get_rotation", "get_alpha", "get_visible", "get_zorder", "get_label",
+    "get_bounds",
+)
+
+
+def _figure_digest(fig):
+    """Hash of the data and style of every artist in the figure, and of its ticks."""
+    import numpy as np
+    from matplotlib.artist import Artist
+    from matplotlib.axis import Axis
+    from matplotlib.colors import Colormap
+    from matplotlib.path import Path as MplPath
+    from matplotlib.spines import Spine
+    from matplotlib.transforms import Transform
+
+    h = hashlib.sha256()
+
+    def update(value):
+        if isinstance(value, np.ma.MaskedArray):
+            update(np.ma.getdata(value))
+            update(np.ma.getmaskarray(value))
+        elif isinstance(value, np.ndarray):
+            if value.dtype == object:
+                update(value.tolist())
+            else:
+                h.update(f"{value.dtype}{value.shape}".encode())
+                h.update(np.ascontiguousarray(value).tobytes())
+        elif isinstance(value, MplPath):
+            update(value.vertices)
+            update(value.codes)
+        elif isinstance(value, Transform):
+            update(value.get_matrix())
+        elif isinstance(value, Colormap):
+            h.update(value.name.encode())
+        elif isinstance(value, Artist):
+            # Hashed as an artist of its own
+            h.update(type(value).__qualname__.encode())
+        elif isinstance(value, (list, tuple)):
+            h.update(b"[")
+            for item in value:
+                update(item)
+            h.update(b"]")
+        else:
+            text = repr(value)
+            # Default reprs contain memory addresses, which change between runs
+            h.update((type(value).__qualname__ if " at 0x" in text else text).encode())
+
+    def artists(artist, skip=()):
+        # Yields each artist with the getters whose values are only computed
+        # when the figure is drawn, from inputs that are hashed
+        yield artist, skip
+        if isinstance(artist, Axis):
+            # Ticks are created and labeled when drawing, so they are hashed
+            # through the locators and formatters below
+            yield from artists(artist.label, ("get_position",))
+        else:
+            for child in artist.get_children():
+                yield from artists(child, ("get_path",) if isinstance(child, Spine) else ())
+
+    for artist, skip in artists(fig):
+        h.update(type(artist).__qualname__.encode())
+        for name in _ARTIST_GETTERS:
+            getter = getattr(artist, name, None) if name not in skip else None
+            if getter is None:
+                continue
+            try:
+                value = getter()
+            except Exception:
+                continue
+            h.update(name.encode())
+            update(value)
+        if isinstance(artist, Axis):
+            # What the locators and formatters produce
+            for get_locs, get_formatter in (
+                (artist.get_majorticklocs, artist.get_major_formatter),
+                (artist.get_minorticklocs, artist.get_minor_formatter),
+            ):
+                try:
+                    locs = get_locs()
+                    labels = get_formatter().format_ticks(locs)
+                except Exception:
+                    continue
+                update(locs)
+                update(labels)
+    return h.hexdigest()
+
+
+def _render_key(kind, fig, cache_key=None, **params):
+    """
+    Return the cache key of a render, or None if the cache is disabled or no
+    `cache_key` is given.
+
+    The digest of the figure's artists does not cover every property that
+    changes the output (e.g. font weights or hatches), so renders are only
+    cached under a `cache_key` from the caller. The key combines it with the
+    digest, the render parameters, the matplotlib version and its rcParams.
+    """
+    import matplotlib
+
+    if not RENDER_CACHE_ENABLED or cache_key is None:
+        return None
+    payload = {
+        "kind": kind,
+        "content": cache_key,
+        "figure": _figure_digest(fig),
+        "params": params,
+        "matplotlib": matplotlib.__version__,
+        "rc": hashlib.sha256(repr(sorted(matplotlib.rcParams.items())).encode()).hexdigest(),
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _cache_lookup(key, suffix):
+    """Return the cached file for `key`, marking it as recently used, and count the hit or miss."""
+    if key is None:
+        return None
+    path = RENDER_CACHE_DIR / f"{key}{suffix}"
+    try:
+        os.utime(path)
+    except OSError:
+        RENDER_CACHE_STATS["misses"] += 1
+        return None
+    RENDER_CACHE_STATS["hits"] += 1
+    return path
+
+
+def _cache_temp_path(suffix):
+    """Create an empty temporary file in the cache directory for `_cache_store()` to take over."""
+    import tempfile
+
+    RENDER_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=RENDER_CACHE_DIR, prefix=".render.", suffix=suffix)
+    os.close(fd)
+    return Path(tmp_path)
+
+
+def _cache_store(key, suffix, tmp_path):
+    """Move a rendered file into the cache and evict the least recently used entries."""
+    path = RENDER_CACHE_DIR / f"{key}{suffix}"
+    os.replace(tmp_path, path)
+
+    entries = []
+    for entry in os.scandir(RENDER_CACHE_DIR):
+        if not entry.name.startswith(".") and entry.is_file():
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, entry_path in sorted(entries):
+        if total <= RENDER_CACHE_MAX_BYTES:
+            break
+        if entry_path == str(path):
+            continue
+        os.unlink(entry_path)
+        total -= size
+        RENDER_CACHE_STATS["evictions"] += 1
+    return path
+
+
+def _asset_store():
+    """Return the converter's asset store for this checkout.
+
+    The store directory can be overridden with the NOTEBOOK_ASSETS_DIR
+    environment variable.
+    """
+    from notebook_assets import get_store
+
+    notebooks_dir = os.environ.get("NOTEBOOK_ASSETS_DIR") or (
+        Path(__file__).resolve().parent.parent / "_intermediate" / "static" / "img" / "notebooks"
+    )
+    return get_store(notebooks_dir)
+
+
 def show_animation_video_base64(
     ani,
     dpi=200,
@@ -55,15 +283,42 @@ def show_animation_video_base64(
     fps=20,
     retina=True,
     class_name="",
+    embed=True,
+    cache_key=None,
+    cache=True,
+    fallback=False,
 ):
     """
     Display the animation as an MP4 video in Jupyter Notebook using base64 embedding.
 
+    With `embed=False`, the video is written to the asset store of the notebook
+    converter instead, and the output only refers to it. This keeps the
+    notebook small, and the converter links the video without decoding it. The
+    store is not committed, so a fresh checkout (e.g. CI) cannot convert the
+    notebook until it is run again, unless `fallback=True` also embeds the
+    video for the converter to decode where the store lacks it.
+
+    Encodes are only cached (see `set_render_cache()`) when a `cache_key` is
+    given, since the frames depend on what the animation function draws. The
+    cache key combines it with the encoding parameters, the number of frames
+    and a digest of the figure's artists; it must change with anything else
+    the frames depend on, such as the seed or data of the animation function.
+
     Parameters:
     ani : FuncAnimation
         The animation object to display.
     dpi : int
         Dots per inch for the saved video. Default is 200.
+    embed : bool
+        Embed the video as base64 (default) or write it to the asset store.
+    cache_key : str
+        Identifies the animation's content in the render cache. Without it,
+        the animation is encoded every time.
+    cache : bool
+        Use the render cache. Default is True.
+    fallback : bool
+        With `embed=False`, also embed the video as base64 for checkouts
+        without the asset store. Default is False.
 
     Returns:
     None
@@ -75,18 +330,6 @@ def show_animation_video_base64(
     suffix_dict = {"mp4": ".mp4", "webm": ".webm"}
     mimetype_dict = {"mp4": "video/mp4", "webm": "video/webm"}
 
-    # Create a temporary file with .mp4 extension
-    with tempfile.NamedTemporaryFile(suffix=suffix_dict[type], delete=False) as tmpfile:
-        tmp_path = tmpfile.name
-
-    # Save the animation to the temporary file using the 'ffmpeg' writer
-    ani.save(tmp_path, writer="ffmpeg", fps=fps, dpi=dpi)
-
-    # Read the video file and encode it in base64
-    with open(tmp_path, "rb") as f:
-        video_data = f.read()
-        b64 = base64.b64encode(video_data).decode("utf-8")
-
     video_tag_options = ""
     if autoplay:
         video_tag_options += "autoplay muted "
@@ -101,22 +344,107 @@ def show_animation_video_base64(
 
     # Create HTML to embed the video. Site rendering may replace this with
     # a component-level player while preserving the source and attributes.
-    html = f'''
+    def video_html(src):
+        return f'''
     <video playsinline {video_tag_options} class="{classNames}">
-      <source src="data:{mimetype_dict[type]};base64,{b64}" type="{mimetype_dict[type]}">
+      <source src="{src}" type="{mimetype_dict[type]}">
     </video>
     '''
-    display(HTML(html))
 
+    key = None
+    if cache:
+        key = _render_key(
+            "animation", ani._fig, cache_key,
+            type=type, fps=fps, dpi=dpi, frames=getattr(ani, "_save_count", None),
+        )
+
+    if not embed:
+        from notebook_assets import ASSET_REFERENCE_MIME
+
+        # The asset store keeps its own record of rendered blobs, which `gc` keeps
+        store = _asset_store()
+        blob = store.get_render(key) if key is not None else None
+        if key is not None:
+            RENDER_CACHE_STATS["hits" if blob is not None else "misses"] += 1
+        if blob is None:
+            # Encode straight into the store, which then takes over the file
+            tmp_path = store.new_temp_path(suffix_dict[type])
+            try:
+                ani.save(tmp_path, writer="ffmpeg", fps=fps, dpi=dpi)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+            blob = store.add_file(tmp_path, move=True)
+            if key is not None:
+                store.put_render(key, blob)
+
+        # The relative path lets Jupyter play the video; the converter replaces it
+        src = os.path.relpath(store.blobs_dir / blob).replace(os.sep, "/")
+        bundle = {"text/html": video_html(src), ASSET_REFERENCE_MIME: {"blob": blob, "src": src}}
+        if fallback:
+            with open(store.blob_path(blob), "rb") as f:
+                bundle[mimetype_dict[type]] = base64.b64encode(f.read()).decode("ascii")
+            bundle[ASSET_REFERENCE_MIME]["fallback"] = mimetype_dict[type]
+        display(bundle, raw=True)
+        return
+
+    video_path = _cache_lookup(key, suffix_dict[type])
+    if video_path is None:
+        if key is not None:
+            tmp_path = _cache_temp_path(suffix_dict[type])
+        else:
+            # Create a temporary file with .mp4 extension
+            with tempfile.NamedTemporaryFile(suffix=suffix_dict[type], delete=False) as tmpfile:
+                tmp_path = tmpfile.name
+
+        try:
+            # Save the animation to the temporary file using the 'ffmpeg' writer
+            ani.save(tmp_path, writer="ffmpeg", fps=fps, dpi=dpi)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        video_path = _cache_store(key, suffix_dict[type], tmp_path) if key is not None else tmp_path
+
+    try:
+        # Read the video file and encode it in base64
+        with open(video_path, "rb") as f:
+            video_data = f.read()
+            b64 = base64.b64encode(video_data).decode("utf-8")
+    finally:
+        if key is None:
+            os.unlink(video_path)
 
-def show_fig_svg(fig):
+    display(HTML(video_html(f"data:{mimetype_dict[type]};base64,{b64}")))
+
+
+def show_fig_svg(fig, cache_key=None, cache=True):
+    """
+    Display the figure as an SVG image.
+
+    Rendered SVGs are only cached (see `set_render_cache()`) when a
+    `cache_key` is given. It is combined with a digest of the figure's
+    artists and ticks, which misses some properties (e.g. font weights or
+    hatches), so it must change with anything else the figure depends on.
+    """
     import io
     from IPython.display import SVG, display
 
+    key = _render_key("svg", fig, cache_key) if cache else None
+    svg_path = _cache_lookup(key, ".svg")
+    if svg_path is not None:
+        display(SVG(svg_path.read_text()))
+        return
+
     # Save the figure into a string buffer as SVG
     buf = io.StringIO()
     fig.savefig(buf, format="svg")
     buf.seek(0)
+    svg = buf.getvalue()
+
+    if key is not None:
+        tmp_path = _cache_temp_path(".svg")
+        tmp_path.write_text(svg)
+        _cache_store(key, ".svg", tmp_path)
 
     # Display the SVG image
-    display(SVG(buf.getvalue()))
+    display(SVG(svg))
@@ -2,7 +2,36 @@ import React from 'react';
 
 const CodeOutputImageBlock = ({ children }) => {
   
-  const content = children;
+  let content = children;
+  let link = null;
+
+  // Rasterized SVGs come as a <picture> wrapped in a link to the SVG
+  if (content.type === 'a') {
+    link = content.props.href;
+    content = React.Children.toArray(content.props.children).find((part) => part.type === 'picture');
+  }
+
+  // Optimized images come as a <picture> with WebP/AVIF sources and an <img> fallback
+  if (content.type === 'picture') {
+    const parts = React.Children.toArray(content.props.children);
+    const sources = parts.filter((part) => part.props && part.props.srcSet);
+    const fallback = parts.find((part) => part.props && part.props.src);
+
+    const picture = (
+      <picture>
+        {sources.map((source) => (
+          <source key={source.props.type} srcSet={source.props.srcSet} type={source.props.type}/>
+        ))}
+        <img src={fallback.props.src} alt="output plot"/>
+      </picture>
+    );
+
+    return (
+      <div className="jupyter-output-image">
+        {link ? <a href={link} target="_blank" rel="noopener noreferrer">{picture}</a> : picture}
+      </div>
+    );
+  }
 
   // Extract the image URL from the content
   const imageUrl = content.props.children.props.src
@@ -156,3 +156,1222 @@ def test_frontmatter_extraction():
     assert idx == 0  # Should find frontmatter in first cell
     assert "title: Test Frontmatter" in extracted, "Title in the frontmatter is incorrect"
     assert "slug: /test" in extracted, "Slug in the frontmatter is incorrect"
+
+def test_incremental_rebuild(setup_test_environment, monkeypatch):
+    """Test that unchanged notebooks are skipped and removed sections are pruned."""
+    import notebook_convert
+    from convert_all_notebooks import convert_all_notebooks
+
+    env = setup_test_environment
+    root_dir = env['temp_dir']
+    docs_dir = root_dir / "docs"
+    docs_dir.mkdir()
+    notebook_path = docs_dir / "multi-page.ipynb"
+    shutil.copy(env['notebooks_dir'] / "multi-page.ipynb", notebook_path)
+
+    # First run converts the notebook and writes the manifest
+    stats = convert_all_notebooks(root_dir)
+    assert stats["success"] == 1 and stats["skipped"] == 0
+    assert (root_dir / "_intermediate" / "build-manifest.json").exists()
+    page_3 = docs_dir / "multi-page" / "autogen-page-3.mdx"
+    assert page_3.exists()
+
+    # Second run finds nothing to do
+    stats = convert_all_notebooks(root_dir)
+    assert stats["success"] == 0 and stats["skipped"] == 1
+
+    # Deleting an output invalidates the entry
+    page_3.unlink()
+    stats = convert_all_notebooks(root_dir)
+    assert stats["success"] == 1
+    assert page_3.exists()
+
+    # A failing section fails the notebook and keeps its previous pages
+    export = notebook_convert.export_notebook_cell_to_mdx
+
+    def fail_page_2(nb, output_path, *args, **kwargs):
+        if output_path.name == "autogen-page-2.mdx":
+            raise ValueError("broken section")
+        return export(nb, output_path, *args, **kwargs)
+
+    monkeypatch.setattr(notebook_convert, "export_notebook_cell_to_mdx", fail_page_2)
+    stats = convert_all_notebooks(root_dir, force=True, jobs=1)
+    assert stats["failed"] == 1 and stats["success"] == 0
+    assert (docs_dir / "multi-page" / "autogen-page-2.mdx").exists() and page_3.exists()
+    monkeypatch.undo()
+    assert convert_all_notebooks(root_dir, jobs=1)["success"] == 1
+
+    # Removing the last section prunes its page
+    nb = nbformat.read(notebook_path, as_version=4)
+    nb.cells = nb.cells[:9]
+    nbformat.write(nb, notebook_path)
+    stats = convert_all_notebooks(root_dir)
+    assert stats["success"] == 1
+    assert not page_3.exists()
+    assert (docs_dir / "multi-page" / "autogen-page-2.mdx").exists()
+
+def test_parallel_conversion(setup_test_environment):
+    """Test that converting with a process pool gives the same stats and outputs."""
+    from convert_all_notebooks import convert_all_notebooks
+
+    env = setup_test_environment
+    root_dir = env['temp_dir']
+    docs_dir = root_dir / "docs"
+    docs_dir.mkdir()
+    for name in ["single-page.ipynb", "multi-page.ipynb"]:
+        shutil.copy(env['notebooks_dir'] / name, docs_dir / name)
+
+    stats = convert_all_notebooks(root_dir, jobs=2)
+    assert stats["success"] == 2 and stats["failed"] == 0
+    assert stats["files_created"] == 5
+    assert (docs_dir / "single-page.mdx").exists()
+    assert (docs_dir / "multi-page" / "autogen-page-3.mdx").exists()
+
+def test_exporter_is_reused(setup_test_environment):
+    """Test that one exporter serves several notebooks with per-call asset directories."""
+    from notebook_assets import get_store
+    from scripts.notebook_convert import get_exporter
+
+    env = setup_test_environment
+    exporter = get_exporter()
+    template = exporter.template
+
+    nb = nbformat.read(env['notebooks_dir'] / "single-page.ipynb", as_version=4)
+    for name in ["first", "second"]:
+        export_notebook_cell_to_mdx(nb, env['temp_dir'] / f"{name}.mdx", env['static_dir'], name)
+        get_store(env['static_dir'] / "notebooks").flush()
+        assert list((env['static_dir'] / "notebooks" / name).glob("*.png")), f"No images extracted for {name}"
+
+    assert get_exporter() is exporter
+    assert exporter.template is template
+
+def test_streaming_media_extraction(setup_test_environment, monkeypatch):
+    """Test that chunked base64 extraction matches decoding the payload at once."""
+    import base64
+    import hashlib
+    import notebook_assets
+    from notebook_assets import get_store
+    from scripts.notebook_convert import ResourceProcessor
+
+    env = setup_test_environment
+    # Stream every payload, using tiny chunks so that payloads span many of them
+    monkeypatch.setattr(notebook_assets, "IN_MEMORY_LIMIT", 0)
+    monkeypatch.setattr(notebook_assets, "CHUNK_CHARS", 8)
+
+    payload = os.urandom(1000)
+    b64 = base64.b64encode(payload).decode()
+    wrapped = "\n".join(b64[i:i + 76] for i in range(0, len(b64), 76))
+    expected_name = hashlib.md5(payload).hexdigest()[:12]
+
+    processor = ResourceProcessor()
+    processor.preprocess(nbformat.v4.new_notebook(), {"static_dir": env['static_dir'], "notebook_name": "stream"})
+    outputs = processor._process_output_media([
+        {"output_type": "display_data", "data": {"image/png": wrapped}, "metadata": {}},
+        {"output_type": "display_data", "metadata": {}, "data": {
+            "text/html": f'<video controls>\n<source src="data:video/mp4;base64,{b64}" type="video/mp4">\n</video>'
+        }},
+    ])
+
+    get_store(env['static_dir'] / "notebooks").flush()
+    assert outputs[0]["data"]["image/png"] == f"/img/notebooks/stream/{expected_name}.png"
+    assert f'<source src="/docs/img/notebooks/stream/{expected_name}.mp4" type="video/mp4">' in outputs[1]["data"]["text/html"]
+    assets_dir = env['static_dir'] / "notebooks" / "stream"
+    assert (assets_dir / f"{expected_name}.png").read_bytes() == payload
+    assert (assets_dir / f"{expected_name}.mp4").read_bytes() == payload
+    assert not list(assets_dir.glob(".*.tmp")), "Temporary files were left behind"
+
+def test_asset_store_dedup_and_gc(setup_test_environment):
+    """Test that identical assets share one blob and unreferenced ones are collected."""
+    from notebook_assets import AssetStore, get_store
+
+    env = setup_test_environment
+    nb = nbformat.read(env['notebooks_dir'] / "single-page.ipynb", as_version=4)
+    pages = {}
+    for name in ["first", "second"]:
+        pages[name] = env['temp_dir'] / f"{name}.mdx"
+        export_notebook_cell_to_mdx(nb, pages[name], env['static_dir'], name)
+    get_store(env['static_dir'] / "notebooks").flush()
+
+    store = AssetStore(env['static_dir'] / "notebooks")
+    blobs = list(store.blobs_dir.glob("*.png"))
+    assert len(blobs) == 1, "Identical images should be stored once"
+    first_png = next((store.notebooks_dir / "first").glob("*.png"))
+    second_png = next((store.notebooks_dir / "second").glob("*.png"))
+    assert os.path.samefile(first_png, blobs[0]) and os.path.samefile(second_png, blobs[0])
+
+    # Nothing to collect while both pages exist
+    assert store.gc() == (0, 0, 0)
+
+    # Once the second page is gone, its files are removed but the shared blob stays
+    pages["second"].unlink()
+    assert store.gc() == (1, 1, 0)
+    assert not (store.notebooks_dir / "second").exists()
+    assert blobs[0].exists()
+
+    # Temporary files of writes in progress are kept, stale ones are removed
+    writing = store.new_temp_path(".mp4")
+    stale = store.new_temp_path(".mp4")
+    os.utime(stale, (0, 0))
+    stale_link = store.notebooks_dir / "first" / ".image.png.1234.tmp"
+    stale_link.write_bytes(b"partial")
+    os.utime(stale_link, (0, 0))
+    assert store.gc() == (0, 1, 1)
+    assert writing.exists() and not stale.exists() and not stale_link.exists()
+
+    pages["first"].unlink()
+    assert store.gc() == (1, 1, 1)
+    assert not blobs[0].exists()
+    assert writing.exists()
+
+
+def test_generated_files_get_the_default_permissions(setup_test_environment, monkeypatch):
+    """Test that atomically written files get the mode `open()` would give them, without touching the umask."""
+    import notebook_utils
+
+    def fail(*args):
+        raise AssertionError("The process umask was changed")
+
+    monkeypatch.setattr(os, "umask", fail)
+    reference = setup_test_environment['temp_dir'] / "reference.txt"
+    reference.write_text("reference")
+    assert notebook_utils._file_mode() == notebook_utils.FILE_MODE == reference.stat().st_mode & 0o777
+
+    written = setup_test_environment['temp_dir'] / "written.txt"
+    notebook_utils.write_bytes_atomic(written, b"written")
+    assert written.stat().st_mode & 0o777 == notebook_utils.FILE_MODE
+
+def test_images_with_the_same_name_keep_their_content(setup_test_environment):
+    """Test that two linked images with the same file name but different content both stay available."""
+    import json
+    from notebook_assets import get_store
+
+    env = setup_test_environment
+    root_dir = env['temp_dir']
+    images = []
+    for name, content in [("first", b"first image"), ("second", b"second image")]:
+        (root_dir / name).mkdir()
+        images.append(root_dir / name / "plot.png")
+        images[-1].write_bytes(content)
+    nb = nbformat.v4.new_notebook()
+    nb.cells = [nbformat.v4.new_markdown_cell(f"![]({image})") for image in images]
+    notebook_path = root_dir / "same-names.ipynb"
+    nbformat.write(nb, notebook_path)
+
+    output_path, = convert_notebook(notebook_path, root_dir, root_dir)
+    content = output_path.read_text()
+    store = get_store(env['static_dir'] / "notebooks")
+    blob = store.add_file(images[1])
+    assert "](/notebooks/same-names/plot.png)" in content
+    assert f"](/notebooks/same-names/{blob})" in content
+    assets_dir = store.notebooks_dir / "same-names"
+    assert (assets_dir / "plot.png").read_bytes() == b"first image"
+    assert (assets_dir / blob).read_bytes() == b"second image"
+    refs, = json.loads(store.refs_path.read_text()).values()
+    assert refs == {"same-names/plot.png": store.add_file(images[0]), f"same-names/{blob}": blob}
+
+def test_asset_index_detects_collisions(setup_test_environment, monkeypatch):
+    """Test that indexed blobs are reused and hash collisions are reported."""
+    import notebook_assets
+    from notebook_assets import AssetCollisionError, AssetStore
+
+    env = setup_test_environment
+    store = AssetStore(env['static_dir'] / "notebooks")
+    blob = store.add_bytes(b"first asset", "png")
+    store.flush()
+
+    # A second store builds its index from disk and reuses the blob
+    store = AssetStore(env['static_dir'] / "notebooks")
+    assert store.add_bytes(b"first asset", "png") == blob
+
+    # Force every asset to the same name to simulate a truncated-hash collision
+    class ConstantHash:
+        def update(self, data):
+            pass
+
+        def hexdigest(self):
+            return blob.split(".")[0]
+
+    monkeypatch.setattr(notebook_assets, "new_hash", ConstantHash)
+    with pytest.raises(AssetCollisionError):
+        store.add_bytes(b"a different, longer asset", "png")
+
+    monkeypatch.undo()
+    notebook_assets.set_hash_algorithm("blake2b")
+    try:
+        assert store.add_bytes(b"first asset", "png") != blob
+    finally:
+        notebook_assets.set_hash_algorithm("md5")
+
+    # Selecting blake3 without the package fails right away
+    monkeypatch.setitem(sys.modules, "blake3", None)
+    with pytest.raises(RuntimeError, match="blake3"):
+        notebook_assets.set_hash_algorithm("blake3")
+    assert notebook_assets.HASH_ALGORITHM == "md5"
+
+def test_page_cache_rewrites_only_changed_sections(setup_test_environment):
+    """Test that only pages whose sections changed are rendered again."""
+    from notebook_manifest import PageCache
+
+    env = setup_test_environment
+    root_dir = env['temp_dir']
+    notebook_path = root_dir / "multi-page.ipynb"
+    shutil.copy(env['notebooks_dir'] / "multi-page.ipynb", notebook_path)
+
+    page_cache = PageCache()
+    convert_notebook(notebook_path, root_dir, root_dir, page_cache)
+    pages = {p.name: p.stat().st_mtime_ns for p in (root_dir / "multi-page").glob("*.mdx")}
+
+    # Edit a cell in the second section
+    nb = nbformat.read(notebook_path, as_version=4)
+    nb.cells[7].source += "\n\nEdited."
+    nbformat.write(nb, notebook_path)
+    convert_notebook(notebook_path, root_dir, root_dir, page_cache)
+
+    changed = {p.name for p in (root_dir / "multi-page").glob("*.mdx") if p.stat().st_mtime_ns != pages[p.name]}
+    assert changed == {"autogen-page-2.mdx"}
+    assert "Edited." in (root_dir / "multi-page" / "autogen-page-2.mdx").read_text()
+
+def test_unchanged_outputs_are_not_rewritten(setup_test_environment):
+    """Test that reconverting an unchanged notebook leaves its files untouched."""
+    from convert_all_notebooks import convert_all_notebooks
+
+    env = setup_test_environment
+    root_dir = env['temp_dir']
+    docs_dir = root_dir / "docs"
+    docs_dir.mkdir()
+    shutil.copy(env['notebooks_dir'] / "multi-page.ipynb", docs_dir / "multi-page.ipynb")
+
+    # index.mdx, three pages and the directory's .gitignore
+    stats = convert_all_notebooks(root_dir)
+    assert stats["files_written"] == 5 and stats["files_unchanged"] == 0
+    mtimes = {p: p.stat().st_mtime_ns for p in (docs_dir / "multi-page").iterdir()}
+
+    stats = convert_all_notebooks(root_dir, force=True)
+    assert stats["files_written"] == 0 and stats["files_unchanged"] == 4
+    assert mtimes == {p: p.stat().st_mtime_ns for p in (docs_dir / "multi-page").iterdir()}
+    assert not list((docs_dir / "multi-page").glob(".*.tmp")), "Temporary files were left behind"
+
+def test_notebook_layout_sections():
+    """Test that the one-pass layout splits sections like the original cell scan."""
+    from notebook_utils import NotebookLayout
+    from scripts.notebook_convert import split_notebook_cells
+
+    nb = nbformat.v4.new_notebook()
+    nb.cells = [
+        nbformat.v4.new_raw_cell("# !chapter\nchapter-title: Chapter"),
+        nbformat.v4.new_markdown_cell("Intro"),
+        nbformat.v4.new_raw_cell("# !pagebreak\n---\ntitle: One\n---\nExtra"),
+        nbformat.v4.new_code_cell("x = 1"),
+        nbformat.v4.new_raw_cell("# !pagebreak"),
+        nbformat.v4.new_raw_cell("# !pagebreak"),
+        nbformat.v4.new_markdown_cell("Last"),
+    ]
+    layout = NotebookLayout(nb)
+    assert layout.chapter_index == 0
+    assert layout.pagebreak_indices == [2, 4, 5]
+
+    sections = split_notebook_cells(nb, layout)
+    # The empty section between the two adjacent pagebreaks is skipped
+    assert [fm for _, fm in sections] == ["---\ntitle: One\n---", None]
+    assert [cell.source for cell in sections[0][0]] == ["Extra", "x = 1"]
+    assert list(sections[1][0]) == [nb.cells[6]]
+
+def test_cell_rewriter_matches_legacy_pipeline(setup_test_environment):
+    """Test that the fused CellRewriter renders byte-identical output to the three separate preprocessors."""
+    import base64
+    import copy
+    from scripts.notebook_convert import LEGACY_PREPROCESSORS, setup_exporter
+
+    env = setup_test_environment
+    png = base64.b64encode(b"\x89PNG\r\n\x1a\n" + b"\x00" * 64).decode()
+    mp4 = base64.b64encode(b"\x00\x00\x00\x18ftypmp42" * 4).decode()
+
+    nb = nbformat.v4.new_notebook()
+    nb.cells = [
+        nbformat.v4.new_markdown_cell("## Heading\nSee [next](other.ipynb) and [web](https://x.org/a.ipynb)."),
+        nbformat.v4.new_markdown_cell(f"![inline](data:image/png;base64,{png}) and [plain](page.md)"),
+        nbformat.v4.new_markdown_cell("Hidden", metadata={"hide": True}),
+        nbformat.v4.new_code_cell("print('```')\n\tindented", outputs=[
+            nbformat.v4.new_output("stream", text="  \n"),
+            nbformat.v4.new_output("stream", text="a ``` b"),
+            nbformat.v4.new_output("display_data", data={
+                "image/png": png,
+                "image/svg+xml": "<svg>```</svg>",
+                "text/plain": "<Figure ```>",
+                "text/html": f'<video><source type="video/mp4" src="data:video/mp4;base64,{mp4}"></video>```',
+            }),
+        ]),
+        nbformat.v4.new_code_cell("secret", metadata={"hide_input": True}, outputs=[
+            nbformat.v4.new_output("stream", text="shown"),
+        ]),
+        nbformat.v4.new_code_cell("shown", metadata={"hide": True}, outputs=[
+            nbformat.v4.new_output("stream", text="hidden"),
+        ]),
+        nbformat.v4.new_code_cell("gone", metadata={"hide": True, "hide_input": True}),
+    ]
+    notebooks = [nb] + [
+        nbformat.read(path, as_version=4)
+        for path in sorted(env['notebooks_dir'].glob("*.ipynb")) + sorted(Path("docs").rglob("*.ipynb"))
+    ]
+
+    legacy, fused = setup_exporter(LEGACY_PREPROCESSORS), setup_exporter()
+    for i, notebook in enumerate(notebooks):
+        results = []
+        for exporter in (legacy, fused):
+            body, resources = exporter.from_notebook_node(
+                copy.deepcopy(notebook),
+                resources={"static_dir": env['static_dir'], "notebook_name": f"nb{i}"}
+            )
+            results.append((body, resources["asset_refs"]))
+        assert results[0] == results[1], f"Output differs for notebook {i}"
+
+@pytest.mark.parametrize("decoder", ["default", "json"])
+def test_fast_loader_matches_nbformat(setup_test_environment, monkeypatch, decoder):
+    """Test that the fast loader returns the same notebook as nbformat.read, and falls back on unusual input."""
+    import notebook_loader
+    from notebook_loader import read_notebook
+
+    if decoder == "json":
+        monkeypatch.setattr(notebook_loader, "orjson", None)
+
+    env = setup_test_environment
+    paths = sorted(env['notebooks_dir'].glob("*.ipynb")) + sorted(Path("docs").rglob("*.ipynb"))
+    for path in paths:
+        with open(path) as f:
+            assert read_notebook(path) == nbformat.read(f, as_version=4), f"Notebook differs: {path}"
+
+    # A v3 notebook is not plain v4, so it goes through nbformat's conversion
+    v3_path = env['temp_dir'] / "v3.ipynb"
+    v3_path.write_text('{"nbformat": 3, "nbformat_minor": 0, "metadata": {}, "worksheets": '
+                       '[{"cells": [{"cell_type": "markdown", "source": ["# Old"], "metadata": {}}]}]}')
+    nb = read_notebook(v3_path)
+    assert nb.nbformat == 4 and nb.cells[0].source == "# Old"
+
+def test_lazy_loading_skips_hidden_outputs(setup_test_environment, monkeypatch):
+    """Test that memory-mapped loading renders the same page and never reads hidden output data."""
+    import base64
+    import textwrap
+    import notebook_loader
+    from notebook_loader import LazyText
+
+    monkeypatch.setattr(notebook_loader, "LAZY_LOAD_MIN_SIZE", 0)
+    monkeypatch.setattr(notebook_loader, "LAZY_MIN_CHARS", 1024)
+
+    env = setup_test_environment
+    root_dir = env['temp_dir']
+    hidden = base64.b64encode(b"hidden" * 1000).decode()
+    shown = base64.b64encode(b"shown!" * 1000).decode()
+    video = base64.b64encode(b"video!" * 1000).decode()
+    nb = nbformat.v4.new_notebook()
+    nb.cells = [
+        nbformat.v4.new_code_cell("hidden()", metadata={"hide": True}, outputs=[
+            nbformat.v4.new_output("display_data", data={"image/png": hidden}),
+        ]),
+        nbformat.v4.new_code_cell("shown()", outputs=[
+            nbformat.v4.new_output("display_data", data={
+                "image/png": shown,
+                "text/html": f'  <video>\n  <source type="video/mp4" src="data:video/mp4;base64,{video}">\n  </video>',
+            }),
+        ]),
+    ]
+    notebook_path = root_dir / "lazy.ipynb"
+    nbformat.write(nb, notebook_path)
+    hidden_start = notebook_path.read_bytes().index(hidden.encode())
+
+    loaded = notebook_loader.read_notebook(notebook_path)
+    assert isinstance(loaded.cells[0].outputs[0].data["image/png"], LazyText)
+    assert str(loaded.cells[1].outputs[0].data["image/png"]) == shown
+    html = loaded.cells[1].outputs[0].data["text/html"]
+    assert isinstance(html, LazyText) and str(html.dedent()) == textwrap.dedent(str(html))
+
+    read_ranges = []
+    getitem = LazyText.__getitem__
+
+    def recording_getitem(self, index):
+        read_ranges.extend(s for s in self.segments if not isinstance(s, str))
+        return getitem(self, index)
+
+    def fail_str(self):
+        raise AssertionError("Lazy output data was read into one string")
+
+    monkeypatch.setattr(LazyText, "__getitem__", recording_getitem)
+    monkeypatch.setattr(LazyText, "__str__", fail_str)
+    output_path, = convert_notebook(notebook_path, root_dir, root_dir)
+    assert read_ranges, "Visible outputs were not read lazily"
+    assert hidden_start not in [start for start, _ in read_ranges], "Hidden output data was read"
+    lazy_page = output_path.read_text()
+
+    monkeypatch.setattr(notebook_loader, "LAZY_LOAD_MIN_SIZE", 1 << 62)
+    convert_notebook(notebook_path, root_dir, root_dir)
+    assert output_path.read_text() == lazy_page
+    assert "/docs/img/notebooks/lazy/" in lazy_page
+
+def test_image_optimization_variants_are_cached(setup_test_environment, monkeypatch):
+    """Test that optimized PNG outputs get a <picture> with a WebP variant, created once per image."""
+    import base64
+    import io
+    PIL_Image = pytest.importorskip("PIL.Image")
+    import notebook_images
+
+    monkeypatch.setattr(notebook_images, "IMAGE_FORMATS", [])
+    notebook_images.set_image_formats(["webp"])
+
+    env = setup_test_environment
+    root_dir = env['temp_dir']
+    image = PIL_Image.new("RGB", (200, 100), "white")
+    image.paste((30, 90, 200), (20, 20, 120, 80))
+    png = io.BytesIO()
+    image.save(png, "PNG", compress_level=0)
+
+    nb = nbformat.v4.new_notebook()
+    nb.cells = [nbformat.v4.new_code_cell("plot()", outputs=[
+        nbformat.v4.new_output("display_data", data={"image/png": base64.b64encode(png.getvalue()).decode()}),
+    ])]
+    notebook_path = root_dir / "chart.ipynb"
+    nbformat.write(nb, notebook_path)
+
+    output_path, = convert_notebook(notebook_path, root_dir, root_dir)
+    content = output_path.read_text()
+    assert "<picture>" in content and 'type="image/webp"' in content
+    assets_dir = env['static_dir'] / "notebooks" / "chart"
+    webp, = assets_dir.glob("*.webp")
+    fallback, = [p for p in assets_dir.glob("*.png") if p.name in content]
+    assert fallback.stat().st_size < len(png.getvalue()), "PNG was not recompressed"
+
+    # The second conversion reuses the cached result
+    def fail(*args):
+        raise AssertionError("Image was optimized again")
+
+    monkeypatch.setattr(notebook_images, "_encode", fail)
+    output_path.unlink()
+    convert_notebook(notebook_path, root_dir, root_dir)
+    assert output_path.read_text() == content
+
+    # Without Pillow, enabling the optimization fails with a clear error
+    monkeypatch.setitem(sys.modules, "PIL", None)
+    with pytest.raises(RuntimeError, match="requires Pillow"):
+        notebook_images.set_image_formats(["webp"])
+
+
+SAMPLE_SVG = """<?xml version="1.0" encoding="utf-8" standalone="no"?>
+<svg xmlns:xlink="http://www.w3.org/1999/xlink" width="100pt" height="50pt" viewBox="0 0 100 50" xmlns="http://www.w3.org/2000/svg" version="1.1">
+ <metadata><rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#"/></metadata>
+ <!-- comment -->
+ <defs>
+  <path id="m1" d="M 0 1.5000001  L 1.234567 0" style="stroke: #1f77b4"/>
+ </defs>
+ <g clip-path="url(#p1)">
+  <use xlink:href="#m1" x="10.123456" y="20.000004"/>
+ </g>
+ <defs>
+  <path id="m2" d="M 0 1.5 L 1.234567 0" style="stroke: #1f77b4"/>
+  <clipPath id="p1"><rect x="0" y="0" width="100" height="50"/></clipPath>
+ </defs>
+ <use xlink:href="#m2" x="30.5" y="40" transform="scale(0.03125)"/>
+</svg>
+"""
+
+
+def test_svg_minification(setup_test_environment, monkeypatch):
+    """Test that SVG outputs are minified with rounded numbers and merged definitions."""
+    import notebook_images
+    from notebook_images import minify_svg
+
+    minified, num_elements = minify_svg(SAMPLE_SVG.encode(), precision=2)
+    svg = minified.decode()
+    assert "metadata" not in svg and "comment" not in svg
+    assert 'd="M 0 1.5 L 1.23 0"' in svg and 'x="10.12" y="20"' in svg
+    assert 'transform="scale(0.03125)"' in svg, "Transforms keep more precision"
+    assert 'id="m2"' not in svg and svg.count('xlink:href="#m1"') == 2
+    assert 'clip-path="url(#p1)"' in svg and 'id="p1"' in svg
+    assert num_elements == 9
+
+    monkeypatch.setattr(notebook_images, "SVG_SETTINGS", None)
+    notebook_images.set_svg_settings({"precision": 2})
+    env = setup_test_environment
+    root_dir = env['temp_dir']
+    nb = nbformat.v4.new_notebook()
+    nb.cells = [nbformat.v4.new_code_cell("plot()", outputs=[
+        nbformat.v4.new_output("display_data", data={"image/svg+xml": SAMPLE_SVG}),
+    ])]
+    notebook_path = root_dir / "vector.ipynb"
+    nbformat.write(nb, notebook_path)
+
+    output_path, = convert_notebook(notebook_path, root_dir, root_dir)
+    asset, = (env['static_dir'] / "notebooks" / "vector").glob("*.svg")
+    assert asset.read_bytes() == minified
+    assert f"![](/img/notebooks/vector/{asset.name})" in output_path.read_text()
+
+    # The second conversion reuses the cached result
+    def fail(*args):
+        raise AssertionError("SVG was minified again")
+
+    monkeypatch.setattr(notebook_images, "minify_svg", fail)
+    output_path.unlink()
+    convert_notebook(notebook_path, root_dir, root_dir)
+    assert asset.name in output_path.read_text()
+
+
+def test_large_svg_is_rasterized(setup_test_environment, monkeypatch):
+    """Test that SVGs above the element threshold get a rasterized <picture> linking to the SVG."""
+    import notebook_images
+
+    if notebook_images._cairosvg() is None:
+        pytest.skip("cairosvg is not available")
+    monkeypatch.setattr(notebook_images, "SVG_SETTINGS", None)
+    notebook_images.set_svg_settings({"max_elements": 5})
+
+    env = setup_test_environment
+    root_dir = env['temp_dir']
+    nb = nbformat.v4.new_notebook()
+    nb.cells = [nbformat.v4.new_code_cell("plot()", outputs=[
+        nbformat.v4.new_output("display_data", data={"image/svg+xml": SAMPLE_SVG}),
+    ])]
+    notebook_path = root_dir / "raster.ipynb"
+    nbformat.write(nb, notebook_path)
+
+    output_path, = convert_notebook(notebook_path, root_dir, root_dir)
+    content = output_path.read_text()
+    assets_dir = env['static_dir'] / "notebooks" / "raster"
+    png, = assets_dir.glob("*.png")
+    svg, = assets_dir.glob("*.svg")
+    assert f'<a href="/docs/img/notebooks/raster/{svg.name}">' in content
+    assert f'<img src="/docs/img/notebooks/raster/{png.name}" />' in content
+
+
+def test_asset_reference_outputs_are_linked(setup_test_environment):
+    """Test that outputs referring to a stored video are linked without decoding anything."""
+    from notebook_assets import ASSET_REFERENCE_MIME, get_store
+
+    env = setup_test_environment
+    root_dir = env['temp_dir']
+    store = get_store(env['static_dir'] / "notebooks")
+    tmp_path = store.new_temp_path(".mp4")
+    tmp_path.write_bytes(b"not really a video")
+    blob = store.add_file(tmp_path, move=True)
+    assert not tmp_path.exists() and store.get_render("key") is None
+    store.put_render("key", blob)
+    assert store.get_render("key") == blob
+
+    src = f"../_intermediate/static/img/notebooks/.store/blobs/{blob}"
+    html = f'<video playsinline controls class="retina">\n  <source src="{src}" type="video/mp4">\n</video>\n'
+    nb = nbformat.v4.new_notebook()
+    nb.cells = [nbformat.v4.new_code_cell("show_animation_video_base64(ani, embed=False)", outputs=[
+        nbformat.v4.new_output("display_data", data={"text/html": html, ASSET_REFERENCE_MIME: {"blob": blob, "src": src}}),
+    ])]
+    notebook_path = root_dir / "clip.ipynb"
+    nbformat.write(nb, notebook_path)
+
+    output_path, = convert_notebook(notebook_path, root_dir, root_dir)
+    content = output_path.read_text()
+    assert f'<source src="/docs/img/notebooks/clip/{blob}" type="video/mp4">' in content
+    assert src not in content and ASSET_REFERENCE_MIME not in content
+    assert os.path.samefile(store.notebooks_dir / "clip" / blob, store.blobs_dir / blob)
+
+    # Rendered blobs survive garbage collection even when no page uses them
+    output_path.unlink()
+    store.gc()
+    assert (store.blobs_dir / blob).exists()
+
+
+class FakeAnimation:
+    """Stands in for a FuncAnimation, writing fixed bytes instead of encoding with ffmpeg."""
+
+    def __init__(self, fig, frames=3, video=b"encoded video"):
+        self._fig = fig
+        self._save_count = frames
+        self.video = video
+        self.saves = 0
+
+    def save(self, path, writer=None, fps=None, dpi=None):
+        self.saves += 1
+        Path(path).write_bytes(self.video)
+
+
+def test_stored_animations_convert_without_the_store(setup_test_environment, monkeypatch):
+    """Test that videos shown with embed=False are linked from the store, or decoded from their fallback where it is missing."""
+    import base64
+    pytest.importorskip("IPython")
+    import IPython.display
+    import matplotlib.pyplot as plt
+    import utils
+    from notebook_assets import ASSET_REFERENCE_MIME
+
+    env = setup_test_environment
+    root_dir = env['temp_dir']
+    monkeypatch.setenv("NOTEBOOK_ASSETS_DIR", str(env['static_dir'] / "notebooks"))
+    monkeypatch.chdir(root_dir)
+    displayed = []
+    monkeypatch.setattr(IPython.display, "display", lambda obj, raw=False: displayed.append(obj))
+
+    fig = plt.figure()
+    try:
+        utils.show_animation_video_base64(FakeAnimation(fig), embed=False, cache=False)
+        utils.show_animation_video_base64(FakeAnimation(fig), embed=False, cache=False, fallback=True)
+    finally:
+        plt.close(fig)
+    reference_only, bundle = displayed
+    # By default the output only refers to the stored video
+    assert set(reference_only) == {"text/html", ASSET_REFERENCE_MIME}
+    reference = bundle[ASSET_REFERENCE_MIME]
+    blob = reference["blob"]
+    assert reference_only[ASSET_REFERENCE_MIME] == {"blob": blob, "src": reference["src"]}
+    assert reference["fallback"] == "video/mp4" and base64.b64decode(bundle["video/mp4"]) == b"encoded video"
+    assert f'src="{reference["src"]}"' in bundle["text/html"]
+
+    def write_notebook(directory, data):
+        nb = nbformat.v4.new_notebook()
+        nb.cells = [nbformat.v4.new_code_cell("show_animation_video_base64(ani, embed=False)", outputs=[
+            nbformat.v4.new_output("display_data", data=data),
+        ])]
+        nbformat.write(nb, directory / "clip.ipynb")
+        return directory / "clip.ipynb"
+
+    output_path, = convert_notebook(write_notebook(root_dir, bundle), root_dir, root_dir)
+    content = output_path.read_text()
+    assert f'<source src="/docs/img/notebooks/clip/{blob}" type="video/mp4">' in content
+    assert bundle["video/mp4"] not in content
+    assert convert_notebook(write_notebook(root_dir, reference_only), root_dir, root_dir) == [output_path]
+    assert output_path.read_text() == content
+
+    # A fresh checkout has no asset store, so only the embedded copy can be converted
+    fresh_dir = root_dir / "fresh"
+    fresh_dir.mkdir()
+    with pytest.raises(ValueError, match="fallback=True"):
+        convert_notebook(write_notebook(fresh_dir, reference_only), fresh_dir, fresh_dir)
+    fresh_path, = convert_notebook(write_notebook(fresh_dir, bundle), fresh_dir, fresh_dir)
+    assert fresh_path.read_text() == content
+    assert (fresh_dir / "_intermediate" / "static" / "img" / "notebooks" / "clip" / blob).read_bytes() == b"encoded video"
+
+
+@pytest.fixture
+def render_cache(setup_test_environment, monkeypatch):
+    """Point the render cache of `utils` at a temporary directory and capture displayed outputs."""
+    pytest.importorskip("IPython")
+    import IPython.display
+    import utils
+
+    for name in ["RENDER_CACHE_ENABLED", "RENDER_CACHE_DIR", "RENDER_CACHE_MAX_BYTES"]:
+        monkeypatch.setattr(utils, name, getattr(utils, name))
+    monkeypatch.setattr(utils, "RENDER_CACHE_STATS", {"hits": 0, "misses": 0, "evictions": 0})
+    utils.set_render_cache(enabled=True, cache_dir=setup_test_environment['temp_dir'] / "render-cache")
+    displayed = []
+    monkeypatch.setattr(IPython.display, "display", lambda obj, raw=False: displayed.append(obj))
+    return displayed
+
+
+def test_render_cache_hits_misses_and_bypass(render_cache):
+    """Test that keyed figures are rendered again when their data, ticks or tick labels change, and not otherwise."""
+    import matplotlib.pyplot as plt
+    from matplotlib.ticker import PercentFormatter
+    import utils
+
+    fig, ax = plt.subplots()
+    try:
+        ax.plot([0, 1, 2], [0.1, 0.5, 0.2])
+        # Figures without a cache key are rendered every time
+        utils.show_fig_svg(fig)
+        assert utils.render_cache_stats()["misses"] == 0 and utils.render_cache_stats()["entries"] == 0
+
+        utils.show_fig_svg(fig, cache_key="line")
+        utils.show_fig_svg(fig, cache_key="line")
+        assert utils.render_cache_stats()["hits"] == 1 and utils.render_cache_stats()["misses"] == 1
+        assert render_cache[1].data == render_cache[2].data
+
+        ax.set_xticks([0, 0.5, 1, 1.5, 2])
+        utils.show_fig_svg(fig, cache_key="line")
+        ax.yaxis.set_major_formatter(PercentFormatter(1.0))
+        utils.show_fig_svg(fig, cache_key="line")
+        assert utils.render_cache_stats()["misses"] == 3
+        assert "%" in render_cache[-1].data and "%" not in render_cache[-2].data
+
+        # Bypassing the cache neither reads nor stores anything
+        utils.show_fig_svg(fig, cache_key="line", cache=False)
+        utils.set_render_cache(enabled=False)
+        utils.show_fig_svg(fig, cache_key="line")
+        stats = utils.render_cache_stats()
+        assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 3, 3)
+    finally:
+        plt.close(fig)
+
+
+def test_render_cache_only_caches_animations_with_a_key(render_cache):
+    """Test that animations are encoded every time unless a cache key identifies what they draw."""
+    import matplotlib.pyplot as plt
+    import utils
+
+    fig = plt.figure()
+    try:
+        ani = FakeAnimation(fig)
+        utils.show_animation_video_base64(ani)
+        utils.show_animation_video_base64(ani)
+        assert ani.saves == 2 and utils.render_cache_stats()["entries"] == 0
+
+        utils.show_animation_video_base64(ani, cache_key="seed=1")
+        utils.show_animation_video_base64(ani, cache_key="seed=1")
+        utils.show_animation_video_base64(ani, cache_key="seed=2")
+        assert ani.saves == 4
+        stats = utils.render_cache_stats()
+        assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 2, 2)
+        assert len({output.data for output in render_cache}) == 1
+    finally:
+        plt.close(fig)
+
+
+def test_render_cache_evicts_least_recently_used(render_cache):
+    """Test that the cache evicts the least recently used entries once it exceeds its size limit."""
+    import utils
+
+    utils.set_render_cache(max_bytes=250)
+    for i, key in enumerate(["first", "second"]):
+        tmp_path = utils._cache_temp_path(".svg")
+        tmp_path.write_bytes(b"x" * 100)
+        os.utime(utils._cache_store(key, ".svg", tmp_path), (i, i))
+    # Looking an entry up marks it as recently used
+    assert utils._cache_lookup("first", ".svg") is not None
+
+    tmp_path = utils._cache_temp_path(".svg")
+    tmp_path.write_bytes(b"x" * 100)
+    utils._cache_store("third", ".svg", tmp_path)
+    assert utils._cache_lookup("second", ".svg") is None
+    assert utils._cache_lookup("first", ".svg") is not None and utils._cache_lookup("third", ".svg") is not None
+    stats = utils.render_cache_stats()
+    assert (stats["evictions"], stats["entries"], stats["bytes"]) == (1, 2, 200)
+
+
+def test_assets_are_published_incrementally(setup_test_environment):
+    """Test that converted notebooks publish their assets and unused ones are unpublished."""
+    from convert_all_notebooks import convert_all_notebooks
+
+    env = setup_test_environment
+    root_dir = env['temp_dir']
+    docs_dir = root_dir / "docs"
+    docs_dir.mkdir()
+    notebook_path = docs_dir / "single-page.ipynb"
+    shutil.copy(env['notebooks_dir'] / "single-page.ipynb", notebook_path)
+
+    stats = convert_all_notebooks(root_dir)
+    published_dir = root_dir / "static" / "img" / "notebooks" / "single-page"
+    published, = published_dir.glob("*.png")
+    assert stats["published"] == 1
+    assert os.path.samefile(published, env['static_dir'] / "notebooks" / "single-page" / published.name)
+
+    # Skipped notebooks publish nothing, unless the published assets are gone
+    assert convert_all_notebooks(root_dir)["published"] == 0
+    shutil.rmtree(root_dir / "static" / "img" / "notebooks")
+    assert convert_all_notebooks(root_dir)["published"] == 1
+
+    # Copies are republished when the source is replaced, even with the same size
+    from notebook_assets import publish_assets
+
+    source = env['static_dir'] / "notebooks" / "single-page" / published.name
+    published.unlink()
+    shutil.copy2(source, published)
+    assert publish_assets([source], env['static_dir'], root_dir / "static" / "img") == 0
+    replacement = source.with_name(".replacement")
+    replacement.write_bytes(bytes(reversed(source.read_bytes())))
+    os.replace(replacement, source)
+    assert publish_assets([source], env['static_dir'], root_dir / "static" / "img") == 1
+    assert published.read_bytes() == source.read_bytes()
+
+    # Assets no page uses any more are unpublished
+    nb = nbformat.read(notebook_path, as_version=4)
+    for cell in nb.cells:
+        if cell.cell_type == "code":
+            cell.outputs = []
+    nbformat.write(nb, notebook_path)
+    stats = convert_all_notebooks(root_dir)
+    assert stats["success"] == 1 and stats["unpublished"] == 1
+    assert not published_dir.exists()
+
+
+def test_synthetic_notebook_benchmark(setup_test_environment):
+    """Test that synthetic notebooks have the requested shape and the benchmark suite runs on them."""
+    from notebook_benchmark import generate_notebook, run_suite
+    from notebook_utils import NotebookLayout
+
+    nb = generate_notebook(cells=20, pagebreaks=3, png_bytes=2000, svg_bytes=1000, video_bytes=1000,
+                           stream_bytes=500, hidden_ratio=0.5)
+    nbformat.validate(nb)
+    layout = NotebookLayout(nb)
+    assert layout.chapter_index == 0 and len(layout.pagebreak_indices) == 3
+    code_cells = [cell for cell in nb.cells if cell.cell_type == "code"]
+    assert len(code_cells) == 10 and any(cell.metadata.get("hide") for cell in code_cells)
+    mime_types = {mime for cell in code_cells for output in cell.outputs for mime in output.get("data", {})}
+    assert {"image/png", "image/svg+xml", "text/html"} <= mime_types
+
+    env = setup_test_environment
+    notebook_path = env['temp_dir'] / "synthetic.ipynb"
+    nbformat.write(nb, notebook_path)
+    records = run_suite([notebook_path], ["convert_notebook", "preprocessors"], repeat=1, isolate=False)
+    assert [r["name"] for r in records][:2] == ["convert_notebook (cold)", "convert_notebook (warm)"]
+    assert "CellRewriter" in [r["name"] for r in records]
+    assert all(r["seconds"] > 0 and r["peak_rss_mb"] > 0 for r in records)
+
+
+def test_stage_timers_and_profiles(setup_test_environment):
+    """Test that conversions report stage times and byte counts and write a profile per notebook."""
+    import json
+    from convert_all_notebooks import convert_all_notebooks
+
+    env = setup_test_environment
+    root_dir = env['temp_dir']
+    docs_dir = root_dir / "docs"
+    docs_dir.mkdir()
+    shutil.copy(env['notebooks_dir'] / "single-page.ipynb", docs_dir / "single-page.ipynb")
+    shutil.copy(env['notebooks_dir'] / "multi-page.ipynb", docs_dir / "multi-page.ipynb")
+    profile_dir = root_dir / "profiles"
+
+    stats = convert_all_notebooks(root_dir, jobs=1, profile_dir=profile_dir, profile_format="trace")
+    assert stats["success"] == 2
+    assert {"read", "preprocess", "render", "write"} <= set(stats["stages"])
+    record = next(r for r in stats["notebooks"] if r["path"] == "docs/single-page.ipynb")
+    assert record["error"] is None
+    assert record["duration"] >= sum(record["stages"].values()) > 0
+    assert record["notebook_bytes"] == (docs_dir / "single-page.ipynb").stat().st_size
+    assert stats["bytes"]["mdx"] == sum(r["mdx_bytes"] for r in stats["notebooks"])
+    assert stats["bytes"]["assets"] == sum(r["new_asset_bytes"] for r in stats["notebooks"]) > 0
+
+    trace = json.loads((profile_dir / "docs__single-page.trace.json").read_text())
+    names = {event["name"] for event in trace["traceEvents"]}
+    assert {"read", "preprocess", "assets", "render", "write", "convert"} <= names
+
+    convert_all_notebooks(root_dir, force=True, jobs=1, profile_dir=profile_dir)
+    assert (profile_dir / "docs__multi-page.prof").exists()
+
+
+def test_build_report_and_diff(setup_test_environment):
+    """Test that build reports record each notebook and that diffs flag regressions."""
+    from convert_all_notebooks import convert_all_notebooks
+    from notebook_report import diff_reports, read_report, write_report
+
+    env = setup_test_environment
+    root_dir = env['temp_dir']
+    docs_dir = root_dir / "docs"
+    docs_dir.mkdir()
+    shutil.copy(env['notebooks_dir'] / "single-page.ipynb", docs_dir / "single-page.ipynb")
+    shutil.copy(env['notebooks_dir'] / "multi-page.ipynb", docs_dir / "multi-page.ipynb")
+
+    write_report(root_dir / "first.ndjson", convert_all_notebooks(root_dir, jobs=1))
+    first, totals = read_report(root_dir / "first.ndjson")
+    assert totals["success"] == 2 and "notebooks" not in totals
+    record = first["docs/single-page.ipynb"]
+    assert record["status"] == "converted" and record["pages"] == 1 and record["error"] is None
+    assert record["mdx_bytes"] == (docs_dir / "single-page.mdx").stat().st_size
+    assert record["new_assets"] == 1 and record["reused_assets"] == 0 and record["new_asset_bytes"] > 0
+
+    write_report(root_dir / "second.ndjson", convert_all_notebooks(root_dir, jobs=1))
+    second, _ = read_report(root_dir / "second.ndjson")
+    record = second["docs/single-page.ipynb"]
+    assert record["status"] == "skipped" and record["pages"] == 1
+    assert record["new_assets"] == 0 and record["reused_asset_bytes"] == first["docs/single-page.ipynb"]["new_asset_bytes"]
+    assert diff_reports(first, second) == []
+
+    # Reconverting reuses the assets of the previous build
+    third = {r["path"]: r for r in convert_all_notebooks(root_dir, force=True, jobs=1)["notebooks"]}
+    assert third["docs/single-page.ipynb"]["reused_assets"] == 1
+
+    slower = {path: dict(r, duration=r["duration"] + 1.0, mdx_bytes=r["mdx_bytes"] * 2) for path, r in third.items()}
+    slower["docs/multi-page.ipynb"]["status"] = "failed"
+    regressions = {(r["path"], r["metric"]) for r in diff_reports(third, slower)}
+    assert regressions == {
+        ("docs/single-page.ipynb", "duration"), ("docs/single-page.ipynb", "mdx_bytes"),
+        ("docs/multi-page.ipynb", "status"),
+    }
+
+
+def test_page_weight_budgets(setup_test_environment):
+    """Test that pages are weighed with the assets they load and checked against budgets."""
+    from convert_all_notebooks import convert_all_notebooks
+    from notebook_weight import page_assets
+
+    content = (
+        '<picture>\n<source srcSet="/docs/img/notebooks/nb/a.avif" type="image/avif" />\n'
+        '<source srcSet="/docs/img/notebooks/nb/a.webp" type="image/webp" />\n'
+        '<img src="/docs/img/notebooks/nb/a.png" />\n</picture>\n'
+        '<a href="/docs/img/notebooks/nb/big.svg">\n<picture>\n<img src="/docs/img/notebooks/nb/big.png" />\n</picture>\n</a>\n'
+        '![](/img/notebooks/nb/b.svg) ![](/img/notebooks/nb/b.svg)'
+    )
+    assert page_assets(content) == ["nb/a.avif", "nb/big.png", "nb/b.svg"]
+
+    env = setup_test_environment
+    root_dir = env['temp_dir']
+    docs_dir = root_dir / "docs"
+    docs_dir.mkdir()
+    shutil.copy(env['notebooks_dir'] / "single-page.ipynb", docs_dir / "single-page.ipynb")
+
+    stats = convert_all_notebooks(root_dir, jobs=1, budgets={"page": 1 << 30, "notebook": 1 << 30})
+    (page, total), = stats["heaviest_pages"]
+    asset, = (env['static_dir'] / "notebooks" / "single-page").glob("*.png")
+    assert page == "docs/single-page.mdx"
+    assert total == (docs_dir / "single-page.mdx").stat().st_size + asset.stat().st_size
+    assert stats["over_budget"] == []
+
+    # Skipped notebooks are checked too
+    stats = convert_all_notebooks(root_dir, budgets={"page": total - 1, "notebook": total})
+    assert stats["skipped"] == 1
+    warning, = stats["over_budget"]
+    assert "single-page.mdx" in warning and asset.name in warning
+
+
+def test_notebook_discovery_prunes_and_uses_git(setup_test_environment, monkeypatch):
+    """Test that discovery skips excluded trees and that the git and walking engines agree."""
+    import subprocess
+    import notebook_discovery
+    from notebook_discovery import find_notebooks
+
+    root_dir = setup_test_environment['temp_dir'] / "site"
+    for rel_path in [
+        "docs/a.ipynb", "docs/sub/b.ipynb", "docs/drafts/c.ipynb", "docs/.ipynb_checkpoints/a-checkpoint.ipynb",
+        "docs/.hidden.ipynb", "tests/d.ipynb", "node_modules/pkg/e.ipynb", "build/f.ipynb", "docs/build/g.ipynb",
+        "docs/notes.md",
+    ]:
+        (root_dir / rel_path).parent.mkdir(parents=True, exist_ok=True)
+        (root_dir / rel_path).write_text("{}")
+
+    walked = []
+    real_walk = os.walk
+    def recording_walk(top, *args, **kwargs):
+        for root, dirs, files in real_walk(top, *args, **kwargs):
+            walked.append(Path(root).relative_to(root_dir).as_posix())
+            yield root, dirs, files
+
+    expected = ["docs/a.ipynb", "docs/build/g.ipynb", "docs/drafts/c.ipynb", "docs/sub/b.ipynb"]
+    monkeypatch.setattr(notebook_discovery.os, "walk", recording_walk)
+    found = find_notebooks(root_dir, use_git=False)
+    monkeypatch.undo()
+    assert [p.relative_to(root_dir).as_posix() for p in found] == expected
+    assert not {"tests", "node_modules", "build", "docs/.ipynb_checkpoints"} & set(walked)
+
+    found = find_notebooks(root_dir, exclude=notebook_discovery.DEFAULT_EXCLUDE + ["docs/drafts"], use_git=False)
+    assert "docs/drafts/c.ipynb" not in [p.relative_to(root_dir).as_posix() for p in found]
+    found = find_notebooks(root_dir, include=["docs/sub/**"], use_git=False)
+    assert [p.relative_to(root_dir).as_posix() for p in found] == ["docs/sub/b.ipynb"]
+
+    if shutil.which("git"):
+        subprocess.run(["git", "init", "-q"], cwd=root_dir, check=True)
+        (root_dir / ".gitignore").write_text("ignored/\n")
+        (root_dir / "ignored").mkdir()
+        (root_dir / "ignored" / "h.ipynb").write_text("{}")
+        assert [p.relative_to(root_dir).as_posix() for p in find_notebooks(root_dir, use_git=True)] == expected
+
+
+def test_dry_run_does_not_import_nbconvert(setup_test_environment):
+    """Test that listing notebooks does not load nbconvert."""
+    import subprocess
+
+    script = Path(__file__).parent.parent / "scripts" / "convert_all_notebooks.py"
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", str(script), str(setup_test_environment['temp_dir']), "--dry-run"],
+        capture_output=True, text=True, check=True
+    )
+    assert "Found" in result.stdout
+    assert "nbconvert" not in result.stderr
+
+
+def test_conversion_server_and_fallback(setup_test_environment):
+    """Test that the client converts through a running server and in-process without one."""
+    import subprocess
+    import time
+    from notebook_convert import set_bytecode_cache_dir
+    from notebook_daemon import SOCKET_PATH, convert
+
+    env = setup_test_environment
+    root_dir = env['temp_dir']
+    docs_dir = root_dir / "docs"
+    docs_dir.mkdir()
+    notebook_path = docs_dir / "single-page.ipynb"
+    shutil.copy(env['notebooks_dir'] / "single-page.ipynb", notebook_path)
+
+    response = convert(notebook_path, root_dir)
+    assert not response["served"] and response["error"] is None
+    expected = (docs_dir / "single-page.mdx").read_text()
+
+    script = Path(__file__).parent.parent / "scripts" / "notebook_daemon.py"
+    server = subprocess.Popen([sys.executable, str(script), "serve", str(root_dir)], stdout=subprocess.DEVNULL)
+    try:
+        deadline = time.monotonic() + 60
+        while not (root_dir / SOCKET_PATH).exists():
+            assert server.poll() is None and time.monotonic() < deadline
+            time.sleep(0.05)
+        (docs_dir / "single-page.mdx").unlink()
+        response = convert(notebook_path, root_dir, publish=True)
+        assert response["served"] and response["error"] is None
+        assert response["output_paths"] == [str(docs_dir.resolve() / "single-page.mdx")]
+        assert (docs_dir / "single-page.mdx").read_text() == expected
+        assert response["published"] == 1
+
+        # Assets deleted by another process are recreated
+        shutil.rmtree(env['static_dir'] / "notebooks")
+        response = convert(notebook_path, root_dir, args=["--hash", "md5"])
+        assert response["served"] and response["error"] is None
+        assert len(list((env['static_dir'] / "notebooks" / "single-page").glob("*.png"))) == 1
+
+        response = convert(notebook_path, root_dir, args=["--no-such-option"])
+        assert response["served"] and response["error"].startswith("Invalid options")
+    finally:
+        server.terminate()
+        server.wait()
+    assert not (root_dir / SOCKET_PATH).exists()
+    assert not convert(notebook_path, root_dir)["served"]
+    # In-process conversions enable the Jinja cache of their root directory
+    set_bytecode_cache_dir(None)
+
+
+REPO_DIR = Path(__file__).parent.parent
+ENGINE_NOTEBOOKS = sorted(
+    str(path.relative_to(REPO_DIR))
+    for directory in ("docs", "tests")
+    for path in (REPO_DIR / directory).rglob("*.ipynb")
+    if ".ipynb_checkpoints" not in path.parts
+)
+
+
+def _convert_with_engines(notebook_path: Path, temp_dir: Path):
+    """Convert a notebook in a new root with each engine and return the outputs by engine."""
+    import notebook_render
+
+    results = {}
+    for engine in notebook_render.ENGINES:
+        docs_dir = temp_dir / engine / "docs"
+        docs_dir.mkdir(parents=True)
+        path = docs_dir / notebook_path.name
+        shutil.copy(notebook_path, path)
+        notebook_render.set_engine(engine)
+        try:
+            output_paths = convert_notebook(path, docs_dir, temp_dir / engine)
+        finally:
+            notebook_render.set_engine("nbconvert")
+        static_dir = temp_dir / engine / "_intermediate" / "static" / "img" / "notebooks"
+        results[engine] = {
+            "pages": {str(p.relative_to(docs_dir)): p.read_text() for p in output_paths},
+            "assets": sorted(str(p.relative_to(static_dir)) for p in static_dir.rglob("*") if ".store" not in p.parts),
+        }
+    return results
+
+
+@pytest.mark.parametrize("notebook", ENGINE_NOTEBOOKS)
+def test_native_engine_matches_nbconvert(setup_test_environment, notebook):
+    """Test that the native renderer writes the same pages and assets as the nbconvert exporter."""
+    results = _convert_with_engines(REPO_DIR / notebook, setup_test_environment['temp_dir'])
+    assert results["native"]["pages"], "No pages were written"
+    assert results["native"] == results["nbconvert"]
+
+
+def test_converter_fingerprint_covers_imported_modules():
+    """Test that every converter module that shapes the output is part of the build fingerprint."""
+    import ast
+    from notebook_manifest import CONVERTER_SOURCES, SCRIPTS_DIR
+
+    tree = ast.parse((SCRIPTS_DIR / "notebook_convert.py").read_text())
+    imported = {
+        node.module if isinstance(node, ast.ImportFrom) else alias.name
+        for node in ast.walk(tree) if isinstance(node, (ast.Import, ast.ImportFrom))
+        for alias in node.names
+    }
+    # Timing, the manifest itself and the --serve command do not affect the generated pages
+    modules = {name for name in imported if name and (SCRIPTS_DIR / f"{name}.py").exists()}
+    modules -= {"notebook_profile", "notebook_manifest", "notebook_daemon"}
+    assert "notebook_render" in modules
+    assert {SCRIPTS_DIR / f"{name}.py" for name in modules} <= set(CONVERTER_SOURCES)
+
+
+@pytest.mark.parametrize("image_formats", [[], ["webp"]])
+def test_native_engine_matches_nbconvert_on_all_blocks(setup_test_environment, monkeypatch, image_formats):
+    """Test both engines on every kind of cell and output the template renders, with and without <picture>s."""
+    import base64
+    import io
+    PIL_Image = pytest.importorskip("PIL.Image")
+    import notebook_images
+
+    monkeypatch.setattr(notebook_images, "IMAGE_FORMATS", [])
+    notebook_images.set_image_formats(image_formats)
+
+    image = PIL_Image.new("RGB", (40, 20), "white")
+    png, jpeg = io.BytesIO(), io.BytesIO()
+    image.save(png, "PNG")
+    image.save(jpeg, "JPEG")
+    png, jpeg = base64.b64encode(png.getvalue()).decode(), base64.b64encode(jpeg.getvalue()).decode()
+
+    nb = nbformat.v4.new_notebook(metadata={"kernelspec": {"name": "python3", "display_name": "Python 3", "language": "python"}})
+    nb.cells = [
+        nbformat.v4.new_markdown_cell("# Title\n\nText with <tags> and ![pic](attachment:pic.png)",
+                                      attachments={"pic.png": {"image/png": png}}),
+        nbformat.v4.new_markdown_cell("Removed", metadata={"transient": {"remove_source": True}}),
+        nbformat.v4.new_raw_cell("<b>raw html</b>", metadata={"raw_mimetype": "text/html"}),
+        nbformat.v4.new_raw_cell("\\LaTeX", metadata={"raw_mimetype": "text/latex"}),
+        nbformat.v4.new_raw_cell("plain raw"),
+        nbformat.v4.new_code_cell("%%bash\necho hi", outputs=[
+            nbformat.v4.new_output("stream", name="stdout", text="hi\n\n"),
+            nbformat.v4.new_output("stream", name="stderr", text="warning <b>\n"),
+        ]),
+        nbformat.v4.new_code_cell("x = 1\nx", metadata={"title": "example.py"}, outputs=[
+            nbformat.v4.new_output("execute_result", data={"text/plain": "1  "}, execution_count=1),
+        ]),
+        nbformat.v4.new_code_cell("%%sql\nSELECT 1", metadata={"title": "query"}),
+        nbformat.v4.new_code_cell("", outputs=[nbformat.v4.new_output("stream", text="no input")]),
+        nbformat.v4.new_code_cell("display()", outputs=[
+            nbformat.v4.new_output("display_data", data={"text/latex": "$x^2$", "text/plain": "x^2"}),
+            nbformat.v4.new_output("display_data", data={"text/markdown": "**bold**", "text/plain": "bold"}),
+            nbformat.v4.new_output("display_data", data={"image/png": png, "text/plain": "<Figure>"}),
+            nbformat.v4.new_output("display_data", data={"image/jpeg": jpeg}),
+            nbformat.v4.new_output("display_data", data={"image/svg+xml": "<svg><rect/></svg>"}),
+            nbformat.v4.new_output("execute_result", data={"text/html": "  <table>\n  </table>", "text/plain": "df"}),
+            nbformat.v4.new_output("display_data", data={"application/json": {"a": 1}}),
+        ]),
+        nbformat.v4.new_code_cell("1 / 0", outputs=[
+            nbformat.v4.new_output("error", ename="ZeroDivisionError", evalue="division by zero", traceback=[
+                "\x1b[0;31mZeroDivisionError\x1b[0m   Traceback  ", "\x1b[1;32m----> 1\x1b[0m 1 / 0",
+            ]),
+        ]),
+        nbformat.v4.new_code_cell("hidden()", metadata={"transient": {"remove_source": True}}, outputs=[
+            nbformat.v4.new_output("stream", text="output of hidden input"),
+        ]),
+    ]
+    temp_dir = setup_test_environment['temp_dir']
+    notebook_path = temp_dir / "blocks.ipynb"
+    nbformat.write(nb, notebook_path)
+
+    results = _convert_with_engines(notebook_path, temp_dir)
+    page = results["native"]["pages"]["blocks.mdx"]
+    for block in ("```bash", '```sql title="query"', '<CodeOutputImageBlock class="svg">', "<HTMLOutputBlock>"):
+        assert block in page
+    assert ("<picture>" in page) == bool(image_formats)
+    assert results["native"] == results["nbconvert"]
+
+
+def test_assets_are_written_in_background_and_failures_fail_the_notebook(setup_test_environment, monkeypatch):
+    """Test that assets are written by the writer threads and that a failed write fails the conversion."""
+    import errno
+    import threading
+    from notebook_assets import AssetStore
+
+    env = setup_test_environment
+    root_dir = env['temp_dir']
+    notebook_path = root_dir / "single-page.ipynb"
+    shutil.copy(env['notebooks_dir'] / "single-page.ipynb", notebook_path)
+    assets_dir = env['static_dir'] / "notebooks" / "single-page"
+
+    def disk_full(self, tmp_path, blob, size):
+        os.unlink(tmp_path)
+        raise OSError(errno.ENOSPC, "No space left on device")
+
+    monkeypatch.setattr(AssetStore, "_install", disk_full)
+    with pytest.raises(OSError, match="No space left"):
+        convert_notebook(notebook_path, root_dir, root_dir)
+    assert not list(assets_dir.glob("*.png"))
+
+    # The failed blob is not assumed to exist by the next conversion in this process
+    monkeypatch.undo()
+    threads = set()
+    install = AssetStore._install
+
+    def recording_install(self, tmp_path, blob, size):
+        threads.add(threading.current_thread().name)
+        install(self, tmp_path, blob, size)
+
+    monkeypatch.setattr(AssetStore, "_install", recording_install)
+    output_path, = convert_notebook(notebook_path, root_dir, root_dir)
+    png, = assets_dir.glob("*.png")
+    assert png.name in output_path.read_text()
+    assert threads and all(name.startswith("asset-writer") for name in threads)